@@ -0,0 +1,66 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+# the app builds its engines and runs its migrations at import, so the test database has to be set first
+_db_dir = tempfile.mkdtemp(prefix='triage-tests-')
+_db_path = os.path.join(_db_dir, 'triage.db')
+os.environ['SQLALCHEMY_DATABASE_URL'] = f'sqlite:///{_db_path}'
+os.environ['SQLALCHEMY_ASYNC_DATABASE_URL'] = f'sqlite+aiosqlite:///{_db_path}'
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('SECURITY_PASSWORD_SALT', 'test-salt')
+# keeps password hashing fast in tests
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+import triage_app.main  # noqa: E402
+from triage_app import models  # noqa: E402
+from triage_app.crud import create_token  # noqa: E402
+from triage_app.database import SessionLocal, async_engine  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def dispose_async_engine():
+    yield
+    # aiosqlite runs each connection on a non daemon thread, pooled ones would keep the interpreter from exiting
+    if async_engine is not None:
+        asyncio.run(async_engine.dispose())
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client():
+    # outside a with block the lifespan, and the workers it starts, never runs
+    return TestClient(triage_app.main.app)
+
+
+@pytest.fixture
+def agent_headers(db):
+    # bearer headers for the seeded agent, as an admin or not
+    def headers(admin: int = 1, agent_id: int = 1):
+        version = db.query(models.Agent.token_version).filter(models.Agent.agent_id == agent_id).scalar()
+        token = create_token({'agent_id': agent_id, 'admin': admin, 'type': 'access', 'ver': version})
+        return {'Authorization': f'Bearer {token}'}
+    return headers
+
+
+@pytest.fixture
+def mailbox(db):
+    db_email = models.Email(email='support@example.com', password='unused', email_from_name='Support',
+                            mail_server='smtp.example.com', imap_server='127.0.0.1', imap_active_status=1,
+                            uid_max=0, banned_emails='[]')
+    db.add(db_email)
+    db.commit()
+    yield db_email
+    db.query(models.Email).filter(models.Email.email_id == db_email.email_id).update({'imap_active_status': 0})
+    db.commit()
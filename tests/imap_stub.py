@@ -0,0 +1,148 @@
+import re
+import socket
+import socketserver
+import threading
+import time
+
+
+class IMAPStub:
+    # a single mailbox imap server on localhost, just enough of the protocol for imaplib and the poller:
+    # LOGIN, SELECT, UID SEARCH, UID FETCH, NOOP, IDLE and LOGOUT. drop() cuts every open connection
+
+    def __init__(self, capabilities=('IMAP4rev1', 'IDLE')):
+        self.capabilities = ' '.join(capabilities)
+        self.messages = []
+        self.logins = 0
+        self.idles = 0
+        self._changed = threading.Condition()
+        self._clients = set()
+        stub = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                stub._serve(self.request)
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.drop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def deliver(self, raw: bytes):
+        with self._changed:
+            uid = len(self.messages) + 1
+            self.messages.append((uid, raw))
+            self._changed.notify_all()
+        return uid
+
+    def drop(self):
+        with self._changed:
+            clients = list(self._clients)
+        for sock in clients:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def wait_for(self, predicate, timeout: float = 10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.05)
+        return predicate()
+
+    def _serve(self, sock):
+        with self._changed:
+            self._clients.add(sock)
+        reader = sock.makefile('rb')
+        send = sock.sendall
+        try:
+            send(f'* OK [CAPABILITY {self.capabilities}] stub ready\r\n'.encode())
+            while True:
+                line = reader.readline()
+                if not line:
+                    return
+                tag, command, *args = line.decode().rstrip('\r\n').split(' ', 2)
+                command = command.upper()
+                if command == 'CAPABILITY':
+                    send(f'* CAPABILITY {self.capabilities}\r\n'.encode())
+                elif command == 'LOGIN':
+                    with self._changed:
+                        self.logins += 1
+                elif command == 'SELECT':
+                    send(f'* {len(self.messages)} EXISTS\r\n* OK [UIDVALIDITY 1] ok\r\n'.encode())
+                    send(f'{tag} OK [READ-WRITE] SELECT completed\r\n'.encode())
+                    continue
+                elif command == 'UID':
+                    self._uid(send, args[0] if args else '')
+                elif command == 'IDLE':
+                    if not self._idle(sock, reader, send):
+                        return
+                elif command == 'LOGOUT':
+                    send(b'* BYE logging out\r\n')
+                    send(f'{tag} OK LOGOUT completed\r\n'.encode())
+                    return
+                elif command != 'NOOP':
+                    send(f'{tag} BAD unknown command\r\n'.encode())
+                    continue
+                send(f'{tag} OK {command} completed\r\n'.encode())
+        except OSError:
+            pass
+        finally:
+            with self._changed:
+                self._clients.discard(sock)
+            sock.close()
+
+    def _uid(self, send, args: str):
+        subcommand, _, rest = args.partition(' ')
+        with self._changed:
+            messages = list(self.messages)
+        if subcommand.upper() == 'SEARCH':
+            match = re.search(r'UID (\d+):\*', rest)
+            uids = [uid for uid, _ in messages if not match or uid >= int(match.group(1))]
+            # like a real server, n:* always matches the newest message
+            if match and not uids and messages:
+                uids = [messages[-1][0]]
+            send(('* SEARCH ' + ' '.join(map(str, uids))).rstrip().encode() + b'\r\n')
+        elif subcommand.upper() == 'FETCH':
+            first, last = (int(n) for n in rest.split(' ', 1)[0].split(':'))
+            for seq, (uid, raw) in enumerate(messages, 1):
+                if first <= uid <= last:
+                    send(f'* {seq} FETCH (UID {uid} BODY[] {{{len(raw)}}}\r\n'.encode() + raw + b')\r\n')
+
+    def _idle(self, sock, reader, send):
+        # pushes EXISTS as soon as mail arrives, until the client ends the idle with DONE
+        with self._changed:
+            self.idles += 1
+            seen = len(self.messages)
+        send(b'+ idling\r\n')
+        done = threading.Event()
+
+        def wait_done():
+            line = reader.readline()
+            done.set()
+            with self._changed:
+                self._changed.notify_all()
+            return line
+
+        result = {}
+        waiter = threading.Thread(target=lambda: result.setdefault('line', wait_done()), daemon=True)
+        waiter.start()
+        while not done.is_set():
+            with self._changed:
+                self._changed.wait(0.1)
+                count = len(self.messages)
+            if count > seen:
+                seen = count
+                send(f'* {count} EXISTS\r\n'.encode())
+        waiter.join()
+        return result.get('line', b'').strip().upper() == b'DONE'
@@ -0,0 +1,126 @@
+import os
+from email.message import EmailMessage
+
+import boto3
+import pytest
+from fastapi import BackgroundTasks
+from moto import mock_aws
+from sqlalchemy.exc import OperationalError
+
+from triage_app import crud, models
+from triage_app.s3 import S3Manager
+
+BUCKET = 'triage-test-ingest'
+
+
+def make_message(uid: int, sender: str = None):
+    message = EmailMessage()
+    message['From'] = sender or f'Sender Ingest{uid} <ingest{uid}@example.com>'
+    message['Subject'] = f'Ingest message {uid}'
+    message['Message-ID'] = f'<ingest-{uid}@example.com>'
+    message.set_content(f'body of message {uid}')
+    message.add_alternative(f'<p>body of message {uid}</p>', subtype='html')
+    message.add_attachment(os.urandom(1024), maintype='application', subtype='pdf', filename=f'{uid}.pdf')
+    return uid, message.as_bytes()
+
+
+@pytest.fixture
+def s3(db):
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    db.query(models.Settings).filter(models.Settings.key == 's3_bucket_name').update({'value': BUCKET})
+    db.commit()
+    crud.refresh_settings_snapshot(db)
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        manager = S3Manager(aws_access_key_id='testing', aws_secret_access_key='testing', region_name='us-east-1')
+        yield manager, client
+        manager.shutdown()
+    db.query(models.Settings).filter(models.Settings.key == 's3_bucket_name').update({'value': None})
+    db.commit()
+    crud.refresh_settings_snapshot(db)
+
+
+def stored(db, db_email):
+    db.expire_all()
+    return {uid for uid, in db.query(models.EmailSource.email_uid).filter(models.EmailSource.email_id == db_email.email_id)}
+
+
+def bucket_keys(client):
+    return {item['Key'] for item in client.list_objects_v2(Bucket=BUCKET).get('Contents', [])}
+
+
+def attachment_keys(db, db_email):
+    links = db.query(models.Attachment.link).join(models.EmailSource, models.EmailSource.thread_entry_id == models.Attachment.object_id) \
+        .filter(models.EmailSource.email_id == db_email.email_id).all()
+    return {link.rsplit('/', 1)[-1] for link, in links}
+
+
+def test_failed_messages_are_retried_or_skipped(db, mailbox, s3, monkeypatch):
+    manager, client = s3
+    persist = crud.persist
+    failures = {2: OperationalError('INSERT', {}, Exception('database is locked')), 3: ValueError('bad message')}
+
+    def flaky_persist(db, commit=True):
+        # fails inside create_email_source, which wraps whatever it catches in an HTTPException
+        for obj in db.new:
+            if isinstance(obj, models.EmailSource) and obj.email_uid in failures:
+                raise failures[obj.email_uid]
+        return persist(db, commit)
+
+    monkeypatch.setattr(crud, 'persist', flaky_persist)
+    crud.ingest_email_batch(BackgroundTasks(), db, mailbox, [make_message(uid) for uid in (1, 2, 3, 4)], manager)
+
+    assert stored(db, mailbox) == {1, 4}
+    # the locked database is retried from uid 2 on, the bad message is not
+    db.refresh(mailbox)
+    assert mailbox.uid_max == 1
+    # the attachments of the rolled back messages were removed from the bucket
+    assert bucket_keys(client) == attachment_keys(db, mailbox)
+    assert len(bucket_keys(client)) == 2
+
+    # the next poll sees everything above uid_max again, plus a message that cannot be parsed
+    failures.clear()
+    crud.ingest_email_batch(BackgroundTasks(), db, mailbox, [make_message(uid) for uid in (2, 3, 4)] + [make_message(5, sender='no address')], manager)
+    assert stored(db, mailbox) == {1, 2, 3, 4}
+    db.refresh(mailbox)
+    assert mailbox.uid_max == 5
+    assert bucket_keys(client) == attachment_keys(db, mailbox)
+
+
+def test_failed_uploads_retry_the_message(db, mailbox, s3, monkeypatch):
+    manager, client = s3
+    upload_fileobj = manager.upload_fileobj
+    broken = {'2.pdf'}
+
+    def flaky_upload(fileobj, bucket_name, key, extra_args=None):
+        future = upload_fileobj(fileobj, bucket_name, key, extra_args)
+        if any(name in extra_args['ContentDisposition'] for name in broken):
+            # the object made it, the request still failed as far as the client can tell
+            future.result()
+            raise ConnectionError('connection reset')
+        return future
+
+    def saved_after_upload(db, object_id, uploads):
+        # the transfers are over before the transaction that stores the rows opens
+        assert all(future.done() for future, _, _ in uploads)
+        return save_email_attachments(db, object_id, uploads)
+
+    save_email_attachments = crud.save_email_attachments
+    monkeypatch.setattr(manager, 'upload_fileobj', flaky_upload)
+    monkeypatch.setattr(crud, 'save_email_attachments', saved_after_upload)
+    crud.ingest_email_batch(BackgroundTasks(), db, mailbox, [make_message(uid) for uid in (1, 2, 3)], manager)
+
+    assert stored(db, mailbox) == {1, 3}
+    db.refresh(mailbox)
+    assert mailbox.uid_max == 1
+    assert bucket_keys(client) == attachment_keys(db, mailbox)
+    assert len(bucket_keys(client)) == 2
+
+    broken.clear()
+    crud.ingest_email_batch(BackgroundTasks(), db, mailbox, [make_message(uid) for uid in (2, 3)], manager)
+    assert stored(db, mailbox) == {1, 2, 3}
+    db.refresh(mailbox)
+    assert mailbox.uid_max == 3
+    assert bucket_keys(client) == attachment_keys(db, mailbox)
+    assert len(bucket_keys(client)) == 3
@@ -0,0 +1,75 @@
+import imaplib
+from email.message import EmailMessage
+
+from triage_app import models
+from triage_app.imap_poller import IMAPPoller
+
+from .imap_stub import IMAPStub
+
+
+def make_message(n: int):
+    message = EmailMessage()
+    message['From'] = f'Sender Number{n} <sender{n}@example.com>'
+    message['To'] = 'support@example.com'
+    message['Subject'] = f'Stub message {n}'
+    message['Message-ID'] = f'<stub-{n}@example.com>'
+    message.set_content(f'body of message {n}')
+    return message.as_bytes()
+
+
+def stored_uids(db, db_email):
+    db.expire_all()
+    return {uid for uid, in db.query(models.EmailSource.email_uid).filter(models.EmailSource.email_id == db_email.email_id)}
+
+
+def run_poller(stub, **options):
+    def connect(db_email):
+        mail = imaplib.IMAP4('127.0.0.1', stub.port, timeout=5)
+        mail.login(db_email.email, 'unused')
+        mail.select('inbox')
+        return mail
+    options = {'poll_interval': 0.2, 'idle_timeout': 1, 'refresh_interval': 0.2, 'reconnect_backoff': 0.1, **options}
+    poller = IMAPPoller(s3_manager=None, connect_factory=connect, **options)
+    poller.start()
+    return poller
+
+
+def test_idle_picks_up_new_mail(db, mailbox):
+    with IMAPStub() as stub:
+        stub.deliver(make_message(1))
+        # a long idle timeout, only the pushed EXISTS can end the idle in time
+        poller = run_poller(stub, idle_timeout=60)
+        try:
+            assert stub.wait_for(lambda: stored_uids(db, mailbox) == {1})
+            assert stub.wait_for(lambda: stub.idles >= 1)
+            stub.deliver(make_message(2))
+            assert stub.wait_for(lambda: stored_uids(db, mailbox) == {1, 2}, timeout=5)
+            assert stub.logins == 1
+        finally:
+            poller.stop()
+    db.refresh(mailbox)
+    assert mailbox.uid_max == 2
+
+
+def test_polls_without_idle(db, mailbox):
+    with IMAPStub(capabilities=('IMAP4rev1',)) as stub:
+        poller = run_poller(stub)
+        try:
+            stub.deliver(make_message(1))
+            assert stub.wait_for(lambda: stored_uids(db, mailbox) == {1})
+            assert stub.idles == 0
+        finally:
+            poller.stop()
+
+
+def test_reconnects_after_dropped_connection(db, mailbox):
+    with IMAPStub() as stub:
+        poller = run_poller(stub)
+        try:
+            assert stub.wait_for(lambda: stub.idles >= 1)
+            stub.drop()
+            stub.deliver(make_message(1))
+            assert stub.wait_for(lambda: stub.logins >= 2)
+            assert stub.wait_for(lambda: stored_uids(db, mailbox) == {1})
+        finally:
+            poller.stop()
@@ -0,0 +1,85 @@
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from triage_app import models
+from triage_app.migrate import alembic_config
+from triage_app.search import SEARCH_TABLES, rebuild_search_index
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "migrations.db"}')
+    yield engine
+    engine.dispose()
+
+
+def upgrade(engine, revision: str):
+    with engine.begin() as connection:
+        command.upgrade(alembic_config(connection), revision)
+
+
+def test_upgrade_builds_the_models_schema_from_nothing(engine):
+    upgrade(engine, 'head')
+    tables = set(inspect(engine).get_table_names())
+    assert set(models.Base.metadata.tables) <= tables
+    assert set(SEARCH_TABLES) <= tables
+
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={'include_name': lambda name, type_, _: not (type_ == 'table' and name.startswith(SEARCH_TABLES))})
+        # sqlite cannot reflect the expression index, everything else must match the models
+        diff = [change for change in compare_metadata(context, models.Base.metadata)
+                if not (change[0] == 'add_index' and change[1].name == 'ix_tickets_overdue_deadline')]
+    assert diff == []
+
+    with engine.begin() as connection:
+        command.downgrade(alembic_config(connection), 'base')
+    assert set(inspect(engine).get_table_names()) <= {'alembic_version'}
+
+
+def add_ticket(connection, ticket_id: int, number: str):
+    connection.execute(text('INSERT INTO tickets (ticket_id, number, title, overdue, answered) VALUES (:id, :number, :title, 0, 0)'),
+                       {'id': ticket_id, 'number': number, 'title': f'printer {ticket_id}'})
+
+
+def test_duplicates_are_reported_before_the_unique_indexes(engine):
+    upgrade(engine, '0001')
+    with engine.begin() as connection:
+        for ticket_id, number in [(1, 'TK-1'), (2, 'TK-1'), (3, 'TK-2')]:
+            add_ticket(connection, ticket_id, number)
+        for source_id, uid in [(1, 7), (2, 7), (3, 8)]:
+            connection.execute(text('INSERT INTO email_sources (soure_id, thread_entry_id, email_uid, email_id, message_id) '
+                                    'VALUES (:id, :id, :uid, 1, :message_id)'), {'id': source_id, 'uid': uid, 'message_id': f'<{source_id}@x>'})
+
+    with pytest.raises(RuntimeError, match=r'TK-1 \(2 tickets\)'):
+        upgrade(engine, 'head')
+
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE tickets SET number = 'TK-3' WHERE ticket_id = 2"))
+    upgrade(engine, 'head')
+
+    with engine.connect() as connection:
+        # the second copy of uid 7 was dropped, the first one kept
+        assert connection.execute(text('SELECT soure_id FROM email_sources ORDER BY soure_id')).scalars().all() == [1, 3]
+        assert connection.execute(text('SELECT version_num FROM alembic_version')).scalar() == '0005'
+
+
+def test_search_index_is_filled_once_after_the_migration(engine):
+    upgrade(engine, '0003')
+    with engine.begin() as connection:
+        add_ticket(connection, 1, 'TK-1')
+    upgrade(engine, 'head')
+
+    with Session(engine) as db:
+        assert db.execute(text('SELECT count(*) FROM ticket_search')).scalar() == 0
+        rebuild_search_index(db, only_if_empty=True)
+        assert db.execute(text("SELECT rowid FROM ticket_search WHERE ticket_search MATCH 'printer'")).scalars().all() == [1]
+        # a filled index is left alone
+        db.execute(text("DELETE FROM ticket_search WHERE rowid = 1"))
+        db.execute(text("INSERT INTO ticket_search (rowid, number, title, description, entries) VALUES (1, 'TK-1', 'stale', '', '')"))
+        db.commit()
+        rebuild_search_index(db, only_if_empty=True)
+        assert db.execute(text("SELECT title FROM ticket_search WHERE rowid = 1")).scalar() == 'stale'
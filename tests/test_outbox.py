@@ -0,0 +1,26 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from triage_app import crud, models, schemas
+
+
+def test_agent_reply_without_an_email_raises(db):
+    # a reply to a ticket that did not come in by email has no account to send from
+    user = models.User(email=f'{uuid4()}@example.com', firstname='No', lastname='Mailbox', status=0)
+    ticket = models.Ticket(number=f'OUTBOX-{uuid4()}', title='web form', overdue=0, answered=0)
+    db.add_all([user, ticket])
+    db.flush()
+    thread = models.Thread(ticket_id=ticket.ticket_id)
+    db.add(thread)
+    db.flush()
+    db.add(models.ThreadEntry(thread_id=thread.thread_id, user_id=user.user_id, type='M', owner='No Mailbox', body='help'))
+    email_info = schemas.ThreadEntryAgentEmailReply(recipient_id=user.user_id, subject='web form', body='on it', thread_id=thread.thread_id)
+    crud.enqueue_agent_reply(db, email_info, 1, ref=f'thread:{thread.thread_id}')
+    db.commit()
+
+    db_outbox = db.query(models.Outbox).filter(models.Outbox.kind == 'agent_reply', models.Outbox.recipient == str(user.user_id)).one()
+    # the outbox worker only marks a row sent when delivery returns, raising keeps it queued for a retry
+    with pytest.raises(Exception, match='No email is set'):
+        asyncio.run(crud.deliver_outbox_row(db, db_outbox))
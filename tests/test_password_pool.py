@@ -0,0 +1,44 @@
+import asyncio
+
+import bcrypt
+import pytest
+
+from triage_app.password_pool import BcryptPool
+
+
+@pytest.fixture
+def pool():
+    pool = BcryptPool(rounds=4, workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def kill_workers(pool):
+    executor = pool.executor()
+    for process in list(executor._processes.values()):
+        process.kill()
+        process.join()
+    return executor
+
+
+def test_workers_are_spawned(pool):
+    assert pool.executor()._mp_context.get_start_method() == 'spawn'
+
+
+def test_a_dead_worker_does_not_break_later_calls(pool):
+    hashed = pool.hash('secret')
+    assert pool.verify('missing') == (False, None)
+    dead = kill_workers(pool)
+
+    assert bcrypt.checkpw(b'secret', pool.hash('secret').encode())
+    assert pool.executor() is not dead
+
+    # the dummy hash went down with its pool and is made again in the new one
+    dead = kill_workers(pool)
+    assert pool.verify('missing') == (False, None)
+    assert pool.verify('secret', hashed) == (True, None)
+    assert pool.executor() is not dead
+
+    kill_workers(pool)
+    assert asyncio.run(pool.verify_async('secret', hashed)) == (True, None)
+    assert pool.stats()['pending'] == 0
@@ -0,0 +1,38 @@
+from uuid import uuid4
+
+import pytest
+
+from triage_app import crud, models
+
+
+@pytest.fixture
+def new_department(db):
+    # written behind the reference data's back, the way another process's write looks to this one
+    crud.get_reference_data()
+    department = models.Department(name=f'Reference {uuid4()}')
+    db.add(department)
+    db.commit()
+    return department.dept_id
+
+
+def test_reference_row_reads_a_missing_row_and_reloads(new_department):
+    version = crud.reference_data_version
+    assert crud.reference_data.get(models.Department, new_department) is None
+
+    row = crud.reference_row(models.Department, new_department)
+    assert row is not None and row.dept_id == new_department
+    assert crud.reference_data_version > version
+    assert crud.get_reference_data().get(models.Department, new_department) is not None
+
+    # ids that are not in the database either leave the reference data alone
+    version = crud.reference_data_version
+    assert crud.reference_row(models.Department, 999999) is None
+    assert crud.reference_data_version == version
+
+
+def test_ticket_lookups_include_missing_rows(db, new_department):
+    ticket = models.Ticket(dept_id=1)
+    lookups = crud.resolve_ticket_lookups(db, [ticket], {'dept_id': new_department})
+    assert lookups['dept_id'][new_department].dept_id == new_department
+    assert lookups['dept_id'][1].dept_id == 1
+    assert crud.get_reference_data().get(models.Department, new_department) is not None
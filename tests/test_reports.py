@@ -0,0 +1,65 @@
+import math
+from datetime import datetime, timedelta
+
+import pytest
+
+from triage_app import models, reports
+
+
+@pytest.fixture(scope='module')
+def report_tickets():
+    from triage_app.database import SessionLocal
+    db = SessionLocal()
+    now = datetime.now()
+    for i in range(60):
+        created = now - timedelta(hours=5 * i + 1)
+        ticket = models.Ticket(number=f'REPORT-{i}', title='report', created=created, overdue=i % 3 == 0, answered=0,
+                               closed=created + timedelta(hours=i % 7 + 1) if i % 2 else None,
+                               due_date=created + timedelta(hours=4) if i % 5 == 0 else None,
+                               dept_id=1 if i % 4 else None, priority_id=i % 3 + 1, sla_id=1, status_id=1)
+        db.add(ticket)
+        db.flush()
+        thread = models.Thread(ticket_id=ticket.ticket_id)
+        db.add(thread)
+        db.flush()
+        db.add(models.ThreadEntry(thread_id=thread.thread_id, agent_id=1 if i % 3 else None, owner='agent', type='M', body='reply',
+                                  created=created + timedelta(minutes=10 * i + 5)))
+    db.commit()
+    db.close()
+    return now - timedelta(days=30), now
+
+
+def rounded(value):
+    if isinstance(value, float):
+        return None if math.isnan(value) else round(value, 6)
+    if isinstance(value, dict):
+        return {k: rounded(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [rounded(v) for v in value]
+    return value
+
+
+@pytest.mark.parametrize('kind', ['time_to_close', 'sla_breach', 'backlog_age', 'first_response'])
+@pytest.mark.parametrize('group_by', [None, 'department', 'priority'])
+def test_chunked_reports_match_a_single_chunk(report_tickets, monkeypatch, kind, group_by):
+    start, end = report_tickets
+    whole = reports.run_report(kind, start, end, group_by)
+    # chunks smaller than a group force every running total across chunk boundaries
+    monkeypatch.setattr(reports, 'REPORT_CHUNK_SIZE', 7)
+    chunked = reports.run_report(kind, start, end, group_by)
+    assert rounded(chunked) == rounded(whole)
+    assert whole['tickets'] >= 60
+
+
+def test_report_route_requires_admin(client, agent_headers, report_tickets):
+    today = datetime.now().strftime('%m-%d-%Y')
+    response = client.get('/report/sla_breach', params={'start': today, 'end': today}, headers=agent_headers(admin=0))
+    assert response.status_code == 403
+
+    # admins get the report from the spawned worker pool
+    try:
+        response = client.get('/report/sla_breach', params={'start': today, 'end': today, 'group_by': 'department'}, headers=agent_headers())
+    finally:
+        reports.shutdown_report_pool()
+    assert response.status_code == 200
+    assert response.json()['report'] == 'sla_breach'
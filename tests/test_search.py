@@ -0,0 +1,45 @@
+import pytest
+
+from triage_app import models
+from triage_app.database import SessionLocal
+from triage_app.search import SearchBackend, SQLiteSearch, index_tickets, search_backend, ticket_search_filter
+
+
+@pytest.fixture(scope='module')
+def ticket():
+    db = SessionLocal()
+    ticket = models.Ticket(number='SRCH-00042', title='printer jam on floor two', description='<p>paper stuck</p>', overdue=0, answered=0)
+    db.add(ticket)
+    db.flush()
+    ticket_id = ticket.ticket_id
+    index_tickets(db, [ticket_id])
+    db.commit()
+    db.close()
+    return ticket_id
+
+
+def matches(db, query):
+    return {ticket_id for ticket_id, in db.query(models.Ticket.ticket_id).filter(ticket_search_filter(query))}
+
+
+@pytest.mark.parametrize('query', ['printer', 'jam floor', 'paper', 'SRCH-00042', '0042', '-0004', 'srch'])
+def test_ticket_search_matches_words_and_any_part_of_the_number(db, ticket, query):
+    assert isinstance(search_backend, SQLiteSearch)
+    assert ticket in matches(db, query)
+
+
+@pytest.mark.parametrize('query', ['scanner', '0043', ''])
+def test_ticket_search_misses(db, ticket, query):
+    assert ticket not in matches(db, query)
+
+
+def test_backends_must_implement_the_interface():
+    with pytest.raises(TypeError):
+        SearchBackend()
+
+    class Partial(SearchBackend):
+        def create_schema(self, connection):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
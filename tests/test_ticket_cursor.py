@@ -0,0 +1,32 @@
+from datetime import datetime
+from uuid import uuid4
+
+from triage_app import crud, models
+
+
+def test_cursor_walks_past_tickets_created_in_the_same_second(db):
+    # the server default stores created to the second, so these tie on it and only the ticket_id tie breaker orders them
+    title = f'cursor {uuid4()}'
+    tickets = [models.Ticket(number=f'CURSOR-{uuid4()}', title=title, overdue=0, answered=0) for _ in range(5)]
+    db.add_all(tickets)
+    db.commit()
+    ids = [ticket.ticket_id for ticket in tickets]
+
+    for sort in ('-created', 'created'):
+        plan = crud.compile_ticket_plan(None, 1, [['tickets.title', '==', title]], [sort])
+        seen, cursor = [], None
+        for _ in range(len(ids)):
+            page = crud.paginate_ticket_cursor(db, plan, '', cursor, 2)
+            seen += [ticket.ticket_id for ticket in page['items']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        assert seen == ids
+
+    # a datetime with microseconds still sorts in with the ones stored to the second
+    tickets[2].created = datetime.fromisoformat(str(tickets[1].created)).replace(microsecond=500)
+    db.commit()
+    plan = crud.compile_ticket_plan(None, 1, [['tickets.title', '==', title]], ['created'])
+    first = crud.paginate_ticket_cursor(db, plan, '', None, 2)
+    rest = crud.paginate_ticket_cursor(db, plan, '', first['next_cursor'], 10)
+    assert sorted(ticket.ticket_id for ticket in first['items'] + rest['items']) == sorted(ids)
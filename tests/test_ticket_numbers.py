@@ -0,0 +1,52 @@
+from uuid import uuid4
+
+import pytest
+from fastapi import BackgroundTasks
+from sqlalchemy import event
+
+from triage_app import crud, models, schemas
+from triage_app.database import engine
+
+NUMBER_FORMAT = 'SEQ-######'
+
+
+@pytest.fixture
+def sequential(db):
+    def configure(sequence, number_format):
+        for key, value in (('default_ticket_number_sequence', sequence), ('default_ticket_number_format', number_format)):
+            db.query(models.Settings).filter(models.Settings.key == key).update({'value': value})
+        db.commit()
+        crud.refresh_settings_snapshot(db)
+
+    settings = crud.get_settings_snapshot(db)
+    previous = settings.get('default_ticket_number_sequence'), settings.get('default_ticket_number_format')
+    configure('Sequential', NUMBER_FORMAT)
+    yield
+    configure(*previous)
+
+
+def test_sequential_numbers_cost_no_queries(db, sequential):
+    crud.reserve_sequence_numbers(models.Ticket, 5, NUMBER_FORMAT)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        numbers = [crud.generate_unique_number(db, models.Ticket) for _ in range(5)]
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert statements == []
+    assert len(set(numbers)) == 5
+
+
+def test_a_clashing_number_takes_the_next_one(db, sequential):
+    crud.reserve_sequence_numbers(models.Ticket, 2, NUMBER_FORMAT)
+    upcoming = crud.number_blocks['tickets'][0]
+    # issued while the sequence was Random, after the counter was seeded
+    db.add(models.Ticket(number=crud.format_number(upcoming, NUMBER_FORMAT), title='random', overdue=0, answered=0))
+    db.commit()
+
+    user = models.User(email=f'{uuid4()}@example.com', firstname='Number', lastname='Clash', status=0)
+    db.add(user)
+    db.commit()
+    ticket = crud.create_ticket(BackgroundTasks(), db, schemas.TicketCreate(user_id=user.user_id, topic_id=1, title='numbered', description='', source='native'), creator='user')
+    assert ticket.number == crud.format_number(upcoming + 1, NUMBER_FORMAT)
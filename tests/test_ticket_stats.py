@@ -0,0 +1,59 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+
+from triage_app import crud, models
+
+
+def rollup(db):
+    counts = Counter()
+    for row in db.query(models.TicketDailyStats).all():
+        for field in crud.TICKET_STATS_FIELDS:
+            counts[(row.date, row.dept_id, row.topic_id, row.agent_id, field)] += getattr(row, field)
+    return +counts
+
+
+def recount(db):
+    return +crud.ticket_stats_snapshot(db, [ticket_id for ticket_id, in db.query(models.Ticket.ticket_id)])
+
+
+def changes(before, after):
+    delta = Counter(after)
+    delta.subtract(before)
+    return {key: value for key, value in delta.items() if value}
+
+
+@pytest.fixture
+def owners(db):
+    agent = models.Agent(firstname='Stats', lastname='Agent', email=f'{uuid4()}@example.com', permissions='{}', preferences='{}', status=0)
+    dept = models.Department(name=f'Stats {uuid4()}')
+    topic = models.Topic(topic=f'Stats {uuid4()}', notes='')
+    db.add_all([agent, dept, topic])
+    db.commit()
+
+    now = datetime.now()
+    tickets = [models.Ticket(number=f'STATS-{uuid4()}', title='stats', agent_id=agent.agent_id, dept_id=dept.dept_id, topic_id=topic.topic_id,
+                             created=now - timedelta(days=i), updated=now, due_date=now - timedelta(days=1), overdue=i % 2, answered=0)
+               for i in range(4)]
+    db.add_all(tickets)
+    db.flush()
+    crud.record_ticket_stats(db, [ticket.ticket_id for ticket in tickets])
+    db.commit()
+    return agent.agent_id, dept.dept_id, topic.topic_id
+
+
+@pytest.mark.parametrize('delete', ['agent', 'department', 'topic'])
+def test_deletes_keep_the_rollup_in_step(db, owners, delete):
+    agent_id, dept_id, topic_id = owners
+    rollup_before, recount_before = rollup(db), recount(db)
+    if delete == 'agent':
+        assert crud.delete_agent(db, agent_id)
+    elif delete == 'department':
+        assert crud.delete_department(db, dept_id)
+    else:
+        assert crud.delete_topic(db, topic_id)
+    # other tests add tickets without going through the rollup, so compare what the delete changed
+    assert changes(rollup_before, rollup(db)) == changes(recount_before, recount(db))
+    assert changes(recount_before, recount(db))
@@ -1,25 +1,34 @@
 import ast
 import asyncio
 import base64
+import binascii
 import email
 import hashlib
 import imaplib
+import io
 import json
 import os
 import random
 import re
 import smtplib
+import tempfile
 import threading
+import time
 import traceback
 import pandas as pd
+from collections import Counter, namedtuple
+from concurrent.futures import Future
+from functools import lru_cache
 from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
 from email.policy import default
+from email.utils import formataddr
 from itertools import chain
+from types import MappingProxyType
 from typing import Annotated
 from uuid import uuid4
 from zoneinfo import ZoneInfo
 
-import bcrypt
 import jwt
 from bs4 import BeautifulSoup
 from Crypto.Cipher import AES
@@ -30,15 +39,20 @@ from fastapi.security import OAuth2PasswordBearer
 from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
 from itsdangerous import URLSafeTimedSerializer
 from jwt.exceptions import InvalidTokenError
-from passlib.context import CryptContext
-from sqlalchemy import Column, and_, case, func, or_, update
-from sqlalchemy.orm import Session, class_mapper
-from sqlalchemy.sql import union
+from sqlalchemy import (Column, DateTime, String, and_, bindparam, case, func, insert, literal, or_,
+                        select, type_coerce, union_all, update)
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, class_mapper, selectinload
 
 from . import models, schemas
 from .models import Agent, Ticket, class_dict, naming_dict, primary_key_dict
 from .database import SessionLocal
+from .helpers import TTLCache
+from .password_pool import PasswordPoolBusy, bcrypt_pool
 from .s3 import S3Manager
+from .search import index_tickets, index_users, ticket_search_filter, ticket_search_rank, user_search_filter
+from .smtp_pool import smtp_pool
 from .schemas import (AgentCreate, AgentData, AgentUpdate, TicketCreate,
                       TicketUpdate, UserData, GuestData)
 
@@ -102,117 +116,238 @@ safe_file_types = [
     "text/x-r",              # R (.r)
 ]
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
+# bcrypt runs in bcrypt_pool's worker processes, never on a request thread
+
+def password_pool_busy():
+    return HTTPException(status_code=503, detail='Too many login attempts, try again shortly', headers={'Retry-After': '5'})
+
+
 def hash_password(password: str):
-    password_bytes = password.encode('utf-8')
-    hashed_bytes = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
-    return hashed_bytes.decode('utf-8')
+    try:
+        return bcrypt_pool.hash(password)
+    except PasswordPoolBusy:
+        raise password_pool_busy()
 
 
-def encrypt(payload: str):
-    salt = get_random_bytes(16)
-    iv = get_random_bytes(12)
+# stored secrets: the original format is base64(salt + iv + ciphertext + tag) under a pbkdf2 key
+# derived per salt, new ones are 'v2$' + base64(iv + ciphertext + tag) under one data key per
+# deployment, so the key derivation runs once per process instead of on every call
+SECRET_ENVELOPE_V2 = 'v2$'
+# base64 encoded 32 byte key, when unset the data key is derived from SECRET_KEY.
+# changing it makes existing v2 secrets unreadable, they have to be entered again
+DATA_ENCRYPTION_KEY = os.getenv('DATA_ENCRYPTION_KEY')
+
+# decrypted values by sha256 of the ciphertext, memory only
+secret_cache = TTLCache(maxsize=1024, ttl=3600)
+
 
-    secret = hashlib.pbkdf2_hmac(
+@lru_cache(maxsize=256)
+def derive_key(salt: bytes):
+    return hashlib.pbkdf2_hmac(
         'SHA512', SECRET_KEY.encode(), salt, 65535, 32)
 
-    cipher = AES.new(secret, AES.MODE_GCM, iv)
+
+@lru_cache(maxsize=1)
+def data_key():
+    if DATA_ENCRYPTION_KEY:
+        key = base64.b64decode(DATA_ENCRYPTION_KEY)
+        if len(key) != 32:
+            raise ValueError('DATA_ENCRYPTION_KEY must be 32 bytes, base64 encoded')
+        return key
+    return derive_key(b'data key:' + SECURITY_PASSWORD_SALT.encode())
+
+
+def secret_cache_key(payload: str):
+    return hashlib.sha256(payload.encode()).digest()
+
+
+def encrypt(payload: str):
+    iv = get_random_bytes(12)
+
+    cipher = AES.new(data_key(), AES.MODE_GCM, iv)
 
     encrypted_message_byte, tag = cipher.encrypt_and_digest(
         payload.encode("utf-8")
     )
-    cipher_byte = salt + iv + encrypted_message_byte + tag
+    cipher_byte = iv + encrypted_message_byte + tag
 
     encoded_cipher_byte = base64.b64encode(cipher_byte)
-    return bytes.decode(encoded_cipher_byte)
+    return SECRET_ENVELOPE_V2 + bytes.decode(encoded_cipher_byte)
 
 
 def decrypt(payload: str):
-    decoded_cipher_byte = base64.b64decode(payload)
-
-    salt = decoded_cipher_byte[:16]
-    iv = decoded_cipher_byte[16: (16 + 12)]
-    encrypted_message_byte = decoded_cipher_byte[
-        (12 + 16): -16
-    ]
+    key = secret_cache_key(payload)
+    cached = secret_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if payload.startswith(SECRET_ENVELOPE_V2):
+        decoded_cipher_byte = base64.b64decode(payload[len(SECRET_ENVELOPE_V2):])
+        secret = data_key()
+    else:
+        # legacy secret with its own salt
+        decoded_cipher_byte = base64.b64decode(payload)
+        salt = decoded_cipher_byte[:16]
+        decoded_cipher_byte = decoded_cipher_byte[16:]
+        secret = derive_key(salt)
+
+    iv = decoded_cipher_byte[:12]
+    encrypted_message_byte = decoded_cipher_byte[12: -16]
     tag = decoded_cipher_byte[-16:]
-    secret = hashlib.pbkdf2_hmac(
-        'SHA512', SECRET_KEY.encode(), salt, 65535, 32)
     cipher = AES.new(secret, AES.MODE_GCM, iv)
 
-    decrypted_message_byte = cipher.decrypt_and_verify(
-        encrypted_message_byte, tag)
-    return decrypted_message_byte.decode("utf-8")
+    decrypted_message = cipher.decrypt_and_verify(
+        encrypted_message_byte, tag).decode("utf-8")
+    secret_cache.set(key, decrypted_message)
+    return decrypted_message
+
+
+def forget_secret(payload: str):
+    # called when a stored secret is replaced
+    if payload:
+        secret_cache.pop(secret_cache_key(payload))
 
 
 def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+    return check_password(plain_password, hashed_password)[0]
 
 
 def get_password_hash(password: str):
-    return pwd_context.hash(password)
+    return hash_password(password)
 
 
-async def send_email(db: Session, email_list: list, template: str, email_type: str, values: list = None):
+def check_password(plain_password: str, hashed_password: str = None):
+    # (matches, new hash when the stored one is at an old cost), None checks against a dummy hash
     try:
-        email_template = get_email_template_by_filter(
-            db, {'code_name': template})
+        return bcrypt_pool.verify(plain_password, hashed_password)
+    except PasswordPoolBusy:
+        raise password_pool_busy()
 
-        if not email_template.active:
-            print(f'{email_template.code_name} not active')
-            return
 
-        email_id = get_settings_by_filter(
-            db, filter={'key': f'default_{email_type}_email'}).value
+async def check_password_async(plain_password: str, hashed_password: str = None):
+    try:
+        return await bcrypt_pool.verify_async(plain_password, hashed_password)
+    except PasswordPoolBusy:
+        raise password_pool_busy()
 
-        if email_id is None:
-            return JSONResponse(status_code=404, content={"message": "Email is not set"})
 
-        email_password = decrypt(get_email_by_filter(
-            db, filter={'email_id': email_id}).password)
-        email_server = get_email_by_filter(
-            db, filter={'email_id': email_id}).mail_server
-        mail_from_name = get_email_by_filter(
-            db, filter={'email_id': email_id}).email_from_name
-        email = get_email_by_filter(db, filter={'email_id': email_id}).email
+def rehash_password(db: Session, account, new_hash: str):
+    # the password was just checked, so a hash at the old cost can be swapped for one at the current cost
+    if new_hash:
+        account.password = new_hash
+        db.commit()
+        db.refresh(account)
 
-        body = email_template.body
 
-        if values:
-            body = body.format(*values)
+# same as send_email but raises on failure so the outbox worker can retry
+async def deliver_email(db: Session, email_list: list, template: str, email_type: str, values: list = None):
+    email_template = get_email_template_by_filter(
+        db, {'code_name': template})
 
-        conf = ConnectionConfig(
-            MAIL_USERNAME=email,
-            MAIL_PASSWORD=email_password,
-            MAIL_FROM=email,
-            MAIL_PORT=587,
-            MAIL_SERVER=email_server,
-            MAIL_STARTTLS=True,
-            MAIL_FROM_NAME=mail_from_name,
-            MAIL_SSL_TLS=False,
-            USE_CREDENTIALS=True,
-        )
+    if not email_template.active:
+        print(f'{email_template.code_name} not active')
+        return
 
-        # we can probably init the object somewhere else in the context so we dont need to remake everytime an email is sent
-        message = MessageSchema(
-            subject=email_template.subject,
-            recipients=email_list,
-            body=body,
-            subtype=MessageType.html
-        )
+    email_id = get_settings_snapshot(db).get_int(f'default_{email_type}_email')
 
-        fm = FastMail(conf)
-        await fm.send_message(message)
-        print('email has sent')
-        return
+    # raising keeps the outbox row queued, it is retried and marked failed once it runs out of attempts
+    if email_id is None:
+        raise Exception(f'No default {email_type} email is set')
+
+    db_email = get_email_by_filter(db, filter={'email_id': email_id})
+    if not db_email:
+        raise Exception(f'Default {email_type} email {email_id} does not exist')
+    email_password = decrypt(db_email.password)
+    email_server = db_email.mail_server
+    mail_from_name = db_email.email_from_name
+    email = db_email.email
+
+    body = email_template.body
+
+    if values:
+        body = body.format(*values)
+
+    message = EmailMessage()
+    message['Subject'] = email_template.subject
+    message['From'] = formataddr((mail_from_name, email))
+    message['To'] = ', '.join(email_list)
+    message.set_content(body, subtype='html')
+
+    # the session for this account comes from the pool, smtplib blocks so it runs off the event loop
+    await asyncio.to_thread(smtp_pool.send_message, email_id, email_server, email, email_password, message)
+    print('email has sent')
+
+
+async def send_email(db: Session, email_list: list, template: str, email_type: str, values: list = None):
+    try:
+        return await deliver_email(db, email_list, template, email_type, values)
     except:
         traceback.print_exc()
         print('Unable to send email')
 
+
+# Outbox, mail is written as rows in the caller's transaction and delivered by the outbox worker
+
+def outbox_dedup_key(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def add_outbox_row(db: Session, **row):
+    # skip rows already queued, in the database or earlier in this transaction
+    if any(isinstance(obj, models.Outbox) and obj.dedup_key == row['dedup_key'] for obj in db.new):
+        return None
+    if db.query(models.Outbox.outbox_id).filter(models.Outbox.dedup_key == row['dedup_key']).first():
+        return None
+    db_outbox = models.Outbox(**row, status=0, attempts=0, next_attempt=datetime.now())
+    db.add(db_outbox)
+    return db_outbox
+
+
+def enqueue_email(db: Session, email_list: list, template: str, email_type: str, values: list = None, ref: str = None):
+    # one row per recipient, ref names the event so the same notice is never queued twice
+    for recipient in email_list:
+        if not recipient:
+            continue
+        add_outbox_row(db, kind='template', recipient=recipient, template=template, email_type=email_type,
+                       payload=json.dumps({'values': values}, default=str),
+                       dedup_key=outbox_dedup_key(template, recipient, values, ref))
+
+
+def enqueue_agent_reply(db: Session, email_info: schemas.ThreadEntryAgentEmailReply, agent_id: int, ref: str = None):
+    add_outbox_row(db, kind='agent_reply', recipient=str(email_info.recipient_id),
+                   payload=json.dumps({'email_info': email_info.model_dump(), 'agent_id': agent_id}, default=str),
+                   dedup_key=outbox_dedup_key('agent_reply', email_info.recipient_id, ref))
+
+
+# set after new rows are committed so a worker in this process does not wait for its next poll
+outbox_wakeup = threading.Event()
+
+
+def notify_outbox():
+    outbox_wakeup.set()
+
+
+def persist(db: Session, commit: bool = True):
+    # creates that are part of a larger transaction pass commit=False and only flush
+    if commit:
+        db.commit()
+    else:
+        db.flush()
+
+
+async def deliver_outbox_row(db: Session, db_outbox: models.Outbox):
+    payload = json.loads(db_outbox.payload)
+    if db_outbox.kind == 'template':
+        await deliver_email(db, [db_outbox.recipient], db_outbox.template, db_outbox.email_type, payload['values'])
+    elif db_outbox.kind == 'agent_reply':
+        await agent_reply_email(db, schemas.ThreadEntryAgentEmailReply.model_validate(payload['email_info']), payload['agent_id'])
+    else:
+        raise ValueError(f'Unknown outbox kind {db_outbox.kind}')
+
+
 async def test_send_email(db: Session, recipient: list, sender: str):
     try:
         email_template = get_email_template_by_filter(db, {'code_name': 'test'})
@@ -256,12 +391,14 @@ async def agent_reply_email(db: Session, email_info: schemas.ThreadEntryAgentEma
     reply_thread_entry = db.query(models.ThreadEntry).filter(and_(models.ThreadEntry.thread_id == email_info.thread_id,
                                                                   models.ThreadEntry.user_id.isnot(None))).order_by(models.ThreadEntry.entry_id.desc()).first()
     latest_message = db.query(models.EmailSource).filter(
-        models.EmailSource.thread_entry_id == reply_thread_entry.entry_id).first()
+        models.EmailSource.thread_entry_id == reply_thread_entry.entry_id).first() if reply_thread_entry else None
 
+    # raising keeps the outbox row queued like deliver_email does, a returned response would count as sent
+    if latest_message is None or latest_message.email_id is None:
+        raise Exception(f'No email is set for thread {email_info.thread_id}')
     email_id = latest_message.email_id
-
-    if email_id is None:
-        return JSONResponse(status_code=404, content={"message": "Email is not set"})
+    if not get_email_by_filter(db, filter={'email_id': email_id}):
+        raise Exception(f'Email {email_id} for thread {email_info.thread_id} does not exist')
     
     db_agent = get_agent_by_filter(db, {'agent_id': agent_id})
     agent_pref = ast.literal_eval(db_agent.preferences)
@@ -306,8 +443,8 @@ async def agent_reply_email(db: Session, email_info: schemas.ThreadEntryAgentEma
     reply = email.message.EmailMessage()
     reply["To"] = email_recipient
     reply["Subject"] = "Re: " + email_info.subject
-    reply["In_Reply-To"] = latest_message.message_id
-    reply["References"] = " " + latest_message.message_id
+    reply["In-Reply-To"] = latest_message.message_id
+    reply["References"] = latest_message.message_id
     reply['From'] = f"{mail_from_name} <{email_sender}>"
     
     email_info.body += mail_signature
@@ -320,14 +457,8 @@ async def agent_reply_email(db: Session, email_info: schemas.ThreadEntryAgentEma
         reply.add_alternative(f"""{email_info.body}""", subtype='html')
     
 
-    server = smtplib.SMTP(email_server, 587)
-    server.ehlo()
-    server.starttls()
-    server.login(email_sender, email_password)
-
-    server.send_message(reply)
     print('Sending email')
-    server.quit()
+    await asyncio.to_thread(smtp_pool.send_message, email_id, email_server, email_sender, email_password, reply)
 
 
 def create_token(data: dict, expires_delta: timedelta = timedelta(minutes=15)):
@@ -338,17 +469,43 @@ def create_token(data: dict, expires_delta: timedelta = timedelta(minutes=15)):
     return encoded_jwt
 
 
+# unknown emails are still checked against a hash, so they take as long as a wrong password
+
 def authenticate_agent(db: Session, email: str, password: str):
     agent = get_agent_by_filter(db, filter={'email': email})
-    if not agent or not verify_password(password, agent.password):
+    matches, new_hash = check_password(password, agent.password if agent else None)
+    if not agent or not matches:
         return None
+    rehash_password(db, agent, new_hash)
     return agent
 
 
 def authenticate_user(db: Session, email: str, password: str):
     user = get_user_by_filter(db, filter={'email': email})
-    if not user or not user.status == 0 or not verify_password(password, user.password):
+    matches, new_hash = check_password(password, user.password if user else None)
+    if not user or not user.status == 0 or not matches:
+        return False
+    rehash_password(db, user, new_hash)
+    return user
+
+
+# the login routes wait on bcrypt from the event loop, only the lookups use a thread
+
+async def authenticate_agent_async(db: Session, email: str, password: str):
+    agent = await asyncio.to_thread(get_agent_by_filter, db, {'email': email})
+    matches, new_hash = await check_password_async(password, agent.password if agent else None)
+    if not agent or not matches:
+        return None
+    await asyncio.to_thread(rehash_password, db, agent, new_hash)
+    return agent
+
+
+async def authenticate_user_async(db: Session, email: str, password: str):
+    user = await asyncio.to_thread(get_user_by_filter, db, {'email': email})
+    matches, new_hash = await check_password_async(password, user.password if user else None)
+    if not user or not user.status == 0 or not matches:
         return False
+    await asyncio.to_thread(rehash_password, db, user, new_hash)
     return user
 
 
@@ -360,21 +517,84 @@ def authenticate_guest(db: Session, email: str, ticket_number: int):
     return guest
 
 
-def decode_token(token: Annotated[str, Depends(oauth2_scheme)], token_type: str):
+# verified tokens by signature, each kept until the token expires
+token_cache = TTLCache(maxsize=8192, ttl=86400)
+# per agent role, permissions, timezone and preferences, short lived so other workers' edits show up
+agent_principal_cache = TTLCache(maxsize=4096, ttl=60)
+# agent edits that revoke the tokens issued before them
+TOKEN_REVOKING_FIELDS = {'admin', 'password', 'email'}
+
+
+def verify_token(token: str, token_type: str):
+    # jwt.decode and the pydantic model are only built the first time a token is seen
+    signature = token.rsplit('.', 1)[-1]
+    cached = token_cache.get((signature, token_type))
+    if cached is not None and cached[0] == token:
+        return cached[1], cached[2]
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    person_id = payload.get(token_type+'_id', None)
+    if person_id is None:
+        raise credentials_exception
+
+    if token_type == 'agent':
+        token_data = AgentData(
+            agent_id=payload['agent_id'], admin=payload['admin'])
+    elif token_type == 'user':
+        token_data = UserData(user_id=payload['user_id'])
+    elif token_type == 'guest':
+        # this could be combined but it looks cleaner like this for now
+        token_data = GuestData(user_id=payload['guest_id'], ticket_number=payload['ticket_number'], email=payload['email'])
+
+    ttl = payload['exp'] - time.time() if 'exp' in payload else None
+    if ttl is None or ttl > 0:
+        token_cache.set((signature, token_type), (token, payload, token_data), ttl)
+    return payload, token_data
+
+
+def load_agent_principal(agent_id: int, db: Session = None):
+    session = db or SessionLocal()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        person_id = payload.get(token_type+'_id', None)
-        if person_id is None:
-            raise credentials_exception
+        agent = session.query(models.Agent).filter(models.Agent.agent_id == agent_id).first()
+        if not agent:
+            return None
+        try:
+            preferences = json.loads(agent.preferences)
+        except:
+            preferences = {}
+        return schemas.AgentPrincipal(
+            agent_id=agent.agent_id, role_id=agent.role_id, dept_id=agent.dept_id, timezone=agent.timezone,
+            preferences=preferences, permissions=parse_permissions(agent.permissions),
+            role_permissions=get_role_permissions(session, agent.role_id) if agent.role_id else frozenset(),
+            token_version=agent.token_version or 0)
+    finally:
+        if db is None:
+            session.close()
+
+
+def get_agent_principal(agent_id: int, db: Session = None):
+    principal = agent_principal_cache.get(agent_id)
+    if principal is None:
+        principal = load_agent_principal(agent_id, db)
+        if principal is not None:
+            agent_principal_cache.set(agent_id, principal)
+    return principal
+
+
+def with_principal(payload: dict, token_data: AgentData, principal: schemas.AgentPrincipal):
+    # tokens issued before the agent's last revocation, or to a deleted agent, are refused
+    if principal is None or payload.get('ver', 0) != principal.token_version:
+        raise credentials_exception
+    return token_data.model_copy(update={'principal': principal})
+
 
+def decode_token(token: Annotated[str, Depends(oauth2_scheme)], token_type: str):
+    try:
+        payload, token_data = verify_token(token, token_type)
         if token_type == 'agent':
-            token_data = AgentData(
-                agent_id=payload['agent_id'], admin=payload['admin'])
-        elif token_type == 'user':
-            token_data = UserData(user_id=payload['user_id'])
-        elif token_type == 'guest':
-            # this could be combined but it looks cleaner like this for now
-            token_data = GuestData(user_id=payload['guest_id'], ticket_number=payload['ticket_number'], email=payload['email'])
+            token_data = with_principal(payload, token_data, get_agent_principal(token_data.agent_id))
+    except HTTPException:
+        raise
     except InvalidTokenError:
         raise credentials_exception
     except:
@@ -384,6 +604,13 @@ def decode_token(token: Annotated[str, Depends(oauth2_scheme)], token_type: str)
     return token_data
 
 
+def revoke_agent_tokens(db: Session, agent_id: int):
+    db.query(models.Agent).filter(models.Agent.agent_id == agent_id).update(
+        {'token_version': models.Agent.token_version + 1})
+    db.commit()
+    agent_principal_cache.pop(agent_id)
+
+
 def refresh_token(db: Session, token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -394,8 +621,10 @@ def refresh_token(db: Session, token: str):
         if 'agent_id' in payload:
             agent_id = payload['agent_id']
             agent = get_agent_by_filter(db, filter={'agent_id': agent_id})
+            if not agent or payload.get('ver', 0) != agent.token_version:
+                raise credentials_exception
             data = {'agent_id': agent_id,
-                    'admin': agent.admin, 'type': 'access'}
+                    'admin': agent.admin, 'type': 'access', 'ver': agent.token_version}
             access_token = create_token(data, timedelta(1440))
             return schemas.AgentToken(token=access_token, refresh_token=token, admin=agent.admin, agent_id=agent.agent_id)
 
@@ -404,6 +633,8 @@ def refresh_token(db: Session, token: str):
             data = {'user_id': user_id, 'type': 'access'}
             access_token = create_token(data, timedelta(1440))
             return schemas.UserToken(token=access_token, refresh_token=token, user_id=user_id)
+    except HTTPException:
+        raise
     except InvalidTokenError:
         raise credentials_exception
     except:
@@ -423,11 +654,60 @@ def decode_guest(token: Annotated[str, Depends(oauth2_scheme)]):
     return decode_token(token, 'guest')
 
 
-def get_permission(db: Session, agent_id: int, permission: str):
+# coroutine versions for the async routes, so a request never leaves the event loop
+async def decode_agent_async(token: Annotated[str, Depends(oauth2_scheme)]):
     try:
+        payload, token_data = verify_token(token, 'agent')
+    except HTTPException:
+        raise
+    except InvalidTokenError:
+        raise credentials_exception
+    principal = agent_principal_cache.get(token_data.agent_id)
+    if principal is None:
+        # a miss reads the agent row, keep that off the event loop
+        return await asyncio.to_thread(decode_token, token, 'agent')
+    return with_principal(payload, token_data, principal)
+
+
+async def decode_user_async(token: Annotated[str, Depends(oauth2_scheme)]):
+    return decode_token(token, 'user')
+
+
+async def decode_guest_async(token: Annotated[str, Depends(oauth2_scheme)]):
+    return decode_token(token, 'guest')
+
+
+# parsed permission sets, keyed by agent_id -> (role_id, agent permissions) and role_id -> role permissions
+agent_permission_cache = TTLCache(maxsize=4096, ttl=300)
+role_permission_cache = TTLCache(maxsize=256, ttl=300)
+
+
+def parse_permissions(permissions: str):
+    return frozenset(key for key, value in ast.literal_eval(permissions).items() if value)
+
+
+def get_agent_permissions(db: Session, agent_id: int):
+    cached = agent_permission_cache.get(agent_id)
+    if cached is None:
         agent = get_agent_by_filter(db=db, filter={'agent_id': agent_id})
-        permissions = ast.literal_eval(agent.permissions)
-        return permissions[permission]
+        cached = (agent.role_id, parse_permissions(agent.permissions))
+        agent_permission_cache.set(agent_id, cached)
+    return cached
+
+
+def get_role_permissions(db: Session, role_id: int):
+    cached = role_permission_cache.get(role_id)
+    if cached is None:
+        db_role = get_role_by_filter(db=db, filter={'role_id': role_id})
+        cached = parse_permissions(db_role.permissions)
+        role_permission_cache.set(role_id, cached)
+    return cached
+
+
+def get_permission(db: Session, agent_id: int, permission: str):
+    try:
+        _, permissions = get_agent_permissions(db, agent_id)
+        return int(permission in permissions)
     except:
         print('Error while parsing permissions')
         return 0
@@ -435,29 +715,148 @@ def get_permission(db: Session, agent_id: int, permission: str):
 
 def get_role(db: Session, agent_id: int, role: str):
     try:
-        agent = get_agent_by_filter(db=db, filter={'agent_id': agent_id})
-        db_role = get_role_by_filter(db=db, filter={'role_id': agent.role_id})
-        roles = ast.literal_eval(db_role.permissions)
-        return roles[role]
+        role_id, _ = get_agent_permissions(db, agent_id)
+        return int(role in get_role_permissions(db, role_id))
     except:
         print('Error while parsing role')
         return 0
 
 
+# numbers reserved by this process per sequence name, as [next, end)
+NUMBER_BLOCK_SIZE = 20
+number_blocks = {}
+number_blocks_lock = threading.Lock()
+
+
+def number_pattern(number_format: str):
+    # TK-#### -> TK\-(\d)(\d)(\d)(\d), the groups are the digits of the sequence number
+    return re.compile(''.join(r'(\d)' if char == '#' else re.escape(char) for char in number_format))
+
+
+def highest_issued_number(db: Session, t, number_format: str):
+    # the largest sequence number among existing numbers written in number_format, 0 when there are none
+    pattern = number_pattern(number_format)
+    highest = 0
+    for number, in db.query(t.number).filter(t.number.like(number_format.replace('#', '_'))).yield_per(1000):
+        match = pattern.fullmatch(number or '')
+        if match:
+            highest = max(highest, int(''.join(match.groups())))
+    return highest
+
+
+def reserve_number_block(t, number_format: str, size: int = NUMBER_BLOCK_SIZE):
+    # reserves a block on the shared counter in its own short transaction so the
+    # caller's session is never involved and other workers only wait for the update
+    name = t.__tablename__
+    sequence_db: Session = SessionLocal()
+    try:
+        for _ in range(2):
+            affected = sequence_db.execute(
+                update(models.NumberSequence)
+                .where(models.NumberSequence.name == name)
+                .values(next=models.NumberSequence.next + size)
+            ).rowcount
+            if affected:
+                end = sequence_db.query(models.NumberSequence.next).filter(
+                    models.NumberSequence.name == name).scalar()
+                sequence_db.commit()
+                return [end - size, end]
+
+            # first allocation, continue after the highest number already issued in this format
+            start = highest_issued_number(sequence_db, t, number_format) + 1
+            try:
+                sequence_db.add(models.NumberSequence(name=name, next=start + size))
+                sequence_db.commit()
+                return [start, start + size]
+            except IntegrityError:
+                # another worker created the counter first
+                sequence_db.rollback()
+        raise Exception(f'Unable to reserve numbers for {name}')
+    finally:
+        sequence_db.close()
+
+
+def next_sequence_number(t, number_format: str):
+    with number_blocks_lock:
+        block = number_blocks.get(t.__tablename__)
+        if not block or block[0] >= block[1]:
+            block = reserve_number_block(t, number_format)
+            number_blocks[t.__tablename__] = block
+        number = block[0]
+        block[0] += 1
+    return number
+
+
+def reserve_sequence_numbers(t, count: int, number_format: str):
+    # makes sure the next count numbers are already held by this process, for callers
+    # that are about to hold a write transaction open (the leftover of a short block is skipped)
+    with number_blocks_lock:
+        block = number_blocks.get(t.__tablename__)
+        if not block or block[1] - block[0] < count:
+            number_blocks[t.__tablename__] = reserve_number_block(t, number_format, max(count, NUMBER_BLOCK_SIZE))
+
+
+def format_number(number: int, number_format: str):
+    width = number_format.count('#')
+    digits = str(number).zfill(width)
+    if len(digits) > width:
+        raise Exception('Ticket number format has run out of numbers')
+    digits = iter(digits)
+    return re.sub(r'#', lambda _: next(digits), number_format)
+
+
 def generate_unique_number(db: Session, t):
-    sequence = get_settings_by_filter(
-        db, filter={'key': 'default_ticket_number_sequence'})
-    number_format = get_settings_by_filter(
-        db, filter={'key': 'default_ticket_number_format'})
+    current_settings = get_settings_snapshot(db)
+    sequence = current_settings.get('default_ticket_number_sequence')
+    number_format = current_settings.get('default_ticket_number_format')
 
-    if sequence.value == 'Random':
+    if sequence == 'Random':
         for _ in range(5):
-            number = re.sub(r'#', lambda _: str(random.randint(0, 9)), number_format.value)
-            if not db.query(t).filter(t.number == number).first():
+            number = re.sub(r'#', lambda _: str(random.randint(0, 9)), number_format)
+            if not db.query(t.number).filter(t.number == number).first():
                 return number
         raise Exception('Unable to find a unique ticket number')
+    elif sequence == 'Sequential':
+        # no query, the counter starts above every number already issued in the format
+        return format_number(next_sequence_number(t, number_format), number_format)
+    else:
+        raise NotImplementedError(f'Unknown ticket number sequence {sequence}')
+
+
+def add_numbered(db: Session, row, t):
+    # a clash is only possible with a Random number issued after the counter was seeded. the unique index on
+    # the number catches it and the next one is taken, in a savepoint so the caller's transaction carries on
+    db.flush()
+    for _ in range(NUMBER_BLOCK_SIZE * 5):
+        savepoint = db.begin_nested()
+        try:
+            db.add(row)
+            db.flush()
+            savepoint.commit()
+            return row
+        except IntegrityError as e:
+            savepoint.rollback()
+            if 'number' not in str(e.orig):
+                raise
+            row.number = generate_unique_number(db, t)
+    raise Exception('Unable to find a unique ticket number')
+
+
+def period_start(v, timezone: str = None):
+    try:
+        dt = datetime.now(tz=ZoneInfo(timezone))
+    except:
+        traceback.print_exc()
+        dt = datetime.now()
+        print("reverting to utc")
+    if v == 'td':
+        return dt
+    elif v == 'tw':
+        return dt - timedelta(days=dt.weekday())
+    elif v == 'tm':
+        return datetime(dt.year, dt.month, 1)
     else:
-        raise NotImplemented
+        return datetime(dt.year, 1, 1)
 
 
 def compute_operator(column: Column, op, v, timezone: str = None):
@@ -495,20 +894,9 @@ def compute_operator(column: Column, op, v, timezone: str = None):
         case 'not ilike':
             return column.not_ilike(f'%{v}%')
         case 'period':
-            try:
-                dt = datetime.now(tz=ZoneInfo(timezone))
-            except:
-                traceback.print_exc()
-                dt = datetime.now()
-                print("reverting to utc")
-            if v == 'td':
-                return column.__gt__(dt)
-            elif v == 'tw':
-                return column.__gt__(dt - timedelta(days=dt.weekday()))
-            elif v == 'tm':
-                return column.__gt__(datetime(dt.year, dt.month, 1))
-            elif v == 'ty':
-                return column.__gt__(datetime(dt.year, 1, 1))
+            if v in ['td', 'tw', 'tm', 'ty']:
+                # evaluated when the statement runs so compiled plans can be cached
+                return column.__gt__(bindparam(None, callable_=lambda: period_start(v, timezone), type_=column.type))
             else:
                 return column.__eq__(v)
         case default:
@@ -694,8 +1082,10 @@ def agent_reset_password(db: Session, password: str, token: str):
         if status != 0:
             return JSONResponse(content={'message': 'Cannot reset password for incomplete account'}, status_code=400)
 
-        db_agent.update({'password': hash_password(password)})
+        # a new password signs the agent out everywhere
+        db_agent.update({'password': hash_password(password), 'token_version': models.Agent.token_version + 1})
         db.commit()
+        agent_principal_cache.pop(db_agent.first().agent_id)
 
         return JSONResponse(content={'message': 'success'}, status_code=200)
 
@@ -748,8 +1138,12 @@ def update_agent(db: Session, agent_id: int, updates: AgentUpdate):
         updates_dict = updates.model_dump(exclude_unset=True)
         if not updates_dict:
             return agent
+        if TOKEN_REVOKING_FIELDS & updates_dict.keys():
+            updates_dict['token_version'] = models.Agent.token_version + 1
         db_agent.update(updates_dict)
         db.commit()
+        agent_permission_cache.pop(agent_id)
+        agent_principal_cache.pop(agent_id)
         db.refresh(agent)
     except:
         traceback.print_exc()
@@ -760,6 +1154,10 @@ def update_agent(db: Session, agent_id: int, updates: AgentUpdate):
 
 
 def delete_agent(db: Session, agent_id: int):
+    # the delete moves the agent's tickets to another rollup cell
+    ticket_ids = [ticket_id for ticket_id, in db.query(Ticket.ticket_id).filter(Ticket.agent_id == agent_id)]
+    stats_before = ticket_stats_snapshot(db, ticket_ids)
+
     affected = db.query(Agent).filter(Agent.agent_id == agent_id).delete()
     if affected == 0:
         return False
@@ -768,18 +1166,121 @@ def delete_agent(db: Session, agent_id: int):
 
     db.query(Ticket).filter(Ticket.agent_id ==
                             agent_id).update({'agent_id': 0})
+    record_ticket_stats(db, ticket_ids, stats_before)
 
     # commit changes (delete and update)
 
     db.commit()
+    agent_permission_cache.pop(agent_id)
+    agent_principal_cache.pop(agent_id)
+    # departments, groups and topics pointing at the agent were cleared by the delete
+    invalidate_reference_data()
 
     return True
 
 
+# the small lookup tables loaded whole once per process and served from memory. every write to them
+# bumps reference_data_version so this process reloads on the next read, other processes catch up within the ttl
+REFERENCE_MODELS = (models.TicketStatus, models.TicketPriority, models.SLA, models.Department,
+                    models.Topic, models.Category, models.Group)
+
+
+class ReferenceData:
+    def __init__(self, db: Session, version: int, ttl: float = 300):
+        self.version = version
+        self.expires = time.monotonic() + ttl
+        # model -> {primary key: row}, the rows are detached and only their columns are loaded
+        self._rows = {}
+        for model in REFERENCE_MODELS:
+            key = class_mapper(model).primary_key[0]
+            self._rows[model] = MappingProxyType({getattr(row, key.key): row for row in db.query(model).order_by(key).all()})
+        # what /ticket/form returns, every topic with its form fields
+        forms = {form.form_id: form for form in db.query(models.Form).options(selectinload(models.Form.fields)).all()}
+        self.topic_forms = [{'topic_id': topic.topic_id, 'topic': topic.topic,
+                             'form': self.form_dict(forms.get(topic.form_id))} for topic in self._rows[models.Topic].values()]
+
+    @staticmethod
+    def form_dict(form):
+        if form is None:
+            return None
+        fields = [{'field_id': field.field_id, 'type': field.type, 'label': field.label, 'name': field.name,
+                   'configuration': field.configuration, 'hint': field.hint} for field in form.fields]
+        return {'form_id': form.form_id, 'fields': fields}
+
+    def rows(self, model):
+        return self._rows[model]
+
+    def get(self, model, key):
+        return self._rows[model].get(key)
+
+
+reference_data: ReferenceData = None
+reference_data_version = 0
+reference_data_lock = threading.Lock()
+
+
+def invalidate_reference_data():
+    # call after the write is committed, so a reload can never pick up the old rows under the new version
+    global reference_data_version
+    with reference_data_lock:
+        reference_data_version += 1
+
+
+def refresh_reference_data():
+    global reference_data
+    version = reference_data_version
+    # a session of its own, the rows outlive the request that happened to trigger the load
+    db = SessionLocal()
+    try:
+        data = ReferenceData(db, version)
+    finally:
+        db.close()
+    with reference_data_lock:
+        if reference_data is None or reference_data.version <= version:
+            reference_data = data
+    return data
+
+
+def get_reference_data():
+    data = reference_data
+    if data is None or data.version != reference_data_version or data.expires < time.monotonic():
+        data = refresh_reference_data()
+    return data
+
+
+def load_reference_rows(model, keys, db: Session = None):
+    # keys missing from the reference data were written since it was loaded, by another process or in a
+    # transaction that has not committed yet. they are read here and a reload is due on the next read,
+    # ids that do not exist at all cost one query and no reload
+    key = class_mapper(model).primary_key[0]
+    own_db = db is None
+    if own_db:
+        db = SessionLocal()
+    try:
+        rows = {getattr(row, key.key): row for row in db.query(model).filter(key.in_(keys)).all()}
+    finally:
+        if own_db:
+            db.close()
+    if rows:
+        invalidate_reference_data()
+    return rows
+
+
+def reference_row(model, key, db: Session = None):
+    row = get_reference_data().get(model, key)
+    if row is None and key is not None:
+        row = load_reference_rows(model, [key], db).get(key)
+    return row
+
+
+def get_topic_forms():
+    return get_reference_data().topic_forms
+
+
 # CRUD Actions for a ticket
 
 # Create
-def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketCreate, creator: str, frontend_url: str = None):
+def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketCreate, creator: str, frontend_url: str = None, commit: bool = True):
     try:
 
         # Unpack data from request
@@ -790,8 +1291,7 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
         # print(form_values)
 
         # Get topic data for ticket
-        db_topic = db.query(models.Topic).filter(
-            models.Topic.topic_id == ticket.topic_id).first()
+        db_topic = reference_row(models.Topic, ticket.topic_id, db)
         # Get user_id by email or create new user
 
         db_user = get_user_by_filter(db, {'user_id': data['user_id']})
@@ -799,6 +1299,8 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
         if not db_user:
             raise HTTPException(400, 'User does not exist')
 
+        current_settings = get_settings_snapshot(db)
+
         # Create ticket
         db_ticket = Ticket(**data)
         db_ticket.user_id = db_user.user_id
@@ -812,9 +1314,7 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
             if not db_topic.dept_id:
                 pass
                 # do settings here
-                default_dept = db.query(models.Settings).filter(
-                    models.Settings.key == 'default_dept_id').first()
-                db_ticket.dept_id = default_dept.value
+                db_ticket.dept_id = current_settings.get_int('default_dept_id')
             else:
                 db_ticket.dept_id = db_topic.dept_id
 
@@ -822,9 +1322,7 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
             if not db_topic.status_id:
                 pass
                 # do settings here
-                default_status = db.query(models.Settings).filter(
-                    models.Settings.key == 'default_status_id').first()
-                db_ticket.status_id = default_status.value
+                db_ticket.status_id = current_settings.get_int('default_status_id')
             else:
                 db_ticket.status_id = db_topic.status_id
 
@@ -832,24 +1330,19 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
             if not db_topic.priority_id:
                 pass
                 # do settings here
-                default_priority = db.query(models.Settings).filter(
-                    models.Settings.key == 'default_priority_id').first()
-                db_ticket.priority_id = default_priority.value
+                db_ticket.priority_id = current_settings.get_int('default_priority_id')
             else:
                 db_ticket.priority_id = db_topic.priority_id
 
 
-        db_department = db.query(models.Department).filter(
-            models.Department.dept_id == db_ticket.dept_id).first()
+        db_department = reference_row(models.Department, db_ticket.dept_id, db)
         
         if not db_ticket.sla_id:
             if not db_topic.sla_id:
                 if not db_department or not db_department.sla_id:
                     # do settings here
                     # print('settings sla')
-                    default_sla = db.query(models.Settings).filter(
-                        models.Settings.key == 'default_sla_id').first()
-                    db_ticket.sla_id = int(default_sla.value)
+                    db_ticket.sla_id = current_settings.get_int('default_sla_id')
                 else:
                     # print('dept sla')
                     db_ticket.sla_id = db_department.sla_id
@@ -858,30 +1351,30 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
                 db_ticket.sla_id = db_topic.sla_id
         # We need to follow the flow of ticket -> topic -> department value for priority etc.
 
-        db_sla = db.query(models.SLA).filter(models.SLA.sla_id == db_ticket.sla_id).first()
+        db_sla = reference_row(models.SLA, db_ticket.sla_id, db)
         db_ticket.est_due_date = datetime.strptime((datetime.now(timezone.utc) + timedelta(hours=db_sla.grace_period)).strftime("%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
-        db.add(db_ticket)
-        db.commit()
+        add_numbered(db, db_ticket, Ticket)
+        record_ticket_stats(db, [db_ticket.ticket_id])
+        index_tickets(db, [db_ticket.ticket_id])
+        persist(db, commit)
+        invalidate_ticket_counts()
         db.refresh(db_ticket)
 
         if not db_ticket.dept_id:
             if db_topic.dept_id:
-                dept = db.query(models.Department).filter(
-                    models.Department.dept_id == db_topic.dept_id).first()
+                dept = reference_row(models.Department, db_topic.dept_id, db)
                 dept_manager_id = dept.manager_id
                 dept_manager = db.query(models.Agent).filter(
                     models.Agent.agent_id == dept_manager_id).first()
                 dept_manager_email = dept_manager.email
 
                 try:
-                    background_task.add_task(func=send_email, db=db, email_list=[
-                                             dept_manager_email], template='agent_new_ticket_alert', email_type='alert')
+                    enqueue_email(db, [dept_manager_email], template='agent_new_ticket_alert', email_type='alert', ref=f'ticket:{db_ticket.ticket_id}')
                 except:
                     traceback.print_exc()
                     print('Could not send new ticket email to department manager')
         else:
-            dept = db.query(models.Department).filter(
-                models.Department.dept_id == db_ticket.dept_id).first()
+            dept = reference_row(models.Department, db_ticket.dept_id, db)
             if dept.manager_id:
                 dept_manager_id = dept.manager_id
                 dept_manager = db.query(models.Agent).filter(
@@ -889,8 +1382,7 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
                 dept_manager_email = dept_manager.email
 
                 try:
-                    background_task.add_task(func=send_email, db=db, email_list=[
-                                            dept_manager_email], template='agent_new_ticket_alert', email_type='alert')
+                    enqueue_email(db, [dept_manager_email], template='agent_new_ticket_alert', email_type='alert', ref=f'ticket:{db_ticket.ticket_id}')
                 except:
                     traceback.print_exc()
                     print('Could not send new ticket email to department manager')
@@ -901,7 +1393,7 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
                           'form_id': db_topic.form_id}
             db_form_entry = models.FormEntry(**form_entry)
             db.add(db_form_entry)
-            db.commit()
+            persist(db, commit)
             db.refresh(db_form_entry)
 
         # Create FormValues
@@ -909,15 +1401,16 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
             db_form_value = models.FormValue(**form_value)
             db_form_value.entry_id = db_form_entry.entry_id
             db.add(db_form_value)
-        db.commit()
+        persist(db, commit)
 
         # Create New Thread
         db_thread = models.Thread(**{'ticket_id': db_ticket.ticket_id})
         db.add(db_thread)
-        db.commit()
+        persist(db, commit)
 
         # Send email regarding new ticket
         user_email = db_user.email
+        agent_email = None
         if db_ticket.agent_id:
             agent = db.query(models.Agent).filter(
                 models.Agent.agent_id == db_ticket.agent_id).first()
@@ -929,8 +1422,7 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
             if db_user.status == 0:
                 # Send regular new ticket notice to registered users
                 try:
-                    background_task.add_task(func=send_email, db=db, email_list=[
-                                            user_email], template='user_new_ticket_notice', email_type='alert')
+                    enqueue_email(db, [user_email], template='user_new_ticket_notice', email_type='alert', ref=f'ticket:{db_ticket.ticket_id}')
                 except:
                     traceback.print_exc()
                     print('Could not send new ticket email to user')
@@ -938,81 +1430,47 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
                 # Send guest new ticket notice to unregistered users
                 try:
                     ticket_confirm_url = frontend_url + '/guest/ticket_search'
-                    email_thread = threading.Thread(target=asyncio.run, args=(send_email(db=db, email_list=[user_email], template='guest_ticket_email_confirmation', email_type='alert', values=[db_ticket.number, ticket_confirm_url]),))
-                    email_thread.start()
-                    email_thread.join()
+                    enqueue_email(db, [user_email], template='guest_ticket_email_confirmation', email_type='alert', values=[db_ticket.number, ticket_confirm_url], ref=f'ticket:{db_ticket.ticket_id}')
                 except:
                     traceback.print_exc()
                     print('Could not send new ticket email to user')
         # Sending the user confirmations their ticket was made 
         elif creator == 'user':
             if db_topic.auto_resp:
-                if ticket.source == 'native':
-                    try:
-                        background_task.add_task(func=send_email, db=db, email_list=[user_email], template='user_new_ticket_auto_response', email_type='alert')
-                    except:
-                        traceback.print_exc()
-                        print('Could not send new ticket email to user')
-                elif ticket.source == 'email':
-                    try:
-                        email_thread = threading.Thread(target=asyncio.run, args=(send_email(db=db, email_list=[user_email], template='user_new_ticket_auto_response', email_type='alert'),))
-                        email_thread.start()
-                        email_thread.join()
-                    except:
-                        traceback.print_exc()
-                        print('Could not send new ticket email to user')
+                try:
+                    enqueue_email(db, [user_email], template='user_new_ticket_auto_response', email_type='alert', ref=f'ticket:{db_ticket.ticket_id}')
+                except:
+                    traceback.print_exc()
+                    print('Could not send new ticket email to user')
 
             if db_user.status != 0:
                 # guest and users who have not finished the registration process
-                if ticket.source == 'native':
-                    try:
-                        ticket_confirm_url = frontend_url + '/guest/ticket_search'
-                        background_task.add_task(func=send_email, db=db, email_list=[user_email], template='guest_ticket_email_confirmation', email_type='alert', values=[db_ticket.number, ticket_confirm_url])
-                    except:
-                        traceback.print_exc()
-                        print('Could not send new ticket email to user')
-                elif ticket.source == 'email':
-                    try:
-                        ticket_confirm_url = frontend_url + '/guest/ticket_search'
-                        email_thread = threading.Thread(target=asyncio.run, args=(send_email(db=db, email_list=[user_email], template='guest_ticket_email_confirmation', email_type='alert', values=[db_ticket.number, ticket_confirm_url]),))
-                        email_thread.start()
-                        email_thread.join()
-                    except:
-                        traceback.print_exc()
-                        print('Could not send new ticket email to user')
-            
-            elif db_user.status == 0:
-                # fully registered users
-                if ticket.source == 'native':
-                    try:
-                        background_task.add_task(func=send_email, db=db, email_list=[user_email], template='ticket_email_confirmation', email_type='alert', values=[db_ticket.number])
-                    except:
-                        traceback.print_exc()
-                        print('Could not send new ticket email to user')
-                elif ticket.source == 'email':
-                    try:
-                        email_thread = threading.Thread(target=asyncio.run, args=(send_email(db=db, email_list=[user_email], template='ticket_email_confirmation', email_type='alert', values=[db_ticket.number]),))
-                        email_thread.start()
-                        email_thread.join()
-                    except:
-                        traceback.print_exc()
-                        print('Could not send new ticket email to user')
-        # If an agent was assigned on the ticket
-        if agent_email:
-            if ticket.source == 'native':
                 try:
-                    background_task.add_task(func=send_email, db=db, email_list=[agent_email], template='agent_ticket_assignment_alert', email_type='alert')
+                    ticket_confirm_url = frontend_url + '/guest/ticket_search'
+                    enqueue_email(db, [user_email], template='guest_ticket_email_confirmation', email_type='alert', values=[db_ticket.number, ticket_confirm_url], ref=f'ticket:{db_ticket.ticket_id}')
                 except:
                     traceback.print_exc()
-                    print('Could not send new ticket email to agent')
-            elif ticket.source == 'email':
+                    print('Could not send new ticket email to user')
+            
+            elif db_user.status == 0:
+                # fully registered users
                 try:
-                    email_thread = threading.Thread(target=asyncio.run, args=(send_email(db=db, email_list=[agent_email], template='agent_ticket_assignment_alert', email_type='alert'),))
-                    email_thread.start()
-                    email_thread.join()
+                    enqueue_email(db, [user_email], template='ticket_email_confirmation', email_type='alert', values=[db_ticket.number], ref=f'ticket:{db_ticket.ticket_id}')
                 except:
                     traceback.print_exc()
-                    print('Could not send new ticket email to agent')
+                    print('Could not send new ticket email to user')
+        # If an agent was assigned on the ticket
+        if agent_email:
+            try:
+                enqueue_email(db, [agent_email], template='agent_ticket_assignment_alert', email_type='alert', ref=f'ticket:{db_ticket.ticket_id}')
+            except:
+                traceback.print_exc()
+                print('Could not send new ticket email to agent')
+
+        # the queued mail is committed with the ticket's last writes and sent by the outbox worker
+        persist(db, commit)
+        if commit:
+            notify_outbox()
 
         return db_ticket
     except:
@@ -1022,8 +1480,36 @@ def create_ticket(background_task: BackgroundTasks, db: Session, ticket: TicketC
 # Read
 
 
-def get_ticket_by_filter(db: Session, filter: dict):
-    q = db.query(Ticket)
+# eager loading options for each ticket response schema, so serializing a page
+# costs a fixed number of queries instead of one lazy load per relationship per row
+def ticket_loader_options(profile: str):
+    form_entry = selectinload(Ticket.form_entry)
+    form_entry_options = [form_entry.selectinload(models.FormEntry.values),
+                          form_entry.selectinload(models.FormEntry.form).selectinload(models.Form.fields)]
+    match profile:
+        case 'list':
+            # TicketJoinedSimple
+            return [selectinload(Ticket.agent), selectinload(Ticket.user), selectinload(Ticket.status),
+                    selectinload(Ticket.dept), selectinload(Ticket.sla), selectinload(Ticket.category),
+                    selectinload(Ticket.group), selectinload(Ticket.priority), selectinload(Ticket.topic),
+                    *form_entry_options]
+        case 'detail':
+            # TicketJoined / TicketJoinedUser
+            thread = selectinload(Ticket.thread)
+            return ticket_loader_options('list') + [
+                thread.selectinload(models.Thread.collaborators),
+                thread.selectinload(models.Thread.entries).selectinload(models.ThreadEntry.attachments),
+                thread.selectinload(models.Thread.events)]
+        case 'user_list':
+            # TicketJoinedSimpleUser
+            return [selectinload(Ticket.status), selectinload(Ticket.dept), selectinload(Ticket.topic),
+                    *form_entry_options]
+        case _:
+            return []
+
+
+def get_ticket_by_filter(db: Session, filter: dict, profile: str = None):
+    q = db.query(Ticket).options(*ticket_loader_options(profile))
     for attr, value in filter.items():
         q = q.filter(getattr(Ticket, attr) == value)
     return q.first()
@@ -1058,7 +1544,7 @@ def get_ticket_by_advanced_search_for_user(db: Session, user_id: int, raw_filter
         filters = [models.Ticket.user_id.__eq__(user_id)]
         orders = []
         table_set = set()
-        query = db.query(models.Ticket)
+        query = db.query(models.Ticket).options(*ticket_loader_options('user_list'))
 
         for data, op, v in raw_filters:
 
@@ -1102,121 +1588,469 @@ def get_ticket_by_advanced_search_for_user(db: Session, user_id: int, raw_filter
         raise HTTPException(400, 'Error during queue builder')
 
 
-def get_ticket_by_advanced_search(db: Session, agent_id: int, raw_filters: dict, sorts: dict, search: str):
-    try:
-        filters = []
-        orders = []
-        table_set = set()
-        query = db.query(models.Ticket)
+# a compiled ticket search: tables to join, filter expressions and (column, desc) sort keys
+TicketQueryPlan = namedtuple('TicketQueryPlan', ['key', 'tables', 'filters', 'sorts'])
 
-        agent = db.query(models.Agent).filter(
-            models.Agent.agent_id == agent_id).first()
-        if agent:
-            timezone = agent.timezone
+# 300s like the settings snapshot, so other workers pick up an edited queue within five minutes
+ticket_plan_cache = TTLCache(maxsize=2048, ttl=300)
+queue_config_cache = TTLCache(maxsize=1024, ttl=300)
 
-        for data, op, v in raw_filters:
 
-            special = special_filter(agent_id, data, op, v)
+def compile_ticket_plan(key, agent_id: int, raw_filters: list, sorts: list, timezone: str = None):
+    filters = []
+    sort_keys = []
+    tables = []
 
-            if special is not None:
-                table, _ = split_col_string(data)
-                table_set.add(table)
-                filters.append(special)
-            else:
-                table, col = split_col_string(data)
-                table_set.add(table)
-                mapper = class_mapper(class_dict[table])
-                if not hasattr(mapper.columns, col):
-                    continue
-                filters.append(compute_operator(
-                    mapper.columns[col], op, v, timezone))
+    search_ranks = []
 
-        for data in sorts:
-            desc = True if data[0] == '-' else False
-            if desc:
-                data = data[1:]
+    for data, op, v in raw_filters:
 
-            table, col = split_col_string(data)
-            table_set.add(table)
+        if op == 'search':
+            # full text match over the ticket, its thread entries are part of the document
+            filters.append(ticket_search_filter(v))
+            rank = ticket_search_rank(v)
+            if rank is not None:
+                search_ranks.append(rank)
+            continue
+
+        special = special_filter(agent_id, data, op, v)
+        table, col = split_col_string(data)
+        if table not in tables:
+            tables.append(table)
+
+        if special is not None:
+            filters.append(special)
+        else:
             mapper = class_mapper(class_dict[table])
             if not hasattr(mapper.columns, col):
                 continue
-            orders.append(mapper.columns[col].desc()
-                          if desc else mapper.columns[col].asc())
+            filters.append(compute_operator(
+                mapper.columns[col], op, v, timezone))
+
+    for data in sorts:
+        desc = True if data[0] == '-' else False
+        if desc:
+            data = data[1:]
+
+        table, col = split_col_string(data)
+        if table not in tables:
+            tables.append(table)
+        mapper = class_mapper(class_dict[table])
+        if not hasattr(mapper.columns, col):
+            continue
+        sort_keys.append((mapper.columns[col], desc))
+
+    # best matches first, the queue sorts break ties
+    sort_keys = [(rank, True) for rank in search_ranks] + sort_keys
+
+    if 'tickets' in tables:
+        tables.remove('tickets')
+
+    return TicketQueryPlan(key, tuple(tables), tuple(filters), tuple(sort_keys))
+
+
+def get_ticket_plan(db: Session, agent_id: int, raw_filters: list, sorts: list, queue_id: int = None):
+    principal = get_agent_principal(agent_id, db)
+    agent_timezone = principal.timezone if principal else None
+    config_hash = hashlib.sha1(json.dumps(
+        [raw_filters, sorts], sort_keys=True, default=str).encode()).hexdigest()
+
+    key = (queue_id, config_hash, agent_id, agent_timezone)
+    plan = ticket_plan_cache.get(key)
+    if plan is None:
+        plan = compile_ticket_plan(key, agent_id, raw_filters, sorts, agent_timezone)
+        ticket_plan_cache.set(key, plan)
+    return plan
+
+
+def get_queue_config(db: Session, queue_id: int):
+    config = queue_config_cache.get(queue_id)
+    if config is None:
+        db_queue = db.query(models.Queue).filter(
+            models.Queue.queue_id == queue_id).first()
+        if not db_queue:
+            raise KeyError(f'Queue with queue_id {queue_id} not found')
+        config = json.loads(db_queue.config)
+        queue_config_cache.set(queue_id, config)
+    return config
+
+
+def get_queue_plan(db: Session, agent_id: int, queue_id: int):
+    config = get_queue_config(db, queue_id)
+    return get_ticket_plan(db, agent_id, config['filters'], config['sorts'], queue_id=queue_id)
+
+
+def agent_page_size(agent_data: AgentData, size: int = None):
+    if size is None:
+        size = agent_data.principal.preferences.get('agent_default_page_size', 10)
+    return int(size)
+
+
+def resolve_queue(db: Session, agent_data: AgentData, queue_id: int, size: int = None):
+    # shared by the sync and async queue routes (the latter through run_sync): queue 0 is the agent's
+    # default queue, or the site default when the agent has none, and no size is the agent's page size
+    if queue_id == 0:
+        queue_id = agent_data.principal.preferences.get('agent_default_ticket_queue', None)
+        if queue_id == 0:
+            queue_id = get_settings_snapshot(db).get_int('default_ticket_queue')
+    try:
+        plan = get_queue_plan(db, agent_data.agent_id, queue_id)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f'Queue with queue_id {queue_id} not found')
+    return queue_id, agent_page_size(agent_data, size), plan
+
+
+def invalidate_queue_plans(queue_id: int):
+    queue_config_cache.pop(queue_id)
+    ticket_plan_cache.invalidate(lambda key: key[0] == queue_id)
+
+
+def get_ticket_plan_stats():
+    return {'plans': ticket_plan_cache.stats(), 'queue_configs': queue_config_cache.stats()}
+
+
+def build_ticket_query(db: Session, plan: TicketQueryPlan, search: str = None, profile: str = 'list'):
+    query = db.query(models.Ticket).options(*ticket_loader_options(profile))
+
+    # join the query on all the tables required
+    for table in plan.tables:
+        query = query.join(class_dict[table])
+
+    query = query.filter(*plan.filters)
+    if search is not None and search != '':
+        query = query.filter(ticket_search_filter(search))
+
+    return query.order_by(*[column.desc() if desc else column.asc() for column, desc in plan.sorts])
+
+
+# keyset pagination: the cursor holds the sort values of the last row seen plus its ticket_id
+def encode_cursor(values: list):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str, columns: list):
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if len(values) != len(columns):
+        raise ValueError('Cursor does not match the sort order')
+    decoded = []
+    for column, value in zip(columns, values):
+        if value is not None and column.type.python_type is datetime:
+            value = datetime.fromisoformat(value)
+        decoded.append(value)
+    return decoded
+
+
+def cursor_sort_keys(plan: TicketQueryPlan, dialect: str):
+    sort_keys = list(plan.sorts) + [(models.Ticket.ticket_id, False)]
+    if dialect != 'sqlite':
+        return sort_keys
+    # sqlite orders datetimes by their stored text, and func.now() stores them without the microseconds a bound
+    # datetime is rendered with, so the cursor keeps and compares that text
+    return [(type_coerce(column, String).label(None) if isinstance(column.type, DateTime) else column, desc) for column, desc in sort_keys]
+
+
+def keyset_filter(sort_keys: list, values: list):
+    # rows strictly after the cursor in (sort keys..., ticket_id) order with nulls last
+    conditions = []
+    equal = []
+    for (column, desc), value in zip(sort_keys, values):
+        if value is None:
+            equal.append(column.is_(None))
+            continue
+        after = column.__lt__(value) if desc else column.__gt__(value)
+        conditions.append(and_(*equal, or_(after, column.is_(None))))
+        equal.append(column.__eq__(value))
+    return or_(*conditions)
+
+
+def paginate_ticket_cursor(db: Session, plan: TicketQueryPlan, search: str, cursor: str, size: int, with_total: bool = False):
+    if size < 1:
+        raise HTTPException(400, 'Page size must be at least 1')
+    try:
+        sort_keys = cursor_sort_keys(plan, db.bind.dialect.name)
+        columns = [column for column, _ in sort_keys]
+
+        query = build_ticket_query(db, plan, search).order_by(None)
+        total = count_ticket_plan(db, plan, search)[0] if with_total else None
+
+        query = query.add_columns(*columns)
+        if cursor:
+            query = query.filter(keyset_filter(sort_keys, decode_cursor(cursor, columns)))
+        query = query.order_by(*[(column.desc() if desc else column.asc()).nulls_last() for column, desc in sort_keys])
+
+        rows = query.limit(size + 1).all()
+        next_cursor = encode_cursor(list(rows[size - 1][1:])) if len(rows) > size else None
+
+        return {'items': [row[0] for row in rows[:size]], 'size': size, 'next_cursor': next_cursor, 'total': total}
+
+    except:
+        traceback.print_exc()
+        raise HTTPException(400, 'Error during cursor pagination')
+
+
+# totals per (plan key, search), short lived and cleared whenever a ticket is written
+ticket_count_cache = TTLCache(maxsize=4096, ttl=30)
+
+
+def invalidate_ticket_counts():
+    ticket_count_cache.clear()
+
+
+def ticket_count_select(plan: TicketQueryPlan, search: str = None, label=None):
+    columns = [func.count(Ticket.ticket_id).label('count')]
+    if label is not None:
+        columns.insert(0, literal(label).label('queue_id'))
+    query = select(*columns).select_from(Ticket)
+    for table in plan.tables:
+        query = query.join(class_dict[table])
+    query = query.where(*plan.filters)
+    if search is not None and search != '':
+        query = query.where(ticket_search_filter(search))
+    return query
+
+
+def count_ticket_plan(db: Session, plan: TicketQueryPlan, search: str = None):
+    # returns (total, exact) where exact is False when the total came from the cache
+    key = (plan.key, search or '')
+    total = ticket_count_cache.get(key)
+    if total is not None:
+        return total, False
+    total = db.execute(ticket_count_select(plan, search)).scalar()
+    ticket_count_cache.set(key, total)
+    return total, True
+
+
+def get_queue_counts(db: Session, agent_id: int):
+    counts = {}
+    selects = []
+    queues = get_queues_for_agent(db, agent_id)
+    for queue in queues:
+        try:
+            plan = get_queue_plan(db, agent_id, queue.queue_id)
+        except:
+            traceback.print_exc()
+            continue
+        total = ticket_count_cache.get((plan.key, ''))
+        if total is not None:
+            counts[queue.queue_id] = {'queue_id': queue.queue_id, 'count': total, 'exact': False}
+        else:
+            selects.append((plan, ticket_count_select(plan, label=queue.queue_id)))
+
+    # every uncached queue is counted in a single round trip
+    if selects:
+        plans = {plan.key[0]: plan for plan, _ in selects}
+        for queue_id, total in db.execute(union_all(*[query for _, query in selects])).all():
+            ticket_count_cache.set((plans[queue_id].key, ''), total)
+            counts[queue_id] = {'queue_id': queue_id, 'count': total, 'exact': True}
+
+    return [counts[queue.queue_id] for queue in queues if queue.queue_id in counts]
+
+
+def get_ticket_by_advanced_search(db: Session, agent_id: int, raw_filters: dict, sorts: dict, search: str):
+    try:
+        plan = get_ticket_plan(db, agent_id, raw_filters, sorts)
+        return build_ticket_query(db, plan, search)
+
+    except:
+        traceback.print_exc()
+        raise HTTPException(400, 'Error during queue builder')
+
+
+def get_ticket_by_queue(db: Session, agent_id: int, queue_id: int, search: str):
+    try:
+        plan = get_queue_plan(db, agent_id, queue_id)
+        return build_ticket_query(db, plan, search)
+
+    except:
+        traceback.print_exc()
+        raise HTTPException(400, 'Error during queue builder')
+
+
+# async versions of the hot ticket reads, used by the routes served from the async engine.
+# everything a response serializes is eager loaded since an AsyncSession cannot lazy load
+
+def ticket_plan_select(plan: TicketQueryPlan, search: str = None, profile: str = 'list'):
+    query = select(Ticket).options(*ticket_loader_options(profile))
+    for table in plan.tables:
+        query = query.join(class_dict[table])
+    query = query.where(*plan.filters)
+    if search is not None and search != '':
+        query = query.where(ticket_search_filter(search))
+    return query.order_by(*[column.desc() if desc else column.asc() for column, desc in plan.sorts])
+
 
-        # join the query on all the tables required
-        table_set.discard('tickets')
-        for table in table_set:
-            query = query.join(class_dict[table])
+async def get_ticket_by_filter_async(db: AsyncSession, filter: dict, profile: str = None):
+    query = select(Ticket).options(*ticket_loader_options(profile))
+    for attr, value in filter.items():
+        query = query.where(getattr(Ticket, attr) == value)
+    return (await db.execute(query.limit(1))).scalars().first()
 
-        if search is not None and search != '':
-            filters.append((Ticket.number + Ticket.title).ilike(f'%{search}%'))
 
-        return query.filter(*filters).order_by(*orders)
+async def get_ticket_plan_async(db: AsyncSession, agent_id: int, raw_filters: list, sorts: list):
+    # plans are cached, so this is usually a lookup, compiling one reuses the sync code
+    return await db.run_sync(get_ticket_plan, agent_id, raw_filters, sorts)
+
+
+async def get_ticket_by_advanced_search_async(db: AsyncSession, agent_id: int, raw_filters: dict, sorts: dict, search: str):
+    try:
+        plan = await get_ticket_plan_async(db, agent_id, raw_filters, sorts)
+        return ticket_plan_select(plan, search)
 
     except:
         traceback.print_exc()
         raise HTTPException(400, 'Error during queue builder')
 
 
-def get_ticket_by_queue(db: Session, agent_id: int, queue_id: int, search: str):
+async def count_ticket_plan_async(db: AsyncSession, plan: TicketQueryPlan, search: str = None):
+    key = (plan.key, search or '')
+    total = ticket_count_cache.get(key)
+    if total is not None:
+        return total, False
+    total = (await db.execute(ticket_count_select(plan, search))).scalar()
+    ticket_count_cache.set(key, total)
+    return total, True
+
+
+async def get_ticket_page_async(db: AsyncSession, plan: TicketQueryPlan, search: str, page: int, size: int):
+    query = ticket_plan_select(plan, search).offset((page - 1) * size).limit(size)
+    return (await db.execute(query)).scalars().all()
+
+
+async def paginate_ticket_cursor_async(db: AsyncSession, plan: TicketQueryPlan, search: str, cursor: str, size: int, with_total: bool = False):
+    if size < 1:
+        raise HTTPException(400, 'Page size must be at least 1')
     try:
+        sort_keys = cursor_sort_keys(plan, db.bind.dialect.name)
+        columns = [column for column, _ in sort_keys]
 
-        db_queue = db.query(models.Queue).filter(
-            models.Queue.queue_id == queue_id).first()
-        if not db_queue:
-            raise KeyError(f'Queue with queue_id {queue_id} not found')
+        query = ticket_plan_select(plan, search).order_by(None)
+        total = (await count_ticket_plan_async(db, plan, search))[0] if with_total else None
+
+        query = query.add_columns(*columns)
+        if cursor:
+            query = query.where(keyset_filter(sort_keys, decode_cursor(cursor, columns)))
+        query = query.order_by(*[(column.desc() if desc else column.asc()).nulls_last() for column, desc in sort_keys])
+
+        rows = (await db.execute(query.limit(size + 1))).all()
+        next_cursor = encode_cursor(list(rows[size - 1][1:])) if len(rows) > size else None
 
-        adv_search = json.loads(db_queue.config)
-        return get_ticket_by_advanced_search(db, agent_id, adv_search['filters'], adv_search['sorts'], search=search)
+        return {'items': [row[0] for row in rows[:size]], 'size': size, 'next_cursor': next_cursor, 'total': total}
 
     except:
         traceback.print_exc()
-        raise HTTPException(400, 'Error during queue builder')
+        raise HTTPException(400, 'Error during cursor pagination')
+
+
+TICKET_STATS_FIELDS = ('created', 'updated', 'overdue')
+# writes touching these refresh the full text search documents
+TICKET_SEARCH_FIELDS = {'number', 'title', 'description'}
+USER_SEARCH_FIELDS = {'firstname', 'lastname', 'email'}
+TICKET_STATS_BATCH_SIZE = 500
+
+
+def ticket_stats_counts(row):
+    # the dashboard counters one ticket contributes, keyed by (date, dept_id, topic_id, agent_id, counter)
+    counts = Counter()
+    dims = (row.dept_id or 0, row.topic_id or 0, row.agent_id or 0)
+    if row.created:
+        counts[(row.created.date(), *dims, 'created')] += 1
+    if row.updated:
+        counts[(row.updated.date(), *dims, 'updated')] += 1
+    deadline = row.due_date or row.est_due_date
+    if row.overdue == 1 and deadline:
+        counts[(deadline.date(), *dims, 'overdue')] += 1
+    return counts
+
+
+def ticket_stats_snapshot(db: Session, ticket_ids: list):
+    counts = Counter()
+    for i in range(0, len(ticket_ids), TICKET_STATS_BATCH_SIZE):
+        rows = db.query(Ticket.created, Ticket.updated, Ticket.due_date, Ticket.est_due_date, Ticket.overdue,
+                        Ticket.dept_id, Ticket.topic_id, Ticket.agent_id) \
+            .filter(Ticket.ticket_id.in_(ticket_ids[i:i + TICKET_STATS_BATCH_SIZE])).all()
+        for row in rows:
+            counts.update(ticket_stats_counts(row))
+    return counts
+
+
+def apply_ticket_stats(db: Session, delta: Counter):
+    # adds the counter changes to the rollup inside the caller's transaction
+    cells = {}
+    for (date, dept_id, topic_id, agent_id, field), value in delta.items():
+        if value:
+            cells.setdefault((date, dept_id, topic_id, agent_id), {})[field] = value
+
+    stats = models.TicketDailyStats
+    for (date, dept_id, topic_id, agent_id), values in cells.items():
+        cell = and_(stats.date == date, stats.dept_id == dept_id, stats.topic_id == topic_id, stats.agent_id == agent_id)
+        increments = {field: getattr(stats, field) + value for field, value in values.items()}
+        if db.execute(update(stats).where(cell).values(**increments)).rowcount:
+            continue
+        try:
+            with db.begin_nested():
+                db.execute(insert(stats).values(date=date, dept_id=dept_id, topic_id=topic_id, agent_id=agent_id,
+                                                **{field: values.get(field, 0) for field in TICKET_STATS_FIELDS}))
+        except IntegrityError:
+            # another writer created the cell first
+            db.execute(update(stats).where(cell).values(**increments))
+
+
+def record_ticket_stats(db: Session, ticket_ids: list, before: Counter = None):
+    # call after the tickets were written (and flushed) with the snapshot taken before the write,
+    # a new ticket has no snapshot and a deleted one no longer shows up in the second one
+    delta = ticket_stats_snapshot(db, ticket_ids)
+    delta.subtract(before or Counter())
+    apply_ticket_stats(db, delta)
+
+
+def rebuild_ticket_daily_stats(db: Session = None, only_if_empty: bool = False):
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        if only_if_empty and (db.query(models.TicketDailyStats).first() or not db.query(Ticket.ticket_id).first()):
+            return 0
+        counts = Counter()
+        rows = db.query(Ticket.created, Ticket.updated, Ticket.due_date, Ticket.est_due_date, Ticket.overdue,
+                        Ticket.dept_id, Ticket.topic_id, Ticket.agent_id).yield_per(TICKET_STATS_BATCH_SIZE)
+        for row in rows:
+            counts.update(ticket_stats_counts(row))
+
+        cells = {}
+        for (date, dept_id, topic_id, agent_id, field), value in counts.items():
+            cell = cells.setdefault((date, dept_id, topic_id, agent_id), {'date': date, 'dept_id': dept_id, 'topic_id': topic_id, 'agent_id': agent_id,
+                                                                         **{f: 0 for f in TICKET_STATS_FIELDS}})
+            cell[field] = value
+
+        db.query(models.TicketDailyStats).delete()
+        if cells:
+            db.execute(insert(models.TicketDailyStats), list(cells.values()))
+        db.commit()
+        print(f'rebuilt {len(cells)} ticket stats rows')
+        return len(cells)
+    except:
+        db.rollback()
+        raise
+    finally:
+        if own_session:
+            db.close()
 
 
 def get_ticket_between_date(db: Session, beginning_date: datetime, end_date: datetime):
     try:
-        # Step 1: Create individual subqueries for each event date
-        created_subq = db.query(func.date(Ticket.created).label("event_date")).filter(
-            func.date(Ticket.created).between(beginning_date, end_date)
-        )
-        updated_subq = db.query(func.date(Ticket.updated).label("event_date")).filter(
-            func.date(Ticket.updated).between(beginning_date, end_date)
-        )
-        due_date_subq = db.query(func.date(Ticket.due_date).label("event_date")).filter(
-            func.date(Ticket.due_date).between(beginning_date, end_date)
-        )
-        est_due_date_subq = db.query(func.date(Ticket.est_due_date).label("event_date")).filter(
-            func.date(Ticket.est_due_date).between(beginning_date, end_date)
-        )
-
-        # Step 2: Use `union()` to remove duplicate event dates
-        subquery = union(created_subq, updated_subq, due_date_subq, est_due_date_subq).alias("subquery") 
-
+        stats = models.TicketDailyStats
+        totals = [func.sum(getattr(stats, field)) for field in TICKET_STATS_FIELDS]
         query = (
-            db.query(
-                subquery.c.event_date,
-                func.count(case((func.date(Ticket.created) == subquery.c.event_date, 1))).label(
-                    'created'),
-                func.count(case((func.date(Ticket.updated) == subquery.c.event_date, 1))).label(
-                    'updated'),
-                func.count(
-                    case(
-                        # Check if due_date exists first
-                        ((Ticket.due_date.isnot(None)) & (func.date(Ticket.due_date) == subquery.c.event_date) & (Ticket.overdue == 1), 1),
-                        # If due_date is NULL, fallback to est_due_date
-                        ((Ticket.due_date.is_(None)) & (func.date(Ticket.est_due_date) == subquery.c.event_date) & (Ticket.overdue == 1), 1)
-                    )
-                ).label('overdue')
-            )
-            .outerjoin(Ticket, (func.date(Ticket.created) == subquery.c.event_date) | (func.date(Ticket.updated) == subquery.c.event_date) | (func.date(Ticket.due_date) == subquery.c.event_date) | (func.date(Ticket.est_due_date) == subquery.c.event_date))
-            .group_by(subquery.c.event_date)
-            .order_by(subquery.c.event_date)
+            db.query(stats.date, *totals)
+            .filter(stats.date.between(beginning_date.date(), end_date.date()))
+            .group_by(stats.date)
+            # cells whose tickets all moved elsewhere stay behind with zero counts
+            .having(or_(*[total != 0 for total in totals]))
+            .order_by(stats.date)
         )
 
         results = query.all()
-        results = [{'date': result[0], 'created': result[1],
+        results = [{'date': datetime.combine(result[0], datetime.min.time()), 'created': result[1],
                     'updated': result[2], 'overdue': result[3]} for result in results]
         return results
     except:
@@ -1226,66 +2060,19 @@ def get_ticket_between_date(db: Session, beginning_date: datetime, end_date: dat
 
 def get_statistics_between_date(db: Session, beginning_date: datetime, end_date: datetime, category: str, agent_id: int):
     try:
-        if category == 'department':
-            query = (
-                db.query(
-                    Ticket.dept_id.label('department'),
-                    func.count(case((func.date(Ticket.created).between(
-                        beginning_date, end_date), 1))).label('created'),
-                    func.count(case((func.date(Ticket.updated).between(
-                        beginning_date, end_date), 1))).label('updated'),
-                    func.count(
-                        case(
-                            # Case 1: Check due_date if it exists
-                            ((Ticket.due_date.isnot(None)) & (func.date(Ticket.due_date).between(beginning_date, end_date)) & (Ticket.overdue == 1), 1),
-                            # Case 2: If due_date is NULL, check est_due_date
-                            ((Ticket.due_date.is_(None)) & (func.date(Ticket.est_due_date).between(beginning_date, end_date)) & (Ticket.overdue == 1), 1)
-                        )
-                    ).label('overdue')
-                )
-                .group_by(Ticket.dept_id)
-            )
-        elif category == 'topics':
-            query = (
-                db.query(
-                    Ticket.topic_id.label('topics'),
-                    func.count(case((func.date(Ticket.created).between(
-                        beginning_date, end_date), 1))).label('created'),
-                    func.count(case((func.date(Ticket.updated).between(
-                        beginning_date, end_date), 1))).label('updated'),
-                    func.count(
-                        case(
-                            # Case 1: Check due_date if it exists
-                            ((Ticket.due_date.isnot(None)) & (func.date(Ticket.due_date).between(beginning_date, end_date)) & (Ticket.overdue == 1), 1),
-                            # Case 2: If due_date is NULL, check est_due_date
-                            ((Ticket.due_date.is_(None)) & (func.date(Ticket.est_due_date).between(beginning_date, end_date)) & (Ticket.overdue == 1), 1)
-                        )
-                    ).label('overdue')
-                )
-                .group_by(Ticket.topic_id)
-            )
-        elif category == 'agent':
-            query = (
-                db.query(
-                    Ticket.agent_id.label('agent'),
-                    func.count(case((func.date(Ticket.created).between(
-                        beginning_date, end_date), 1))).label('created'),
-                    func.count(case((func.date(Ticket.updated).between(
-                        beginning_date, end_date), 1))).label('updated'),
-                    func.count(
-                        case(
-                            # Case 1: Check due_date if it exists
-                            ((Ticket.due_date.isnot(None)) & (func.date(Ticket.due_date).between(beginning_date, end_date)) & (Ticket.overdue == 1), 1),
-                            # Case 2: If due_date is NULL, check est_due_date
-                            ((Ticket.due_date.is_(None)) & (func.date(Ticket.est_due_date).between(beginning_date, end_date)) & (Ticket.overdue == 1), 1)
-                        )
-                    ).label('overdue')
-                )
-                .group_by(Ticket.agent_id).filter(Ticket.agent_id == agent_id)
-            )
+        stats = models.TicketDailyStats
+        category_column = {'department': stats.dept_id, 'topics': stats.topic_id, 'agent': stats.agent_id}[category]
+        totals = [func.sum(getattr(stats, field)) for field in TICKET_STATS_FIELDS]
+        query = (
+            db.query(category_column, *totals)
+            .filter(stats.date.between(beginning_date.date(), end_date.date()))
+            .group_by(category_column)
+        )
+        if category == 'agent':
+            query = query.filter(stats.agent_id == agent_id)
 
         results = query.all()
-        results = [{'category_name': category, 'category_id': result[0], 'created': result[1],
+        results = [{'category_name': category, 'category_id': result[0] or None, 'created': result[1],
                     'updated': result[2], 'overdue': result[3]} for result in results]
         return results
     except:
@@ -1306,8 +2093,13 @@ def update_ticket(background_task: BackgroundTasks, db: Session, ticket_id: int,
         updates_dict = updates.model_dump(exclude_unset=True)
         if not updates_dict:
             return ticket
+        stats_before = ticket_stats_snapshot(db, [ticket_id])
         db_ticket.update(updates_dict)
+        record_ticket_stats(db, [ticket_id], stats_before)
+        if TICKET_SEARCH_FIELDS & updates_dict.keys():
+            index_tickets(db, [ticket_id])
         db.commit()
+        invalidate_ticket_counts()
         db.refresh(ticket)
     except:
         traceback.print_exc()
@@ -1337,6 +2129,81 @@ def determine_type_for_thread_entry(old, new):
     return type
 
 
+def resolve_ticket_lookups(db: Session, tickets: list, update_dict: dict):
+    # key -> {id: row} for the current and new value of every foreign key being changed, from the
+    # reference data or with one IN query per table however many tickets there are
+    lookups = {}
+    for key, val in update_dict.items():
+        if key not in primary_key_dict:
+            continue
+        table = primary_key_dict[key]
+        ids = {getattr(ticket, key) for ticket in tickets} | {val}
+        ids.discard(None)
+        if table in REFERENCE_MODELS:
+            rows = get_reference_data().rows(table)
+            missing = ids - rows.keys()
+            lookups[key] = {**rows, **load_reference_rows(table, missing, db)} if missing else rows
+            continue
+        rows = db.query(table).filter(getattr(table, key).in_(ids)).all() if ids else []
+        lookups[key] = {getattr(row, key): row for row in rows}
+    return lookups
+
+
+def lookup_name(key: str, row):
+    if row is None:
+        return None
+    if key == 'agent_id':
+        return row.firstname + ' ' + row.lastname
+    return getattr(row, naming_dict[key])
+
+
+def ticket_change_events(ticket: Ticket, update_dict: dict, lookups: dict, owner: str, agent_id: int):
+    # thread event rows for every field update_dict changes, nothing is written. closing, reopening and
+    # pushing the due date out also set closed and overdue on the ticket, the fields themselves are left to the caller
+    thread_id = ticket.thread.thread_id
+    events = []
+
+    def add_event(data: dict, type: str):
+        events.append({'thread_id': thread_id, 'owner': owner, 'agent_id': agent_id,
+                       'data': json.dumps(data, default=str), 'type': type})
+
+    for key, val in update_dict.items():
+        prev = getattr(ticket, key)
+        if val == prev:
+            continue
+
+        data = {'field': key}
+        if key in primary_key_dict:
+            prev_row = lookups[key].get(prev)
+            new_row = lookups[key].get(val)
+
+            if key == 'status_id':
+                was_closed = prev_row is not None and prev_row.state == 'closed'
+                closing = new_row is not None and new_row.state == 'closed'
+                if closing and not was_closed:
+                    close_time = datetime.now(timezone.utc).replace(microsecond=0)
+                    ticket.closed = close_time
+                    add_event({'field': 'closed', 'new_val': close_time, 'prev_val': None}, 'A')
+                elif was_closed and not closing:
+                    add_event({'field': 'closed', 'new_val': None, 'prev_val': ticket.closed}, 'R')
+                    ticket.closed = None
+
+            data['prev_id'] = prev
+            data['new_id'] = val
+            data['prev_val'] = lookup_name(key, prev_row)
+            data['new_val'] = lookup_name(key, new_row)
+        else:
+            data['prev_val'] = prev
+            data['new_val'] = val
+
+        if key == 'due_date' and val and ticket.overdue == 1 and val.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc):
+            ticket.overdue = 0
+            add_event({'field': 'overdue', 'new_val': 0, 'prev_val': 1}, 'M')
+
+        add_event(data, determine_type_for_thread_entry(data['prev_val'], data['new_val']))
+    return events
+
+
 def update_ticket_with_thread(background_task: BackgroundTasks, db: Session, ticket_id: int, updates: schemas.TicketUpdateWithThread, agent_id: int):
     db_ticket = db.query(Ticket).filter(Ticket.ticket_id == ticket_id)
     ticket = db_ticket.first()
@@ -1351,110 +2218,27 @@ def update_ticket_with_thread(background_task: BackgroundTasks, db: Session, tic
         agent = db.query(models.Agent).filter(
             models.Agent.agent_id == agent_id).first()
         agent_name = agent.firstname + ' ' + agent.lastname
+        stats_before = ticket_stats_snapshot(db, [ticket_id])
 
         if not update_dict:
             return ticket
 
-        found_changes = False
-        for key, val in update_dict.items():
-
-            if val == getattr(ticket, key):
-                print('Skipping', key, val, getattr(ticket, key))
-                continue
-
-            found_changes = True
-
-            data = {
-                'field': key,
-            }
-
-            if key in primary_key_dict:
-                table = primary_key_dict[key]
-                prev_val = db.query(table).filter(
-                    getattr(table, key) == getattr(ticket, key)).first()
-                new_val = db.query(table).filter(
-                    getattr(table, key) == val).first()
-                name = naming_dict[key]
-
-                if key == 'status_id':
-                    if new_val.state == 'closed' or prev_val.state == 'closed':
-                        if new_val.state == 'closed' and prev_val.state != 'closed':
-                            close_time = datetime.now(
-                                timezone.utc).replace(microsecond=0)
-                            ticket.closed = close_time
-                            closed_data = {'field': 'closed',
-                                        'new_val': close_time, 'prev_val': None}
-                            closed_type = 'A'
-                        elif new_val.state != 'closed' and prev_val.state == 'closed':
-                            closed_data = {'field': 'closed',
-                                        'new_val': None, 'prev_val': ticket.closed}
-                            ticket.closed = None
-                            closed_type = 'R'
-
-                        closed_thread_event = {'thread_id': ticket.thread.thread_id, 'owner': agent_name,
-                                            'agent_id': agent_id, 'data': json.dumps(closed_data, default=str), 'type': closed_type}
-                        db_closed_thread_event = models.ThreadEvent(
-                            **closed_thread_event)
-                        db.add(db_closed_thread_event)
-
-                data['prev_id'] = getattr(ticket, key)
-                data['new_id'] = val
-
-                if key == 'agent_id':
-                    data['prev_val'] = prev_val.firstname + ' ' + \
-                        prev_val.lastname if prev_val else None
-                    data['new_val'] = new_val.firstname + ' ' + \
-                        new_val.lastname if new_val else None
-                else:
-                    data['prev_val'] = getattr(
-                        prev_val, name) if prev_val else None
-                    data['new_val'] = getattr(
-                        new_val, name) if new_val else None
-            else:
-                data['prev_val'] = getattr(ticket, key)
-                data['new_val'] = val
-
-            # print(data)
-
-            if key == 'due_date':
-                if ticket.overdue == 1 and val.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc):
-                    ticket.overdue = 0
-                    overdue_data = {'field': 'overdue',
-                                    'new_val': 0, 'prev_val': 1}
-                    overdue_thread_event = {'thread_id': ticket.thread.thread_id, 'owner': agent_name,
-                                            'agent_id': agent_id, 'data': json.dumps(overdue_data, default=str), 'type': 'M'}
-                    db_overdue_thread_event = models.ThreadEvent(
-                        **overdue_thread_event)
-                    db.add(db_overdue_thread_event)
-
-            type = determine_type_for_thread_entry(
-                data['prev_val'], data['new_val'])
-
-            thread_event = {'thread_id': ticket.thread.thread_id, 'owner': agent_name,
-                            'agent_id': agent_id, 'data': json.dumps(data, default=str), 'type': type}
-            db_thread_event = models.ThreadEvent(**thread_event)
-            db.add(db_thread_event)
+        # every notice queued by this update shares a ref, so a recipient gets each template once
+        outbox_ref = f'ticket:{ticket_id}:update:{uuid4()}'
+        lookups = resolve_ticket_lookups(db, [ticket], update_dict)
+        thread_events = ticket_change_events(ticket, update_dict, lookups, agent_name, agent_id)
+        found_changes = bool(thread_events)
+        db.add_all([models.ThreadEvent(**thread_event) for thread_event in thread_events])
 
-            try:
-                if key == 'agent_id':
-                    if val and not getattr(ticket, key):
-                        # send new assignment email
-                        new_agent = db.query(models.Agent).filter(
-                            models.Agent.agent_id == val).first()
-                        agent_email = new_agent.email
-                        background_task.add_task(func=send_email, db=db, email_list=[
-                                                 agent_email], template='agent_ticket_assignment_alert', email_type='alert')
-
-                    elif val and getattr(ticket, key):
-                        # send reassignment email
-                        new_agent = db.query(models.Agent).filter(
-                            models.Agent.agent_id == val).first()
-                        agent_email = new_agent.email
-                        background_task.add_task(func=send_email, db=db, email_list=[
-                                                 agent_email], template='agent_ticket_transfer_alert', email_type='alert')
-            except:
-                traceback.print_exc()
-                print("Could not send email about ticket assignment")
+        try:
+            new_agent = lookups['agent_id'].get(update_dict['agent_id']) if 'agent_id' in update_dict else None
+            if new_agent and new_agent.agent_id != ticket.agent_id:
+                # reassignment when the ticket had an agent, new assignment when it did not
+                template = 'agent_ticket_transfer_alert' if ticket.agent_id else 'agent_ticket_assignment_alert'
+                enqueue_email(db, [new_agent.email], template=template, email_type='alert', ref=outbox_ref)
+        except:
+            traceback.print_exc()
+            print("Could not send email about ticket assignment")
 
         if form_values:
             for update in form_values:
@@ -1477,20 +2261,26 @@ def update_ticket_with_thread(background_task: BackgroundTasks, db: Session, tic
                 db_form_value.update(update)
 
         if found_changes:
+            try:
+                user = get_user_by_filter(db, filter={'user_id': ticket.user_id})
+                enqueue_email(db, [user.email], template='user_new_activity_notice', email_type='alert', ref=outbox_ref)
+            except:
+                traceback.print_exc()
+                print("Could not send email about ticket update")
+
+            # the queued notices are committed together with the ticket changes
             db_ticket.update(update_dict)
+            db.flush()
+            record_ticket_stats(db, [ticket_id], stats_before)
+            if TICKET_SEARCH_FIELDS & update_dict.keys():
+                index_tickets(db, [ticket_id])
             db.commit()
+            invalidate_ticket_counts()
+            notify_outbox()
             print('Saved ticket changes')
         else:
             print('No changes to commit!')
 
-        try:
-            user = get_user_by_filter(db, filter={'user_id': ticket.user_id})
-            background_task.add_task(func=send_email, db=db, email_list=[
-                                     user.email], template='user_new_activity_notice', email_type='alert')
-        except:
-            traceback.print_exc()
-            print("Could not send email about ticket update")
-
     except:
         traceback.print_exc()
         raise HTTPException(400, 'Error during creation')
@@ -1498,6 +2288,76 @@ def update_ticket_with_thread(background_task: BackgroundTasks, db: Session, tic
     return ticket
 
 
+# most tickets a single bulk update may touch
+TICKET_BULK_UPDATE_LIMIT = 500
+
+
+def bulk_update_tickets(db: Session, ticket_ids: list, updates: TicketUpdate, agent_id: int):
+    # applies one change set to many tickets in one transaction, lookups are resolved with one
+    # query per table and each recipient gets one notice for the whole batch
+    ticket_ids = list(dict.fromkeys(ticket_ids))
+    if len(ticket_ids) > TICKET_BULK_UPDATE_LIMIT:
+        raise HTTPException(400, f'At most {TICKET_BULK_UPDATE_LIMIT} tickets can be updated at once')
+
+    tickets = db.query(Ticket).options(selectinload(Ticket.thread)).filter(Ticket.ticket_id.in_(ticket_ids)).all()
+    missing = set(ticket_ids) - {ticket.ticket_id for ticket in tickets}
+    if missing:
+        raise HTTPException(400, f'Tickets with ids {sorted(missing)} not found')
+
+    try:
+        update_dict = updates.model_dump(exclude_unset=True)
+        if not update_dict:
+            return {'updated': [], 'unchanged': ticket_ids}
+
+        agent = db.query(models.Agent).filter(models.Agent.agent_id == agent_id).first()
+        agent_name = agent.firstname + ' ' + agent.lastname
+        stats_before = ticket_stats_snapshot(db, ticket_ids)
+        lookups = resolve_ticket_lookups(db, tickets, update_dict)
+        new_agent = lookups['agent_id'].get(update_dict['agent_id']) if 'agent_id' in update_dict else None
+
+        thread_events = []
+        updated = []
+        user_ids = set()
+        agent_templates = set()
+        for ticket in tickets:
+            ticket_events = ticket_change_events(ticket, update_dict, lookups, agent_name, agent_id)
+            if not ticket_events:
+                continue
+            thread_events += ticket_events
+            updated.append(ticket.ticket_id)
+            user_ids.add(ticket.user_id)
+            if new_agent and new_agent.agent_id != ticket.agent_id:
+                agent_templates.add('agent_ticket_transfer_alert' if ticket.agent_id else 'agent_ticket_assignment_alert')
+
+        if updated:
+            outbox_ref = f'ticket:bulk:update:{uuid4()}'
+            try:
+                for template in sorted(agent_templates):
+                    enqueue_email(db, [new_agent.email], template=template, email_type='alert', ref=outbox_ref)
+                emails = [email for email, in db.query(models.User.email).filter(models.User.user_id.in_(user_ids)).all()]
+                enqueue_email(db, emails, template='user_new_activity_notice', email_type='alert', ref=outbox_ref)
+            except:
+                traceback.print_exc()
+                print("Could not send email about ticket update")
+
+            # every event in one executemany
+            db.execute(insert(models.ThreadEvent), thread_events)
+            db.query(Ticket).filter(Ticket.ticket_id.in_(updated)).update(update_dict)
+            db.flush()
+            record_ticket_stats(db, ticket_ids, stats_before)
+            if TICKET_SEARCH_FIELDS & update_dict.keys():
+                index_tickets(db, updated)
+            db.commit()
+            invalidate_ticket_counts()
+            notify_outbox()
+
+        updated_ids = set(updated)
+        return {'updated': updated, 'unchanged': [ticket_id for ticket_id in ticket_ids if ticket_id not in updated_ids]}
+    except:
+        traceback.print_exc()
+        raise HTTPException(400, 'Error during bulk update')
+
+
 def update_ticket_with_thread_for_user(background_task: BackgroundTasks, db: Session, ticket_id: int, updates: schemas.TicketUpdateWithThread, user_id: int):
     db_ticket = db.query(Ticket).filter(Ticket.ticket_id == ticket_id)
     ticket = db_ticket.first()
@@ -1512,6 +2372,7 @@ def update_ticket_with_thread_for_user(background_task: BackgroundTasks, db: Ses
         user = db.query(models.User).filter(
             models.User.user_id == user_id).first()
         user_name = user.firstname + ' ' + user.lastname
+        stats_before = ticket_stats_snapshot(db, [ticket_id])
 
         if not update_dict:
             return ticket
@@ -1585,7 +2446,12 @@ def update_ticket_with_thread_for_user(background_task: BackgroundTasks, db: Ses
 
         if found_changes:
             db_ticket.update(update_dict)
+            db.flush()
+            record_ticket_stats(db, [ticket_id], stats_before)
+            if TICKET_SEARCH_FIELDS & update_dict.keys():
+                index_tickets(db, [ticket_id])
             db.commit()
+            invalidate_ticket_counts()
             print('Saved ticket changes')
         else:
             print('No changes to commit!')
@@ -1607,10 +2473,14 @@ def update_ticket_with_thread_for_user(background_task: BackgroundTasks, db: Ses
 
 
 def delete_ticket(db: Session, ticket_id: int):
+    stats_before = ticket_stats_snapshot(db, [ticket_id])
     affected = db.query(Ticket).filter(Ticket.ticket_id == ticket_id).delete()
     if affected == 0:
         return False
+    record_ticket_stats(db, [ticket_id], stats_before)
+    index_tickets(db, [ticket_id])
     db.commit()
+    invalidate_ticket_counts()
     return True
 
 
@@ -1623,6 +2493,7 @@ def create_department(db: Session, department: schemas.DepartmentCreate):
         db_department = models.Department(**department.__dict__)
         db.add(db_department)
         db.commit()
+        invalidate_reference_data()
         db.refresh(db_department)
         return db_department
     except:
@@ -1640,7 +2511,7 @@ def get_department_by_filter(db: Session, filter: dict):
 
 
 def get_departments(db: Session):
-    return db.query(models.Department).all()
+    return list(get_reference_data().rows(models.Department).values())
 
 
 def get_departments_joined(db: Session):
@@ -1674,6 +2545,7 @@ def update_department(db: Session, dept_id: int, updates: schemas.DepartmentUpda
             return department
         db_department.update(updates_dict)
         db.commit()
+        invalidate_reference_data()
         db.refresh(department)
     except:
         traceback.print_exc()
@@ -1685,11 +2557,17 @@ def update_department(db: Session, dept_id: int, updates: schemas.DepartmentUpda
 
 
 def delete_department(db: Session, dept_id: int):
+    # tickets pointing at it are set to null by the foreign key, which moves them to another rollup cell
+    ticket_ids = [ticket_id for ticket_id, in db.query(Ticket.ticket_id).filter(Ticket.dept_id == dept_id)]
+    stats_before = ticket_stats_snapshot(db, ticket_ids)
+
     affected = db.query(models.Department).filter(
         models.Department.dept_id == dept_id).delete()
     if affected == 0:
         return False
+    record_ticket_stats(db, ticket_ids, stats_before)
     db.commit()
+    invalidate_reference_data()
     return True
 
 # CRUD for forms
@@ -1722,6 +2600,7 @@ def create_form(db: Session, form: schemas.FormCreate):
 
         db.refresh(db_form)
 
+        invalidate_reference_data()
         return db_form
     except:
         traceback.print_exc()
@@ -1756,6 +2635,7 @@ def update_form(db: Session, form_id: int, updates: schemas.FormUpdate):
             return form
         db_form.update(updates_dict)
         db.commit()
+        invalidate_reference_data()
         db.refresh(form)
     except:
         traceback.print_exc()
@@ -1772,6 +2652,7 @@ def delete_form(db: Session, form_id: int):
     if affected == 0:
         return False
     db.commit()
+    invalidate_reference_data()
     return True
 
 # CRUD for form_entries
@@ -1840,6 +2721,7 @@ def create_form_field(db: Session, form_field: schemas.FormFieldCreate):
         db_form_field = models.FormField(**form_field.__dict__)
         db.add(db_form_field)
         db.commit()
+        invalidate_reference_data()
         db.refresh(db_form_field)
         return db_form_field
     except:
@@ -1876,6 +2758,7 @@ def update_form_field(db: Session, field_id: int, updates: schemas.FormFieldUpda
             return form_field
         db_form_field.update(updates_dict)
         db.commit()
+        invalidate_reference_data()
         db.refresh(form_field)
     except:
         traceback.print_exc()
@@ -1892,6 +2775,7 @@ def delete_form_field(db: Session, field_id: int):
     if affected == 0:
         return False
     db.commit()
+    invalidate_reference_data()
     return True
 
 
@@ -1960,6 +2844,7 @@ def create_topic(db: Session, topic: schemas.TopicCreate):
         db_topic = models.Topic(**topic.__dict__)
         db.add(db_topic)
         db.commit()
+        invalidate_reference_data()
         db.refresh(db_topic)
         return db_topic
     except:
@@ -1995,6 +2880,7 @@ def update_topic(db: Session, topic_id: int, updates: schemas.TopicUpdate):
             return topic
         db_topic.update(updates_dict)
         db.commit()
+        invalidate_reference_data()
         db.refresh(topic)
     except:
         traceback.print_exc()
@@ -2006,11 +2892,17 @@ def update_topic(db: Session, topic_id: int, updates: schemas.TopicUpdate):
 
 
 def delete_topic(db: Session, topic_id: int):
+    # tickets pointing at it are set to null by the foreign key, which moves them to another rollup cell
+    ticket_ids = [ticket_id for ticket_id, in db.query(Ticket.ticket_id).filter(Ticket.topic_id == topic_id)]
+    stats_before = ticket_stats_snapshot(db, ticket_ids)
+
     affected = db.query(models.Topic).filter(
         models.Topic.topic_id == topic_id).delete()
     if affected == 0:
         return False
+    record_ticket_stats(db, ticket_ids, stats_before)
     db.commit()
+    invalidate_reference_data()
     return True
 
 # CRUD for roles
@@ -2056,6 +2948,8 @@ def update_role(db: Session, role_id: int, updates: schemas.RoleUpdate):
             return role
         db_role.update(updates_dict)
         db.commit()
+        role_permission_cache.pop(role_id)
+        agent_principal_cache.clear()
         db.refresh(role)
     except:
         traceback.print_exc()
@@ -2072,6 +2966,10 @@ def delete_role(db: Session, role_id: int):
     if affected == 0:
         return False
     db.commit()
+    # agents on this role had their role_id nulled by the foreign key
+    role_permission_cache.pop(role_id)
+    agent_permission_cache.clear()
+    agent_principal_cache.clear()
     return True
 
 
@@ -2228,6 +3126,7 @@ def create_sla(db: Session, sla: schemas.SLACreate):
         db_sla = models.SLA(**sla.__dict__)
         db.add(db_sla)
         db.commit()
+        invalidate_reference_data()
         db.refresh(db_sla)
         return db_sla
     except:
@@ -2245,7 +3144,7 @@ def get_sla_by_filter(db: Session, filter: dict):
 
 
 def get_slas(db: Session):
-    return db.query(models.SLA).all()
+    return list(get_reference_data().rows(models.SLA).values())
 
 # Update
 
@@ -2263,6 +3162,7 @@ def update_sla(db: Session, sla_id: int, updates: schemas.SLAUpdate):
             return sla
         db_sla.update(updates_dict)
         db.commit()
+        invalidate_reference_data()
         db.refresh(sla)
     except:
         traceback.print_exc()
@@ -2279,6 +3179,7 @@ def delete_sla(db: Session, sla_id: int):
     if affected == 0:
         return False
     db.commit()
+    invalidate_reference_data()
     return True
 
 # CRUD for tasks
@@ -2353,6 +3254,7 @@ def create_group(db: Session, group: schemas.GroupCreate):
         db_group = models.Group(**group_dict)
         db.add(db_group)
         db.commit()
+        invalidate_reference_data()
         db.refresh(db_group)
 
         if not db_group:
@@ -2390,7 +3292,7 @@ def get_group_by_filter(db: Session, filter: dict):
 
 
 def get_groups(db: Session):
-    return db.query(models.Group).all()
+    return list(get_reference_data().rows(models.Group).values())
 
 
 def get_groups_joined(db: Session):
@@ -2423,6 +3325,7 @@ def update_group(db: Session, group_id: int, updates: schemas.GroupUpdate):
             return group
         db_group.update(updates_dict)
         db.commit()
+        invalidate_reference_data()
         db.refresh(group)
     except:
         traceback.print_exc()
@@ -2439,6 +3342,7 @@ def delete_group(db: Session, group_id: int):
     if affected == 0:
         return False
     db.commit()
+    invalidate_reference_data()
     return True
 
 # CRUD for group_members
@@ -2627,7 +3531,7 @@ def delete_thread_collaborator(db: Session, collab_id: int):
 # CRUD for thread_entries
 
 
-def create_thread_entry(background_task: BackgroundTasks, db: Session, thread_entry: schemas.ThreadEntryCreate):
+def create_thread_entry(background_task: BackgroundTasks, db: Session, thread_entry: schemas.ThreadEntryCreate, commit: bool = True):
     try:
         if not thread_entry.owner:
             if thread_entry.agent_id:
@@ -2644,7 +3548,7 @@ def create_thread_entry(background_task: BackgroundTasks, db: Session, thread_en
         db_thread_entry = models.ThreadEntry(
             **{key: value for key, value in thread_entry.__dict__.items() if key != 'attachments'})
         db.add(db_thread_entry)
-        db.commit()
+        persist(db, commit)
         db.refresh(db_thread_entry)
 
         # this is for the email but also the triggering for on update needs the ticket so i am putting this code above
@@ -2655,8 +3559,11 @@ def create_thread_entry(background_task: BackgroundTasks, db: Session, thread_en
 
         # trigger on update for ticket to signify that the ticket was updated
 
+        stats_before = ticket_stats_snapshot(db, [thread.ticket_id])
         db_ticket.update({})
-        db.commit()
+        record_ticket_stats(db, [thread.ticket_id], stats_before)
+        index_tickets(db, [thread.ticket_id])
+        persist(db, commit)
 
         ticket = db_ticket.first()
 
@@ -2669,14 +3576,14 @@ def create_thread_entry(background_task: BackgroundTasks, db: Session, thread_en
                 db_attachment = create_attachment(db, attachment)
 
         # new message alert for agent, response/reply for user
+        outbox_ref = f'thread_entry:{db_thread_entry.entry_id}'
         if thread_entry.agent_id:
             db_user = get_user_by_filter(db, {'user_id': ticket.user_id})
             db_user_email = db_user.email
 
             if ticket.source == 'native':
                 try:
-                    background_task.add_task(func=send_email, db=db, email_list=[
-                                             db_user_email], template='user_response_template', email_type='alert')
+                    enqueue_email(db, [db_user_email], template='user_response_template', email_type='alert', ref=outbox_ref)
                 except:
                     traceback.print_exc()
                     print("Could not send email to user about thread response/reply")
@@ -2685,15 +3592,11 @@ def create_thread_entry(background_task: BackgroundTasks, db: Session, thread_en
                     if thread_entry.attachments is not None:
                         attachment_urls = [{"name": attachment.name, "link": attachment.link}
                                            for attachment in thread_entry.attachments]
-                        email_thread = threading.Thread(target=asyncio.run, args=(agent_reply_email(db, schemas.ThreadEntryAgentEmailReply.model_validate(
-                            {'recipient_id': ticket.user_id, 'subject': ticket.title, 'body': db_thread_entry.body, 'thread_id': thread_entry.thread_id, 'attachment_urls': attachment_urls}), thread_entry.agent_id),))
-                        email_thread.start()
-                        email_thread.join()
+                        enqueue_agent_reply(db, schemas.ThreadEntryAgentEmailReply.model_validate(
+                            {'recipient_id': ticket.user_id, 'subject': ticket.title, 'body': db_thread_entry.body, 'thread_id': thread_entry.thread_id, 'attachment_urls': attachment_urls}), thread_entry.agent_id, ref=outbox_ref)
                     else:
-                        email_thread = threading.Thread(target=asyncio.run, args=(agent_reply_email(db, schemas.ThreadEntryAgentEmailReply.model_validate(
-                            {'recipient_id': ticket.user_id, 'subject': ticket.title, 'body': db_thread_entry.body, 'thread_id': thread_entry.thread_id}), thread_entry.agent_id),))
-                        email_thread.start()
-                        email_thread.join()
+                        enqueue_agent_reply(db, schemas.ThreadEntryAgentEmailReply.model_validate(
+                            {'recipient_id': ticket.user_id, 'subject': ticket.title, 'body': db_thread_entry.body, 'thread_id': thread_entry.thread_id}), thread_entry.agent_id, ref=outbox_ref)
                 except:
                     traceback.print_exc()
                     print("Could not send email to user about agent response/reply")
@@ -2701,8 +3604,7 @@ def create_thread_entry(background_task: BackgroundTasks, db: Session, thread_en
             db_agent = get_agent_by_filter(db, {'agent_id': ticket.agent_id})
             db_agent_email = db_agent.email
             try:
-                background_task.add_task(func=send_email, db=db, email_list=[
-                                         db_agent_email], template='agent_new_message_alert', email_type='alert')
+                enqueue_email(db, [db_agent_email], template='agent_new_message_alert', email_type='alert', ref=outbox_ref)
             except:
                 traceback.print_exc()
                 print("Could not send email to agent about thread response/reply")
@@ -2710,6 +3612,10 @@ def create_thread_entry(background_task: BackgroundTasks, db: Session, thread_en
         else:
             raise Exception('No editor specified!')
 
+        persist(db, commit)
+        if commit:
+            notify_outbox()
+
         return db_thread_entry
     except:
         traceback.print_exc()
@@ -2753,6 +3659,21 @@ def get_thread_entry_by_filter(db: Session, filter: dict):
     return q.first()
 
 
+async def get_thread_entry_by_filter_async(db: AsyncSession, filter: dict):
+    query = select(models.ThreadEntry)
+    for attr, value in filter.items():
+        query = query.where(getattr(models.ThreadEntry, attr) == value)
+    return (await db.execute(query.limit(1))).scalars().first()
+
+
+async def get_thread_entries_per_thread_async(db: AsyncSession, thread_id: int):
+    return (await db.execute(select(models.ThreadEntry).where(models.ThreadEntry.thread_id == thread_id))).scalars().all()
+
+
+def thread_ticket_id(db: Session, thread_id: int):
+    return db.query(models.Thread.ticket_id).filter(models.Thread.thread_id == thread_id).scalar()
+
+
 def get_thread_entries_per_thread(db: Session, thread_id: int):
     return db.query(models.ThreadEntry).filter(models.ThreadEntry.thread_id == thread_id).all()
 
@@ -2772,6 +3693,8 @@ def update_thread_entry(db: Session, entry_id: int, updates: schemas.ThreadEntry
         if not updates_dict:
             return thread_entry
         db_thread_entry.update(updates_dict)
+        if 'subject' in updates_dict or 'body' in updates_dict:
+            index_tickets(db, [thread_ticket_id(db, thread_entry.thread_id)])
         db.commit()
         db.refresh(thread_entry)
     except:
@@ -2784,10 +3707,13 @@ def update_thread_entry(db: Session, entry_id: int, updates: schemas.ThreadEntry
 
 
 def delete_thread_entry(db: Session, entry_id: int):
+    thread_id = db.query(models.ThreadEntry.thread_id).filter(
+        models.ThreadEntry.entry_id == entry_id).scalar()
     affected = db.query(models.ThreadEntry).filter(
         models.ThreadEntry.entry_id == entry_id).delete()
     if affected == 0:
         return False
+    index_tickets(db, [thread_ticket_id(db, thread_id)])
     db.commit()
     return True
 
@@ -2861,6 +3787,7 @@ def create_ticket_priority(db: Session, ticket_priority: schemas.TicketPriorityC
         db_ticket_priority = models.TicketPriority(**ticket_priority.__dict__)
         db.add(db_ticket_priority)
         db.commit()
+        invalidate_reference_data()
         db.refresh(db_ticket_priority)
         return db_ticket_priority
     except:
@@ -2878,7 +3805,7 @@ def get_ticket_priority_by_filter(db: Session, filter: dict):
 
 
 def get_ticket_priorities(db: Session):
-    return db.query(models.TicketPriority).all()
+    return list(get_reference_data().rows(models.TicketPriority).values())
 
 # Update
 
@@ -2897,6 +3824,7 @@ def update_ticket_priority(db: Session, priority_id: int, updates: schemas.Ticke
             return ticket_priority
         db_ticket_priority.update(updates_dict)
         db.commit()
+        invalidate_reference_data()
         db.refresh(ticket_priority)
     except:
         traceback.print_exc()
@@ -2913,6 +3841,7 @@ def delete_ticket_priority(db: Session, priority_id: int):
     if affected == 0:
         return False
     db.commit()
+    invalidate_reference_data()
     return True
 
 # CRUD for ticket_statuses
@@ -2923,6 +3852,7 @@ def create_ticket_status(db: Session, ticket_status: schemas.TicketStatusCreate)
         db_ticket_status = models.TicketStatus(**ticket_status.__dict__)
         db.add(db_ticket_status)
         db.commit()
+        invalidate_reference_data()
         db.refresh(db_ticket_status)
         return db_ticket_status
     except:
@@ -2940,7 +3870,7 @@ def get_ticket_status_by_filter(db: Session, filter: dict):
 
 
 def get_ticket_statuses(db: Session):
-    return db.query(models.TicketStatus).all()
+    return list(get_reference_data().rows(models.TicketStatus).values())
 
 # Update
 
@@ -2959,6 +3889,7 @@ def update_ticket_status(db: Session, status_id: int, updates: schemas.TicketSta
             return ticket_status
         db_ticket_status.update(updates_dict)
         db.commit()
+        invalidate_reference_data()
         db.refresh(ticket_status)
     except:
         traceback.print_exc()
@@ -2975,16 +3906,19 @@ def delete_ticket_status(db: Session, status_id: int):
     if affected == 0:
         return False
     db.commit()
+    invalidate_reference_data()
     return True
 
 # CRUD for users
 
 
-def create_user(db: Session, user: schemas.UserCreate):
+def create_user(db: Session, user: schemas.UserCreate, commit: bool = True):
     try:
         db_user = models.User(**user.__dict__, status=2)
         db.add(db_user)
-        db.commit()
+        db.flush()
+        index_users(db, [db_user.user_id])
+        persist(db, commit)
         db.refresh(db_user)
 
         return db_user
@@ -3008,6 +3942,8 @@ def register_user(background_task: BackgroundTasks, db: Session, user: schemas.U
             db_user = models.User(**user.__dict__, status=1)
             db.add(db_user)
 
+        db.flush()
+        index_users(db, [db_user.user_id])
         db.commit()
         db.refresh(db_user)
 
@@ -3164,16 +4100,12 @@ def get_user_for_user_profile(db: Session, user_id: int):
 
 
 def get_users_by_name_search(db: Session, name: str):
-    full_name = models.User.firstname + ' ' + \
-        models.User.lastname + ' ' + models.User.email
-    return db.query(models.User).filter(full_name.ilike(f'%{name}%')).limit(10).all()
+    return db.query(models.User).filter(user_search_filter(name)).limit(10).all()
 
 
 def get_users_by_search(db: Session, name: str):
-    full_name = models.User.firstname + ' ' + \
-        models.User.lastname + ' ' + models.User.email
     if name:
-        return db.query(models.User).filter(full_name.ilike(f'%{name}%'))
+        return db.query(models.User).filter(user_search_filter(name))
     else:
         return db.query(models.User)
 
@@ -3192,6 +4124,8 @@ def update_user(db: Session, user_id: int, updates: schemas.UserUpdate):
         if not updates_dict:
             return user
         db_user.update(updates_dict)
+        if USER_SEARCH_FIELDS & updates_dict.keys():
+            index_users(db, [user_id])
         db.commit()
         db.refresh(user)
     except:
@@ -3213,6 +4147,8 @@ def update_user_for_user_profile(db: Session, user_id: int, updates: schemas.Use
         if not updates_dict:
             return user
         db_user.update(updates_dict)
+        if USER_SEARCH_FIELDS & updates_dict.keys():
+            index_users(db, [user_id])
         db.commit()
         db.refresh(user)
     except:
@@ -3229,6 +4165,7 @@ def delete_user(db: Session, user_id: int):
         models.User.user_id == user_id).delete()
     if affected == 0:
         return False
+    index_users(db, [user_id])
     db.commit()
     return True
 
@@ -3240,6 +4177,7 @@ def create_category(db: Session, category: schemas.CategoryCreate):
         db_category = models.Category(**category.__dict__)
         db.add(db_category)
         db.commit()
+        invalidate_reference_data()
         db.refresh(db_category)
         return db_category
     except:
@@ -3257,7 +4195,7 @@ def get_category_by_filter(db: Session, filter: dict):
 
 
 def get_categories(db: Session):
-    return db.query(models.Category).all()
+    return list(get_reference_data().rows(models.Category).values())
 
 # Update
 
@@ -3276,6 +4214,7 @@ def update_category(db: Session, category_id: int, updates: schemas.CategoryUpda
             return category
         db_category.update(updates_dict)
         db.commit()
+        invalidate_reference_data()
         db.refresh(category)
     except:
         traceback.print_exc()
@@ -3292,6 +4231,7 @@ def delete_category(db: Session, category_id: int):
     if affected == 0:
         return False
     db.commit()
+    invalidate_reference_data()
     return True
 
 # CRUD for settings
@@ -3309,6 +4249,63 @@ def delete_category(db: Session, category_id: int):
 # Read
 
 
+# the whole settings table held in memory, rebuilt whenever settings are written
+class SettingsSnapshot:
+    truthy_values = ('1', 'true', 'yes', 'on', 'enable', 'enabled')
+
+    def __init__(self, rows, ttl: float = 300):
+        self._values = MappingProxyType({row.key: row.value for row in rows})
+        self.expires = time.monotonic() + ttl
+
+    def get(self, key: str, default=None):
+        value = self._values.get(key)
+        return default if value is None else value
+
+    def get_int(self, key: str, default: int = None):
+        try:
+            return int(self._values.get(key))
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self, key: str, default: bool = False):
+        value = self._values.get(key)
+        if value is None:
+            return default
+        return str(value).lower() in self.truthy_values
+
+    def get_secret(self, key: str, default: str = None):
+        value = self._values.get(key)
+        if value in [None, '']:
+            return default
+        return decrypt(value)
+
+
+settings_snapshot: SettingsSnapshot = None
+settings_snapshot_lock = threading.Lock()
+
+
+def refresh_settings_snapshot(db: Session = None):
+    global settings_snapshot
+    session = db or SessionLocal()
+    try:
+        snapshot = SettingsSnapshot(session.query(models.Settings).all())
+    finally:
+        if db is None:
+            session.close()
+    # swap the reference in one step so readers never see a half built snapshot
+    with settings_snapshot_lock:
+        settings_snapshot = snapshot
+    return snapshot
+
+
+def get_settings_snapshot(db: Session = None):
+    snapshot = settings_snapshot
+    # the ttl picks up changes made by other worker processes
+    if snapshot is None or snapshot.expires < time.monotonic():
+        snapshot = refresh_settings_snapshot(db)
+    return snapshot
+
+
 def get_settings_by_filter(db: Session, filter: dict):
     q = db.query(models.Settings)
     for attr, value in filter.items():
@@ -3318,6 +4315,10 @@ def get_settings_by_filter(db: Session, filter: dict):
 
 def get_settings(db: Session):
     db_settings = db.query(models.Settings).all()
+    return decrypt_settings(db_settings)
+
+
+def decrypt_settings(db_settings: list):
     settings = [row.to_dict() for row in db_settings]
     private_fields = ['s3_access_key', 's3_secret_access_key']
     for setting in settings:
@@ -3327,6 +4328,17 @@ def get_settings(db: Session):
     return settings
 
 
+async def get_settings_by_filter_async(db: AsyncSession, filter: dict):
+    query = select(models.Settings)
+    for attr, value in filter.items():
+        query = query.where(getattr(models.Settings, attr) == value)
+    return (await db.execute(query.limit(1))).scalars().first()
+
+
+async def get_settings_async(db: AsyncSession):
+    return decrypt_settings((await db.execute(select(models.Settings))).scalars().all())
+
+
 # Update
 
 def update_settings(db: Session, id: int, updates: schemas.SettingsUpdate):
@@ -3342,6 +4354,7 @@ def update_settings(db: Session, id: int, updates: schemas.SettingsUpdate):
             return settings
         db_settings.update(updates_dict)
         db.commit()
+        refresh_settings_snapshot(db)
         db.refresh(settings)
     except:
         raise HTTPException(400, 'Error during creation')
@@ -3359,9 +4372,10 @@ def reset_s3_client(db: Session, excluded_list: list, s3_manager: S3Manager):
         row['value'] for row in excluded_list if row['key'] == 's3_secret_access_key']
     region_name = [row['value']
                    for row in excluded_list if row['key'] == 's3_bucket_region']
+    current_settings = get_settings_snapshot(db)
     for update in excluded_list:
         if update['key'] in private_fields:
-            if update['value'] != get_settings_by_filter(db, filter={'key': update['key']}).value:
+            if update['value'] != current_settings.get(update['key']):
                 reset_client = True
 
     if reset_client:
@@ -3382,9 +4396,14 @@ def bulk_update_settings(db: Session, updates: list[schemas.SettingsUpdate], s3_
 
         reset_s3_client(db=db, excluded_list=excluded_list,
                         s3_manager=s3_manager)
+        current_settings = get_settings_snapshot(db)
+        for private_update in excluded_list:
+            if private_update['key'] in private_fields:
+                forget_secret(current_settings.get(private_update['key']))
 
         db.execute(update(models.Settings), excluded_list)
         db.commit()
+        refresh_settings_snapshot(db)
         return len(excluded_list)
     except:
         traceback.print_exc()
@@ -3513,6 +4532,7 @@ def update_queue(db: Session, queue_id: int, updates: schemas.QueueUpdate):
             return queue
         db_queue.update(updates_dict)
         db.commit()
+        invalidate_queue_plans(queue_id)
         db.refresh(queue)
     except:
         raise HTTPException(400, 'Error during creation')
@@ -3528,6 +4548,7 @@ def delete_queue(db: Session, queue_id: int):
     if affected == 0:
         return False
     db.commit()
+    invalidate_queue_plans(queue_id)
     return True
 
 # CRUD for default_columns
@@ -3687,8 +4708,11 @@ def update_email(db: Session, email_id: int, updates: schemas.EmailUpdate):
             email_dict['banned_emails'] = ast.literal_eval(email_dict['banned_emails'])
             return email_dict
         updates_dict['banned_emails'] = repr(updates_dict['banned_emails'])
+        if 'password' in updates_dict:
+            forget_secret(email.password)
         db_email.update(updates_dict)
         db.commit()
+        smtp_pool.invalidate(email_id)
         db.refresh(email)
     except:
         traceback.print_exc()
@@ -3702,10 +4726,14 @@ def update_email(db: Session, email_id: int, updates: schemas.EmailUpdate):
 
 
 def delete_email(db: Session, email_id: int):
+    password = db.query(models.Email.password).filter(
+        models.Email.email_id == email_id).scalar()
     affected = db.query(models.Email).filter(
         models.Email.email_id == email_id).delete()
     if affected == 0:
         return False
+    smtp_pool.invalidate(email_id)
+    forget_secret(password)
 
     affected_row_system = db.query(models.Settings).filter(
         (models.Settings.key == 'default_system_email'))
@@ -3732,6 +4760,7 @@ def delete_email(db: Session, email_id: int):
             affected_row_admin.update({'value': None})
 
     db.commit()
+    refresh_settings_snapshot(db)
     return True
 
 
@@ -3797,7 +4826,7 @@ def resend_email_confirmation_email(background_task: BackgroundTasks, db: Sessio
 
 def generate_presigned_url(db: Session, attachment_name: schemas.AttachmentName, s3_client: any):
     try:
-        bucket_name = get_settings_by_filter(db, filter={'key': 's3_bucket_name'}).value
+        bucket_name = get_settings_snapshot(db).get('s3_bucket_name')
         response_dict = {}
         for attachment in attachment_name.attachment_names:
             response = s3_client.generate_presigned_url('put_object', Params={'Bucket': bucket_name, 'Key': str(
@@ -3834,30 +4863,63 @@ def get_attachment_by_filter(db: Session, filter: dict):
     return q.all()
 
 
+# high-water marks of the last overdue sweep as (local time, utc time), None means the next run does a full pass.
+# deadlines are compared in local time like before, ticket.updated is filled by the database clock in utc
+overdue_high_water_mark = None
+OVERDUE_BATCH_SIZE = 500
+
+
 def mark_tickets_overdue():
+    global overdue_high_water_mark
     print('checking for overdue tickets')
+    db: Session = SessionLocal()
     try:
-        db: Session = SessionLocal()
-        tickets = db.query(models.Ticket).all()
-
-        for ticket in tickets:
-            if ticket.overdue == 0 and ticket.due_date and ticket.due_date < datetime.now():
-                ticket.overdue = 1
-                data = {"field": "overdue", "prev_id": None,
-                        "new_id": None, "prev_val": 0, "new_val": 1}
-                thread_event = {'thread_id': ticket.thread.thread_id, 'owner': 'System',
-                                'agent_id': 0, 'data': json.dumps(data, default=str), 'type': 'M'}
-                db_thread_event = models.ThreadEvent(**thread_event)
-                db.add(db_thread_event)
-            elif ticket.overdue == 0 and not ticket.due_date and ticket.est_due_date and ticket.est_due_date < datetime.now():
-                ticket.overdue = 1
-                data = {"field": "overdue", "prev_id": None,
-                        "new_id": None, "prev_val": 0, "new_val": 1}
-                thread_event = {'thread_id': ticket.thread.thread_id, 'owner': 'System',
-                                'agent_id': 0, 'data': json.dumps(data, default=str), 'type': 'M'}
-                db_thread_event = models.ThreadEvent(**thread_event)
-                db.add(db_thread_event)
+        now = datetime.now()
+        now_utc = datetime.now(timezone.utc).replace(tzinfo=None)
+        deadline = func.coalesce(models.Ticket.due_date, models.Ticket.est_due_date)
+        open_statuses = select(models.TicketStatus.status_id).where(models.TicketStatus.state == 'open')
+
+        q = db.query(models.Ticket.ticket_id, models.Thread.thread_id) \
+            .outerjoin(models.Thread, models.Thread.ticket_id == models.Ticket.ticket_id) \
+            .filter(models.Ticket.overdue == 0) \
+            .filter(or_(models.Ticket.status_id.is_(None), models.Ticket.status_id.in_(open_statuses))) \
+            .filter(deadline < now)
+
+        # only look at deadlines that passed since the last run, plus tickets edited since then
+        # (a due date moved into the past would otherwise be missed)
+        if overdue_high_water_mark:
+            deadline_mark, updated_mark = overdue_high_water_mark
+            q = q.filter(or_(deadline >= deadline_mark,
+                             models.Ticket.updated >= updated_mark))
+
+        candidates = q.all()
+        data = json.dumps({"field": "overdue", "prev_id": None,
+                           "new_id": None, "prev_val": 0, "new_val": 1}, default=str)
+
+        for i in range(0, len(candidates), OVERDUE_BATCH_SIZE):
+            chunk = candidates[i:i + OVERDUE_BATCH_SIZE]
+            ticket_ids = [ticket_id for ticket_id, _ in chunk]
+            stats_before = ticket_stats_snapshot(db, ticket_ids)
+            db.execute(
+                update(models.Ticket)
+                .where(models.Ticket.ticket_id.in_(ticket_ids))
+                .where(models.Ticket.overdue == 0)
+                .values(overdue=1)
+                .execution_options(synchronize_session=False)
+            )
+            record_ticket_stats(db, ticket_ids, stats_before)
+            thread_events = [{'thread_id': thread_id, 'owner': 'System', 'agent_id': 0,
+                              'data': data, 'type': 'M'} for _, thread_id in chunk if thread_id is not None]
+            if thread_events:
+                db.execute(insert(models.ThreadEvent), thread_events)
         db.commit()
+        if candidates:
+            invalidate_ticket_counts()
+        overdue_high_water_mark = (now, now_utc)
+        print(f'marked {len(candidates)} tickets overdue')
+    except:
+        db.rollback()
+        traceback.print_exc()
     finally:
         db.close()
 
@@ -3869,262 +4931,440 @@ def search_string(uid_max, criteria={}):
 
 
 # CRUD for email sources
-def create_email_source(db: Session, email_source: schemas.EmailSourceCreate):
+def create_email_source(db: Session, email_source: schemas.EmailSourceCreate, commit: bool = True):
     try:
         db_email_source = models.EmailSource(**email_source.__dict__)
         db.add(db_email_source)
-        db.commit()
+        persist(db, commit)
         db.refresh(db_email_source)
         return db_email_source
     except:
         traceback.print_exc()
         raise HTTPException(400, 'Error during creation')
 
-# do this every 5 minutes
+def connect_imap(db_email: models.Email, timeout: float = None):
+    mail = imaplib.IMAP4_SSL(db_email.imap_server, timeout=timeout)
+    mail.login(db_email.email, decrypt(db_email.password))
+    mail.select('inbox')
+    return mail
 
 
-def create_imap_server(background_task: BackgroundTasks, s3_manager: S3Manager):
-    try:
-        # finding all the emails with imap servers activated
-        db: Session = SessionLocal()  # Create a new session
-        active_emails = db.query(models.Email).filter(models.Email.imap_active_status == 1).all()
-        if not active_emails:
-            print('No active emails')
+def fetch_new_messages(mail, uid_max: int, chunk_size: int = 25):
+    # yields lists of (uid, raw message) for every uid above uid_max, fetching whole uid ranges per round trip
+    _, data = mail.uid('SEARCH', None, search_string(uid_max))
+    # 'n:*' always matches the newest message even when it is older than n
+    uids = sorted(int(s) for s in data[0].split() if int(s) > uid_max)
+
+    for i in range(0, len(uids), chunk_size):
+        chunk = uids[i:i + chunk_size]
+        status, data = mail.uid('FETCH', f'{chunk[0]}:{chunk[-1]}', '(UID BODY[])')
+        if status != 'OK':
+            print(status)
             return
+        messages = {}
+        for item in data:
+            if not isinstance(item, tuple):
+                continue
+            match = re.search(rb'UID (\d+)', item[0])
+            if match:
+                messages[int(match.group(1))] = item[1]
+        yield [(uid, messages[uid]) for uid in chunk if uid in messages]
+
+
+# parts above this size are spooled to disk while they wait for their upload
+ATTACHMENT_SPOOL_SIZE = 1024 * 1024
+# characters of the encoded payload decoded per write to the spooled file
+ATTACHMENT_DECODE_CHUNK = 256 * 1024
+
+
+def decode_part_into(part, fileobj, chunk_size: int = ATTACHMENT_DECODE_CHUNK):
+    # writes a part's decoded payload to fileobj a chunk at a time rather than building the whole
+    # decoded attachment in memory, returns the decoded size
+    payload = part.get_payload()
+    if not isinstance(payload, str):
+        payload = ''
+    encoding = part.get('content-transfer-encoding', '').strip().lower()
+    size = 0
+    if encoding == 'base64':
+        carry = ''
+        for i in range(0, len(payload), chunk_size):
+            # base64 decodes in groups of 4, whatever is left over waits for the next chunk
+            text = carry + re.sub(r'[^A-Za-z0-9+/=]', '', payload[i:i + chunk_size])
+            usable = len(text) - len(text) % 4
+            carry = text[usable:]
+            size += fileobj.write(binascii.a2b_base64(text[:usable]))
+        if carry:
+            # like get_payload(decode=True), tolerate a payload missing its padding
+            size += fileobj.write(binascii.a2b_base64(carry + '=' * (-len(carry) % 4)))
+    elif encoding == 'quoted-printable':
+        # soft line breaks end their line, so decoding whole lines at a time is safe
+        lines = []
+        pending = 0
+        for line in io.StringIO(payload):
+            lines.append(line)
+            pending += len(line)
+            if pending >= chunk_size:
+                size += fileobj.write(binascii.a2b_qp(''.join(lines).encode('ascii', 'surrogateescape')))
+                lines, pending = [], 0
+        if lines:
+            size += fileobj.write(binascii.a2b_qp(''.join(lines).encode('ascii', 'surrogateescape')))
+    elif encoding in ('', '7bit', '8bit', 'binary'):
+        for i in range(0, len(payload), chunk_size):
+            chunk = payload[i:i + chunk_size]
+            try:
+                size += fileobj.write(chunk.encode('ascii', 'surrogateescape'))
+            except UnicodeError:
+                size += fileobj.write(chunk.encode('raw-unicode-escape'))
+    else:
+        # uuencode and anything else rare goes through the email package in one piece
+        size += fileobj.write(part.get_payload(decode=True) or b'')
+    return size
+
+
+def extract_email_attachments(email_content):
+    # decodes each attachment part exactly once, returns (name, content type, file, size) tuples
+    email_attachments = []
+    found_start = False
+    # because of the extra headers sent for the body of the email, we are looking for any headers that exist beyond the html/text in the body (hence the found_start part)
+    for part in email_content.walk():
+        if found_start:
+            if part.get_content_type() in safe_file_types:
+                spooled = tempfile.SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_SIZE)
+                size = decode_part_into(part, spooled)
+                spooled.seek(0)
+                email_attachments.append((part.get_filename(), part.get_content_type(), spooled, size))
+        elif part.get_content_type() == 'text/html':
+            found_start = True
+    return email_attachments
+
+
+def upload_email_attachments(db: Session, s3_manager: S3Manager, email_attachments: list):
+    # starts the uploads on the s3 manager's pool and returns them as (future, file, attachment row) without the object_id
+    if not email_attachments:
+        return []
+    bucket_name = get_settings_snapshot(db).get('s3_bucket_name')
+    uploads = []
+    for name, content_type, spooled, size in email_attachments:
+        key = str(uuid4())
+        row = {'size': size, 'type': content_type, 'name': name, 'inline': 1, 'link': f'https://{bucket_name}.s3.amazonaws.com/{key}'}
         try:
-            # creating an imap instance for each active email so we can check for new emails and handle them appropriately
-            for db_email in active_emails:
-                print('looping through emails')
-                try:
-                    mail = imaplib.IMAP4_SSL(db_email.imap_server)
-                    mail.login(db_email.email, decrypt(db_email.password))
-                except:
-                    traceback.print_exc()
-                    raise HTTPException(
-                        400, 'Email log in credentials were not correct')
-                mail.select('inbox')
-                current_uid_max = db_email.uid_max
-                _, data = mail.uid(
-                    'SEARCH', None, search_string(current_uid_max))
-                uids_list = [int(s) for s in data[0].split()]
-                
-                # check if the latest email is new
-                if(len(uids_list) != 0 and uids_list[-1] > current_uid_max):
-                    for uid in uids_list:
-                        print('looping through all uids greater than the current max')
-                        # searching for every email that is new, if nothing is new in this inbox, we move to the next email
-                        status, data = mail.uid('fetch', str(uid), 'BODY[]')
-
-                        if status == 'OK':
-                            # obtaining email contents
-                            email_content = email.message_from_bytes(data[0][1], policy=default)
-
-                            # obtaining the from email and creating a new user if necessary
-                            sender_name = email_content['From']
-
-
-                            first_name = ''
-                            last_name = ''
-
-                            email_extraction = r'<(.*?)>'
-                            user_email = re.findall(
-                                email_extraction, sender_name)
-                            
-                            # checking the banned emails to see if we skip or continue with this process
-                            if user_email[0] in db_email.banned_emails:
-                                print(f'{user_email[0]} email was skipped')
-                                db_email.uid_max = uid
-                                db.commit()
-                                continue
-
-                            db_user = db.query(models.User).filter(
-                                models.User.email == user_email[0]).first()
-                            if not db_user:
-                                print(
-                                    'generating a user w/ status 2 if they dont exist')
-                                # there is a name present with the email
-                                if len(sender_name.split('<')[0]) > 0:
-                                    # the name on the email is more than 1 word, ideally it will only be 2 but for now we will just put the first two words that show up
-                                    if (len(sender_name.split('<')[0].split(' '))) == 3:
-                                        first_name = sender_name.split(
-                                            '<')[0].split(' ')[0]
-                                        last_name = sender_name.split(
-                                            '<')[0].split(' ')[1]
-                                    # just taking the entire name there and making it the first name
-                                    else:
-                                        first_name = sender_name.split(
-                                            '<')[0].split(' ')[0]
-                                        last_name = ''
-                                # there was no from name and just an email
-                                else:
-                                    first_name = user_email
-                                    last_name = ''
-
-                                db_user = create_user(db=db, user=schemas.UserCreate.model_validate({'email': user_email[0], 'firstname': first_name, 'lastname': last_name}))
-                            
-                            
-                            # check if the new email is a reply or new email thread; if reply we are gonna find the parent email and attach this email as a new thread entry there
-                            # message_id = str(email_content.get('In-Reply-To'))
-                            message_id = str(email_content.get('References'))
-                            if message_id != 'None':
-                                print('this is a reply')
-                                message_id = message_id.split(" ")[0]
-                                _, data = mail.search(
-                                    None, f'HEADER "Message-ID" "{message_id}"')
-                                # Fetch the UID of the first matching email
-                                email_ids = data[0].split()
-                                # Use the first email found
-                                first_email_id = email_ids[0]
-
-                                # Fetch the UID of the email
-                                _, uid_data = mail.fetch(
-                                    first_email_id, '(UID)')
-                                parent_uid = uid_data[0].decode()
-                                parent_uid = parent_uid.split()[-1].rstrip(')')
-
-                                _, reply_email = mail.uid(
-                                    'fetch', str(parent_uid), '(RFC822)')
-                                reply_content = email.message_from_bytes(
-                                    reply_email[0][1], policy=default)
-
-                                # obtaining the inline content; for now any inline attachments will be moved to regular attachments and the inline tags will be removed
-                                subject = str(email_content['Subject'])
-
-                                print('obtaining reply contents')
-                                try:
-                                    # because replying to an email will include a quote referencing the previous replies, we are extracting all the content before we see the container containing the quoted replies. Regex may not be reliable will have to test
-                                    body = email_content.get_body(preferencelist=('html')).get_content()
-                                    # if no match is made, include the entire body
-                                    pattern = r"(.*?)(<br\s*/?>\s*)*(<div class=\"gmail_quote gmail_quote_container\"|<div name=\"messageReplySection\">)"
-                                    extracted_reply = re.search(
-                                        pattern, body, re.DOTALL)
-                                    body = extracted_reply.group(1).strip()
-                                    soup = BeautifulSoup(body, 'html.parser')
-
-                                    for tag in ['img', 'audio', 'video']:
-                                        # dealing with inline attachment tags for now
-                                        for component in soup.find_all(tag):
-                                            component.decompose()  # Removes the tag from the document
-                                    body = str(soup)
-                                except:
-                                    body = ''
-
-                                # finding the thread entry id of the email that was replied to, which will let us find the thread this new reply belongs to
-                                parent_thread_entry = db.query(models.EmailSource).filter(and_(models.EmailSource.email_id == db_email.email_id, models.EmailSource.email_uid == int(parent_uid))).first()
-                                db_thread = db.query(models.ThreadEntry).filter(models.ThreadEntry.entry_id == parent_thread_entry.thread_entry_id).first()
-                                db_thread_entry = create_thread_entry(background_task=background_task, db=db, thread_entry=schemas.ThreadEntryCreate.model_validate({'thread_id': db_thread.thread_id, 'user_id': db_user.user_id, 'type': 'A', 'owner': db_user.firstname + " " + db_user.lastname, 'editor': '', 'body': body, 'recipients': ''}))
-
-                                # add a row for the email source table
-                                db_email_source = create_email_source(db=db, email_source=schemas.EmailSourceCreate.model_validate({'thread_entry_id': db_thread_entry.entry_id, 'email_id': db_email.email_id, 'email_uid': int(uid), 'message_id': message_id}))
-
-                                # uploading the attachments present in the email if the s3 client is set up, otherwise nothing happens here and the attachments will be ignored
-                                found_start = False
-
-                                s3_client = s3_manager.get_client()
-
-                                # because of the extra headers sent for the body of the email, we are looking for any headers that exist beyond the html/text in the body (hence the found_start part)
-                                if s3_client is not None:
-                                    for part in email_content.walk():
-                                        # print(part.get_content_type())
-                                        if found_start:
-                                            if (part.get_content_type() in safe_file_types):
-                                                print(
-                                                    'we are uploading to s3 and creating attachments')
-                                                key = str(uuid4())
-                                                try:
-                                                    bucket_name = get_settings_by_filter(db, filter={'key': 's3_bucket_name'}).value
-                                                    s3_client.put_object(Body=part.get_content(), Bucket=bucket_name, Key=key, ContentDisposition=f'inline; filename="{part.get_filename()}"', ContentType=part.get_content_type())
-                                                    db_attachment = create_attachment(db, attachment=schemas.AttachmentCreate.model_validate({'object_id': db_thread_entry.entry_id, 'size': len(part.get_content(
-                                                    )), 'type': part.get_content_type(), 'name': part.get_filename(), 'inline': 1, 'link': f'https://{bucket_name}.s3.amazonaws.com/{key}'}))
-                                                except:
-                                                    traceback.print_exc()
-                                        elif part.get_content_type() == 'text/html':
-                                            found_start = True
-                                db_email.uid_max = uids_list[-1]
-                                db.commit()
-                                mail.logout()
-
-
-                            else:
-                                print('this is a new thread')
-                                # obtaining the inline content; for now any inline attachments will be moved to regular attachments and the inline tags will be removed
-                                subject = str(email_content['Subject'])
-
-                                print('obtaining email contents')
-                                try:
-                                    body = email_content.get_body(
-                                        preferencelist=('html')).get_content()
-                                    soup = BeautifulSoup(body, 'html.parser')
-
-                                    for tag in ['img', 'audio', 'video']:
-                                        for component in soup.find_all(tag):
-                                            component.decompose()  # Removes the tag from the document
-                                    body = str(soup)
-                                except:
-                                    body = ''
-                                # print(body)
-
-                                default_topic_id = get_settings_by_filter(db, filter={'key': 'default_topic_id'}).value
-                                db_ticket = create_ticket(background_task=background_task, db=db, ticket=schemas.TicketCreate.model_validate({'user_id': db_user.user_id, 'topic_id': default_topic_id, 'title': subject, 'description': body, 'source': 'email'}), creator='user', frontend_url=os.getenv('FRONTEND_URL'))
-                                # print(db_ticket.thread.thread_id)
-                                # fetch form_id from topic_id
-
-                                db_form_entry = get_form_entry_by_filter(db, filter={'ticket_id': db_ticket.ticket_id})
-                                if db_form_entry:
-                                    # fetch fields from form
-                                    db_topic = get_topic_by_filter(db, filter={'topic_id': default_topic_id})
-                                    form_fields = get_form_fields_per_form(db, db_topic.form_id)
-                                    # print(form_fields)
-                                    
-                                    # create empty values for each field
-                                    for field in form_fields:
-                                        form_value = {'form_id': db_topic.form_id, 'field_id': field.field_id, 'value': '', 'entry_id': db_form_entry.entry_id}
-                                        db_form_value = models.FormValue(**form_value)
-                                        db.add(db_form_value)
-
-                                # db_thread = create_thread(db=db, thread={'ticket_id': db_ticket.ticket_id})
-                                db_thread_entry = create_thread_entry(background_task=background_task, db=db, thread_entry=schemas.ThreadEntryCreate.model_validate(
-                                    {'thread_id': db_ticket.thread.thread_id, 'user_id': db_user.user_id, 'type': 'A', 'owner': db_user.firstname + " " + db_user.lastname, 'editor': '', 'subject': subject, 'body': body, 'recipients': ''}))
-
-                                # add a row for the email source table
-                                db_email_source = create_email_source(db=db, email_source=schemas.EmailSourceCreate.model_validate({'thread_entry_id': db_thread_entry.entry_id, 'email_id': db_email.email_id, 'email_uid': int(uid), 'message_id': email_content['Message-ID']}))
-                                
-                                # uploading the attachments present in the email if the s3 client is set up, otherwise nothing happens here and the attachments will be ignored
-                                found_start = False
-
-                                s3_client = s3_manager.get_client()
-
-                                # because of the extra headers sent for the body of the email, we are looking for any headers that exist beyond the html/text in the body (hence the found_start part)
-                                if s3_client is not None:
-                                    for part in email_content.walk():
-                                        # print(part.get_content_type())
-                                        if found_start:
-                                            if (part.get_content_type() in safe_file_types):
-                                                print(
-                                                    'we are uploading to s3 and creating attachments')
-                                                key = str(uuid4())
-                                                try:
-                                                    bucket_name = get_settings_by_filter(db, filter={'key': 's3_bucket_name'}).value
-                                                    s3_client.put_object(Body=part.get_content(), Bucket=bucket_name, Key=key, ContentDisposition=f'inline; filename="{part.get_filename()}"', ContentType=part.get_content_type())
-                                                    db_attachment = create_attachment(db, attachment=schemas.AttachmentCreate.model_validate({'object_id': db_thread_entry.entry_id, 'size': len(part.get_content(
-                                                    )), 'type': part.get_content_type(), 'name': part.get_filename(), 'inline': 1, 'link': f'https://{bucket_name}.s3.amazonaws.com/{key}'}))
-                                                except:
-                                                    traceback.print_exc()
-                                        elif part.get_content_type() == 'text/html':
-                                            found_start = True
-                                db_email.uid_max = uids_list[-1]
-                                db.commit()
-                                # email_thread.join()
-                                mail.logout()
-                        else:
-                            print(status)
-                            continue
-                else:
-                    print(f'No new emails for {db_email.email}')
-                    mail.logout()
-                    continue
+            future = s3_manager.upload_fileobj(spooled, bucket_name, key, {'ContentDisposition': f'inline; filename="{name}"', 'ContentType': content_type})
+        except Exception as e:
+            # an upload that could not even start fails like one that did
+            future = Future()
+            future.set_exception(e)
+        uploads.append((future, spooled, row))
+    return uploads
+
+
+def email_uploads_done(uploads: list):
+    # waits for every upload of a message, False when any of them failed
+    done = True
+    for future, spooled, row in uploads:
+        try:
+            future.result()
+        except:
+            traceback.print_exc()
+            done = False
+    return done
+
+
+def save_email_attachments(db: Session, object_id: int, uploads: list):
+    # adds the rows of uploads that have all finished, in one insert
+    rows = []
+    for future, spooled, row in uploads:
+        rows.append({**row, 'object_id': object_id})
+        spooled.close()
+    if rows:
+        db.execute(insert(models.Attachment), rows)
+    return rows
+
+
+def discard_email_attachments(db: Session, s3_manager: S3Manager, uploads: list):
+    # deletes the uploaded objects of a message whose rows were rolled back. failed uploads are included, a request
+    # that errored on our side may still have landed and deleting a missing key is not an error
+    keys = []
+    for future, spooled, row in uploads:
+        try:
+            future.result()
+        except:
+            pass
+        finally:
+            spooled.close()
+        keys.append(row['link'].rsplit('/', 1)[-1])
+    if keys:
+        try:
+            s3_manager.delete_objects(get_settings_snapshot(db).get('s3_bucket_name'), keys)
+        except:
+            traceback.print_exc()
+            print(f'Could not delete {len(keys)} orphaned attachments')
+
+
+def parse_message_ids(value):
+    return re.findall(r'<[^<>\s]+>', str(value or ''))
+
+
+def resolve_reply_thread(db: Session, db_email: models.Email, email_content, mail=None):
+    # In-Reply-To first, then References from the most recent ancestor back to the root
+    candidates = parse_message_ids(email_content.get('In-Reply-To')) + parse_message_ids(email_content.get('References'))[::-1]
+    if not candidates:
+        return None
+
+    # every message we ingest is indexed by its own Message-ID, so this is normally a single lookup
+    rows = db.query(models.EmailSource.message_id, models.ThreadEntry.thread_id) \
+        .join(models.ThreadEntry, models.ThreadEntry.entry_id == models.EmailSource.thread_entry_id) \
+        .filter(models.EmailSource.email_id == db_email.email_id, models.EmailSource.message_id.in_(set(candidates))).all()
+    thread_ids = dict(rows)
+    for candidate in candidates:
+        if candidate in thread_ids:
+            return thread_ids[candidate]
+
+    if mail is None:
+        return None
+
+    # sources stored before the index existed only know the thread root's uid, ask the server for it
+    print('falling back to imap search for the parent email')
+    for candidate in candidates:
+        _, data = mail.uid('SEARCH', None, f'HEADER "Message-ID" "{candidate}"')
+        parent_uids = [int(u) for u in data[0].split()]
+        if not parent_uids:
+            continue
+        db_thread_entry = db.query(models.ThreadEntry) \
+            .join(models.EmailSource, models.ThreadEntry.entry_id == models.EmailSource.thread_entry_id) \
+            .filter(models.EmailSource.email_id == db_email.email_id, models.EmailSource.email_uid.in_(parent_uids)).first()
+        if db_thread_entry:
+            return db_thread_entry.thread_id
+    return None
+
+
+ParsedEmail = namedtuple('ParsedEmail', ['uid', 'message_id', 'email_content', 'user_email', 'first_name', 'last_name', 'subject', 'body', 'reply_body', 'attachments'])
+
+
+def clean_email_body(body: str):
+    soup = BeautifulSoup(body, 'html.parser')
+    for tag in ['img', 'audio', 'video']:
+        # dealing with inline attachment tags for now
+        for component in soup.find_all(tag):
+            component.decompose()  # Removes the tag from the document
+    return str(soup)
+
+
+def parse_email_message(db_email: models.Email, uid: int, raw: bytes):
+    # everything about a message that does not need the database, None if the sender is banned
+    email_content = email.message_from_bytes(raw, policy=default)
+
+    # obtaining the from email
+    sender_name = email_content['From']
+
+    first_name = ''
+    last_name = ''
+
+    email_extraction = r'<(.*?)>'
+    user_email = re.findall(
+        email_extraction, sender_name)
+    
+    # checking the banned emails to see if we skip or continue with this process
+    if user_email[0] in db_email.banned_emails:
+        print(f'{user_email[0]} email was skipped')
+        return None
+
+    # there is a name present with the email
+    if len(sender_name.split('<')[0]) > 0:
+        # the name on the email is more than 1 word, ideally it will only be 2 but for now we will just put the first two words that show up
+        if (len(sender_name.split('<')[0].split(' '))) == 3:
+            first_name = sender_name.split(
+                '<')[0].split(' ')[0]
+            last_name = sender_name.split(
+                '<')[0].split(' ')[1]
+        # just taking the entire name there and making it the first name
+        else:
+            first_name = sender_name.split(
+                '<')[0].split(' ')[0]
+            last_name = ''
+    # there was no from name and just an email
+    else:
+        first_name = user_email
+        last_name = ''
+
+    # obtaining the inline content; for now any inline attachments will be moved to regular attachments and the inline tags will be removed
+    subject = str(email_content['Subject'])
+
+    print('obtaining email contents')
+    try:
+        body = clean_email_body(email_content.get_body(preferencelist=('html')).get_content())
+    except:
+        body = ''
+
+    # whether this is a reply is only known once earlier messages of the batch are stored, so the reply version of the body is prepared too
+    try:
+        # because replying to an email will include a quote referencing the previous replies, we are extracting all the content before we see the container containing the quoted replies. Regex may not be reliable will have to test
+        reply_body = email_content.get_body(preferencelist=('html')).get_content()
+        # if no match is made, include the entire body
+        pattern = r"(.*?)(<br\s*/?>\s*)*(<div class=\"gmail_quote gmail_quote_container\"|<div name=\"messageReplySection\">)"
+        extracted_reply = re.search(
+            pattern, reply_body, re.DOTALL)
+        reply_body = clean_email_body(extracted_reply.group(1).strip())
+    except:
+        reply_body = ''
+
+    return ParsedEmail(uid=int(uid), message_id=str(email_content['Message-ID'] or '').strip(), email_content=email_content, user_email=user_email[0],
+                       first_name=first_name, last_name=last_name, subject=subject, body=body, reply_body=reply_body,
+                       attachments=extract_email_attachments(email_content))
+
+
+def store_email_message(background_task: BackgroundTasks, db: Session, db_email: models.Email, parsed: ParsedEmail, uploads: list, mail=None, commit: bool = True):
+    # creating a new user if necessary
+    db_user = db.query(models.User).filter(
+        models.User.email == parsed.user_email).first()
+    if not db_user:
+        print(
+            'generating a user w/ status 2 if they dont exist')
+        db_user = create_user(db=db, user=schemas.UserCreate.model_validate({'email': parsed.user_email, 'firstname': parsed.first_name, 'lastname': parsed.last_name}), commit=commit)
+    
+    # check if the new email is a reply or new email thread; if reply we are gonna find the thread of the email it answers and attach this email as a new thread entry there
+    email_content = parsed.email_content
+    reply_thread_id = None
+    if email_content.get('In-Reply-To') or email_content.get('References'):
+        reply_thread_id = resolve_reply_thread(db, db_email, email_content, mail)
+
+    if reply_thread_id is not None:
+        print('this is a reply')
+        db_thread_entry = create_thread_entry(background_task=background_task, db=db, thread_entry=schemas.ThreadEntryCreate.model_validate({'thread_id': reply_thread_id, 'user_id': db_user.user_id, 'type': 'A', 'owner': db_user.firstname + " " + db_user.lastname, 'editor': '', 'body': parsed.reply_body, 'recipients': ''}), commit=commit)
+
+    else:
+        print('this is a new thread')
+        default_topic_id = get_settings_snapshot(db).get_int('default_topic_id')
+        db_ticket = create_ticket(background_task=background_task, db=db, ticket=schemas.TicketCreate.model_validate({'user_id': db_user.user_id, 'topic_id': default_topic_id, 'title': parsed.subject, 'description': parsed.body, 'source': 'email'}), creator='user', frontend_url=os.getenv('FRONTEND_URL'), commit=commit)
+        # fetch form_id from topic_id
+
+        db_form_entry = get_form_entry_by_filter(db, filter={'ticket_id': db_ticket.ticket_id})
+        if db_form_entry:
+            # fetch fields from form
+            db_topic = get_topic_by_filter(db, filter={'topic_id': default_topic_id})
+            form_fields = get_form_fields_per_form(db, db_topic.form_id)
+            
+            # create empty values for each field
+            for field in form_fields:
+                form_value = {'form_id': db_topic.form_id, 'field_id': field.field_id, 'value': '', 'entry_id': db_form_entry.entry_id}
+                db_form_value = models.FormValue(**form_value)
+                db.add(db_form_value)
+
+        db_thread_entry = create_thread_entry(background_task=background_task, db=db, thread_entry=schemas.ThreadEntryCreate.model_validate(
+            {'thread_id': db_ticket.thread.thread_id, 'user_id': db_user.user_id, 'type': 'A', 'owner': db_user.firstname + " " + db_user.lastname, 'editor': '', 'subject': parsed.subject, 'body': parsed.body, 'recipients': ''}), commit=commit)
+
+    # add a row for the email source table
+    create_email_source(db=db, email_source=schemas.EmailSourceCreate.model_validate({'thread_entry_id': db_thread_entry.entry_id, 'email_id': db_email.email_id, 'email_uid': parsed.uid, 'message_id': parsed.message_id}), commit=commit)
+
+    # attachments were uploaded while the batch was parsed, only their rows are left
+    save_email_attachments(db, db_thread_entry.entry_id, uploads)
+    persist(db, commit)
+    return db_thread_entry
+
+
+def retryable_ingest_error(e: BaseException):
+    # a locked database or a clashing row can succeed on the next poll. the create helpers turn every error into an
+    # HTTPException raised inside their except, so the database error is looked for down the exception's context
+    while e is not None:
+        if isinstance(e, (OperationalError, IntegrityError)):
+            return True
+        e = e.__cause__ or e.__context__
+    return False
+
+
+def ingest_email_batch(background_task: BackgroundTasks, db: Session, db_email: models.Email, messages: list, s3_manager: S3Manager, mail=None):
+    # parses and uploads a batch first, then stores all of it in one transaction so a crash mid batch is simply retried
+    if not messages:
+        return 0
+    uid_max = max(uid for uid, _ in messages)
+
+    # (email_id, uid) is unique on email sources, anything already stored is skipped on a retry
+    stored = {uid for uid, in db.query(models.EmailSource.email_uid).filter(
+        models.EmailSource.email_id == db_email.email_id, models.EmailSource.email_uid.in_([uid for uid, _ in messages])).all()}
+
+    batch = []
+    for uid, raw in messages:
+        if uid in stored:
+            continue
+        try:
+            parsed = parse_email_message(db_email, uid, raw)
         except:
             traceback.print_exc()
-            raise HTTPException(400, 'Error during creation')
+            print(f'Could not parse message {uid} for {db_email.email}')
+            continue
+        if parsed is not None:
+            batch.append(parsed)
+
+    s3_client = s3_manager.get_client() if s3_manager else None
+    uploads = {}
+    for parsed in batch:
+        # uploading the attachments present in the email if the s3 client is set up, otherwise nothing happens here and the attachments will be ignored
+        if s3_client is not None:
+            uploads[parsed.uid] = upload_email_attachments(db, s3_manager, parsed.attachments)
+        else:
+            for _, _, spooled, _ in parsed.attachments:
+                spooled.close()
+
+    # the uploads finish before the transaction opens, on sqlite its write lock would be held for the transfers.
+    # a message missing an attachment is not stored, it is retried from on the next poll like a database error
+    retry_from = None
+    failed = set()
+    for parsed in batch:
+        if not email_uploads_done(uploads.get(parsed.uid, [])):
+            print(f'Could not upload the attachments of message {parsed.uid} for {db_email.email}, retrying it next poll')
+            discard_email_attachments(db, s3_manager, uploads.pop(parsed.uid))
+            failed.add(parsed.uid)
+            retry_from = parsed.uid if retry_from is None else min(retry_from, parsed.uid)
+    batch = [parsed for parsed in batch if parsed.uid not in failed]
+
+    # sequential numbers come from their own session, reserve them now so it does not wait on this transaction's lock
+    current_settings = get_settings_snapshot(db)
+    if batch and current_settings.get('default_ticket_number_sequence') == 'Sequential':
+        reserve_sequence_numbers(Ticket, len(batch), current_settings.get('default_ticket_number_format'))
+
+    try:
+        # writing uid_max first opens the transaction before the first savepoint
+        db_email.uid_max = uid_max
+        db.flush()
+        for parsed in batch:
+            savepoint = db.begin_nested()
+            try:
+                store_email_message(background_task, db, db_email, parsed, uploads.get(parsed.uid, []), mail, commit=False)
+                savepoint.commit()
+            except Exception as e:
+                traceback.print_exc()
+                savepoint.rollback()
+                discard_email_attachments(db, s3_manager, uploads.pop(parsed.uid, []))
+                # anything that is not a database error would fail again and is skipped
+                if retryable_ingest_error(e):
+                    retry_from = parsed.uid if retry_from is None else min(retry_from, parsed.uid)
+                    print(f'Could not ingest message {parsed.uid} for {db_email.email}, retrying it next poll')
+                else:
+                    print(f'Could not ingest message {parsed.uid} for {db_email.email}')
+        if retry_from is not None:
+            # messages above it that were stored are skipped on the retry by the email sources check
+            db_email.uid_max = retry_from - 1
+        db.commit()
+    except:
+        db.rollback()
+        for pending in uploads.values():
+            discard_email_attachments(db, s3_manager, pending)
+        raise
     finally:
-        db.close()
+        for pending in uploads.values():
+            for _, spooled, _ in pending:
+                spooled.close()
+    notify_outbox()
+    return len(batch)
+
+
+def poll_mailbox(background_task: BackgroundTasks, db: Session, db_email: models.Email, mail, s3_manager: S3Manager):
+    # ingests everything above the mailbox's uid_max, returns how many messages were handled
+    count = 0
+    for messages in fetch_new_messages(mail, db_email.uid_max or 0):
+        count += ingest_email_batch(background_task, db, db_email, messages, s3_manager, mail)
+        if messages and (db_email.uid_max or 0) < messages[-1][0]:
+            # part of the batch is retried on the next poll, later batches must not move uid_max past it
+            break
+    if not count:
+        print(f'No new emails for {db_email.email}')
+    return count
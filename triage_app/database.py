@@ -1,12 +1,17 @@
 from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.schema import MetaData
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from dotenv import load_dotenv
 from . import models
 # from .crud import get_settings_by_filter, decrypt
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import boto3
 from botocore import client
@@ -18,16 +23,131 @@ file_path = os.path.dirname(__file__)
 
 SQLALCHEMY_DATABASE_URL = os.getenv('SQLALCHEMY_DATABASE_URL')
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base(metadata=MetaData())
+def env_int(name: str, default: int):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def env_bool(name: str, default: bool):
+    value = os.getenv(name)
+    return value.lower() in ('1', 'true', 'yes', 'on') if value not in (None, '') else default
+
+
+# sqlite: milliseconds a writer waits on a locked database, and the page cache / mmap sizes
+SQLITE_BUSY_TIMEOUT = env_int('SQLITE_BUSY_TIMEOUT', 5000)
+SQLITE_CACHE_SIZE = env_int('SQLITE_CACHE_SIZE', -64000)  # negative is KiB, so 64MB
+SQLITE_MMAP_SIZE = env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+
+# postgres and other server databases: connections kept open, extra ones allowed under load,
+# seconds to wait for a free connection and seconds before a connection is replaced
+DB_POOL_SIZE = env_int('DB_POOL_SIZE', 10)
+DB_MAX_OVERFLOW = env_int('DB_MAX_OVERFLOW', 20)
+DB_POOL_TIMEOUT = env_int('DB_POOL_TIMEOUT', 30)
+DB_POOL_RECYCLE = env_int('DB_POOL_RECYCLE', 1800)
+DB_POOL_PRE_PING = env_bool('DB_POOL_PRE_PING', True)
+
+
+class PoolWaitTimer:
+    # times every connection checkout, so the metrics show how long requests queue for the pool.
+    # dispose() recreates the pool, which starts the counters over
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self._wait_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._wait_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._wait_lock:
+                self.waits += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+class TimedQueuePool(PoolWaitTimer, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(PoolWaitTimer, AsyncAdaptedQueuePool):
+    pass
 
 
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
+def set_sqlite_pragmas(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
\ No newline at end of file
+    # WAL lets readers carry on while a write is in progress, NORMAL only syncs at checkpoints
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def engine_options(url: str, is_async: bool = False):
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        options = {'connect_args': {'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT / 1000}}
+        # in memory databases live and die with their one connection, keep sqlalchemy's default pool
+        if url.database not in (None, '', ':memory:'):
+            options['poolclass'] = TimedAsyncQueuePool if is_async else TimedQueuePool
+        return options
+    return {'poolclass': TimedAsyncQueuePool if is_async else TimedQueuePool, 'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW, 'pool_timeout': DB_POOL_TIMEOUT, 'pool_recycle': DB_POOL_RECYCLE,
+            'pool_pre_ping': DB_POOL_PRE_PING}
+
+
+def make_engine(url: str):
+    db_engine = create_engine(url, **engine_options(url))
+    if db_engine.dialect.name == 'sqlite':
+        event.listen(db_engine, 'connect', set_sqlite_pragmas)
+    return db_engine
+
+
+def make_async_engine(url: str):
+    db_engine = create_async_engine(url, **engine_options(url, is_async=True))
+    if db_engine.dialect.name == 'sqlite':
+        event.listen(db_engine.sync_engine, 'connect', set_sqlite_pragmas)
+    return db_engine
+
+
+def pool_stats(db_engine):
+    pool = db_engine.pool
+    stats = {'dialect': db_engine.dialect.name, 'pool': type(pool).__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({'size': pool.size(), 'checked_in': pool.checkedin(), 'checked_out': pool.checkedout(),
+                      'overflow': pool.overflow()})
+    if isinstance(pool, PoolWaitTimer):
+        with pool._wait_lock:
+            stats.update({'checkouts': pool.waits, 'timeouts': pool.timeouts, 'wait_max': pool.wait_max,
+                          'wait_avg': pool.wait_total / pool.waits if pool.waits else 0.0})
+    return stats
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# opt in async engine for the read routes, e.g. sqlite+aiosqlite:///./triage.db or postgresql+asyncpg://...
+# pointing at the same database, when unset every route runs on the sync engine
+SQLALCHEMY_ASYNC_DATABASE_URL = os.getenv('SQLALCHEMY_ASYNC_DATABASE_URL')
+
+async_engine = make_async_engine(
+    SQLALCHEMY_ASYNC_DATABASE_URL
+) if SQLALCHEMY_ASYNC_DATABASE_URL else None
+# nothing may lazy load on an async session, so loaded objects must not expire on commit
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False) if async_engine else None
+
+Base = declarative_base(metadata=MetaData())
@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # small thread safe lru cache where every entry also expires after ttl seconds
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float = None):
+        # ttl overrides the cache wide one for this entry
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def invalidate(self, predicate):
+        # drops every entry whose key matches the predicate
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,173 @@
+import select
+import ssl
+import threading
+import time
+import traceback
+
+from fastapi import BackgroundTasks
+from sqlalchemy.orm import Session
+
+from . import models
+from .crud import connect_imap, poll_mailbox
+from .database import SessionLocal
+from .s3 import S3Manager
+
+
+class IMAPPoller:
+    # keeps one imap connection open per active mailbox and ingests new mail as it arrives,
+    # using IDLE where the server supports it and short interval polling where it does not
+
+    def __init__(self, s3_manager: S3Manager, connect_factory=None, max_parallel: int = 4,
+                 poll_interval: float = 30, idle_timeout: float = 600, refresh_interval: float = 60,
+                 reconnect_backoff: float = 30, timeout: float = 60):
+        self.s3_manager = s3_manager
+        # connect_factory(db_email) -> logged in imaplib client with the inbox selected,
+        # swappable so the poller can run against a local imap stub
+        self.connect_factory = connect_factory or (lambda db_email: connect_imap(db_email, timeout=timeout))
+        self.poll_interval = poll_interval
+        # servers drop idle sessions after 30 minutes, re-issue IDLE well before that
+        self.idle_timeout = idle_timeout
+        self.refresh_interval = refresh_interval
+        self.reconnect_backoff = reconnect_backoff
+        # bounds how many mailboxes ingest at once, waiting in IDLE does not hold a slot
+        self._slots = threading.BoundedSemaphore(max_parallel)
+        self._stop = threading.Event()
+        # email_id -> (thread, per mailbox stop event)
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._supervisor = None
+
+    def start(self):
+        if self._supervisor and self._supervisor.is_alive():
+            return
+        self._stop.clear()
+        self._supervisor = threading.Thread(target=self._supervise, name='imap-poller', daemon=True)
+        self._supervisor.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers = {}
+        for _, stop in workers:
+            stop.set()
+        if self._supervisor:
+            self._supervisor.join(timeout)
+        for thread, _ in workers:
+            thread.join(timeout)
+
+    def active_mailboxes(self):
+        db: Session = SessionLocal()
+        try:
+            return {email_id for email_id, in db.query(models.Email.email_id).filter(models.Email.imap_active_status == 1).all()}
+        finally:
+            db.close()
+
+    def _supervise(self):
+        # starts and stops mailbox workers as mailboxes are activated, deactivated or deleted
+        while not self._stop.is_set():
+            try:
+                active = self.active_mailboxes()
+                with self._lock:
+                    for email_id in list(self._workers):
+                        thread, stop = self._workers[email_id]
+                        if email_id not in active or not thread.is_alive():
+                            stop.set()
+                            del self._workers[email_id]
+                    for email_id in active - set(self._workers):
+                        stop = threading.Event()
+                        thread = threading.Thread(target=self._run_mailbox, args=(email_id, stop), name=f'imap-{email_id}', daemon=True)
+                        self._workers[email_id] = (thread, stop)
+                        thread.start()
+            except:
+                traceback.print_exc()
+            self._stop.wait(self.refresh_interval)
+
+    def _run_mailbox(self, email_id: int, stop: threading.Event):
+        db: Session = SessionLocal()
+        try:
+            while not stop.is_set():
+                mail = None
+                try:
+                    db_email = db.query(models.Email).filter(models.Email.email_id == email_id).first()
+                    if not db_email or db_email.imap_active_status != 1:
+                        return
+                    mail = self.connect_factory(db_email)
+                    supports_idle = 'IDLE' in mail.capabilities
+                    while not stop.is_set():
+                        with self._slots:
+                            # picks up settings or credential edits made since the last pass
+                            db.refresh(db_email)
+                            poll_mailbox(BackgroundTasks(), db, db_email, mail, self.s3_manager)
+                        if supports_idle:
+                            self.idle(mail, stop)
+                        else:
+                            stop.wait(self.poll_interval)
+                            # keeps the session alive and lets the server report new mail
+                            mail.noop()
+                except:
+                    traceback.print_exc()
+                    db.rollback()
+                    print(f'IMAP connection for email {email_id} failed, reconnecting')
+                    stop.wait(self.reconnect_backoff)
+                finally:
+                    if mail is not None:
+                        try:
+                            mail.logout()
+                        except:
+                            pass
+        finally:
+            db.close()
+
+    def idle(self, mail, stop: threading.Event):
+        # imaplib has no IDLE support before 3.14, so the command is driven by hand:
+        # wait for any untagged response, then end the idle with DONE
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+        line = mail.readline()
+        while not line.startswith(b'+'):
+            if line.startswith(tag):
+                raise mail.error(f'IDLE rejected: {line!r}')
+            line = mail.readline()
+
+        deadline = time.monotonic() + self.idle_timeout
+        while not stop.is_set() and time.monotonic() < deadline:
+            if self.has_response(mail):
+                break
+            select.select([mail.sock], [], [], 1)
+
+        mail.send(b'DONE\r\n')
+        while True:
+            line = mail.readline()
+            if not line:
+                raise mail.abort('connection closed during IDLE')
+            if line.startswith(tag):
+                break
+
+    def has_response(self, mail):
+        # imaplib reads through a buffered file and ssl keeps its own buffer, so select on the
+        # socket alone can miss a response that already arrived; peek without blocking instead
+        timeout = mail.sock.gettimeout()
+        mail.sock.settimeout(0)
+        try:
+            return bool(mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            mail.sock.settimeout(timeout)
+
+
+imap_poller: IMAPPoller = None
+
+
+def start_imap_poller(s3_manager: S3Manager):
+    global imap_poller
+    if imap_poller is None:
+        imap_poller = IMAPPoller(s3_manager)
+    imap_poller.start()
+    return imap_poller
+
+
+def stop_imap_poller():
+    if imap_poller is not None:
+        imap_poller.stop()
@@ -0,0 +1,104 @@
+# reports which saved queue filters and sorts are not backed by an index
+# usage: python -m triage_app.index_report
+
+import json
+import warnings
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal, engine
+
+# filters that compare against a single value, an index can serve these and then the sort
+EQUALITY_OPS = {'==', 'in', 'eq'}
+# filters handled by special_filter, mapped to the ticket column they end up on
+SPECIAL_FILTER_COLUMNS = {'agents.name': 'agent_id', 'users.name': 'user_id'}
+
+
+def split_column(data: str):
+    split = data.split('.')
+    return (split[0], split[1]) if len(split) == 2 else ('tickets', split[0])
+
+
+def ticket_column_for(table: str, column: str):
+    # filters on a joined table reach tickets through its foreign key column
+    if table == 'tickets':
+        return column
+    for fk in models.Ticket.__table__.foreign_keys:
+        if fk.column.table.name == table:
+            return fk.parent.name
+    return None
+
+
+def table_indexes(table: str):
+    inspector = inspect(engine)
+    with warnings.catch_warnings():
+        # expression indexes such as ix_tickets_overdue_deadline cannot be reflected on sqlite
+        warnings.simplefilter('ignore')
+        indexes = [(index['name'], [c for c in index['column_names'] if c]) for index in inspector.get_indexes(table)]
+    primary = inspector.get_pk_constraint(table)
+    if primary and primary.get('constrained_columns'):
+        indexes.append((primary.get('name') or 'primary key', primary['constrained_columns']))
+    return [(name, columns) for name, columns in indexes if columns]
+
+
+def covering_index(indexes: list, column: str, prefix: set = frozenset()):
+    # an index serves the column when it follows only columns pinned by equality filters
+    for name, columns in indexes:
+        for indexed in columns:
+            if indexed == column:
+                return name
+            if indexed not in prefix:
+                break
+    return None
+
+
+def queue_index_coverage(db: Session):
+    indexes = table_indexes('tickets')
+    report = []
+    for db_queue in db.query(models.Queue).order_by(models.Queue.queue_id).all():
+        config = json.loads(db_queue.config)
+        filters = []
+        equality_columns = set()
+        for data, op, _ in config.get('filters', []):
+            if op == 'search':
+                # served by the full text search tables rather than a tickets index
+                filters.append({'filter': data, 'op': op, 'column': None, 'index': 'ticket_search'})
+                continue
+            column = SPECIAL_FILTER_COLUMNS.get(data) or ticket_column_for(*split_column(data))
+            index = covering_index(indexes, column) if column else None
+            filters.append({'filter': data, 'op': op, 'column': column, 'index': index})
+            if column and op in EQUALITY_OPS:
+                equality_columns.add(column)
+
+        sorts = []
+        for data in config.get('sorts', []):
+            table, column = split_column(data.lstrip('-'))
+            # sorting on a joined table can never use a tickets index
+            index = covering_index(indexes, column, equality_columns) if table == 'tickets' else None
+            sorts.append({'sort': data, 'column': column if table == 'tickets' else None, 'index': index})
+            # only the first sort key can come straight off the index
+            break
+
+        report.append({'queue_id': db_queue.queue_id, 'title': db_queue.title, 'filters': filters, 'sorts': sorts})
+    return report
+
+
+def print_report(report: list):
+    uncovered = 0
+    for queue in report:
+        missing = [f"filter {f['filter']} {f['op']}" for f in queue['filters'] if not f['index']] + \
+                  [f"sort {s['sort']}" for s in queue['sorts'] if not s['index']]
+        uncovered += len(missing)
+        status = 'ok' if not missing else 'not covered: ' + ', '.join(missing)
+        print(f"queue {queue['queue_id']} ({queue['title']}): {status}")
+    print(f'{uncovered} filters or sorts without an index')
+
+
+if __name__ == '__main__':
+    db = SessionLocal()
+    try:
+        print_report(queue_index_coverage(db))
+    finally:
+        db.close()
@@ -2,40 +2,51 @@ from contextlib import asynccontextmanager
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
-from fastapi import BackgroundTasks, FastAPI, Request
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_pagination import add_pagination
 
 from triage_app import models
-from .crud import (create_imap_server, decrypt, get_settings_by_filter,
-                   mark_tickets_overdue)
-from .database import SessionLocal, engine
+from .crud import (get_settings_snapshot, mark_tickets_overdue,
+                   rebuild_ticket_daily_stats)
+from .database import SessionLocal, async_engine, engine
+from .imap_poller import start_imap_poller, stop_imap_poller
+from .migrate import run_migrations
+from .reports import shutdown_report_pool
+from .outbox import start_outbox_worker, stop_outbox_worker
 from .routes import (agent, attachment, auth, category, column, default_column,
                      department, email, form, form_entry, form_field,
-                     form_value, group, group_member, queue, role, schedule,
-                     schedule_entry, settings, sla, task, template, thread,
-                     thread_collaborators, thread_entry, thread_event, ticket,
-                     ticket_priority, ticket_status, topic, user)
+                     form_value, group, group_member, metrics, queue, report, role, schedule,
+                     schedule_entry, settings, settings_async, sla, task, template, thread,
+                     thread_collaborators, thread_entry, thread_entry_async, thread_event, ticket,
+                     ticket_async, ticket_priority, ticket_status, topic, user)
 from .s3 import S3Manager
+from .search import rebuild_search_index
+from .smtp_pool import smtp_pool
+from .password_pool import bcrypt_pool
 from triage_app.seed import seed_initial_data
 
-models.Base.metadata.create_all(bind=engine)
+run_migrations()
 seed_initial_data()
+# databases that predate the dashboard rollup get it filled once
+rebuild_ticket_daily_stats(only_if_empty=True)
+# the same for the search index, which the migration only creates
+rebuild_search_index(only_if_empty=True)
 
 load_dotenv()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     db = SessionLocal()
-    background_task = BackgroundTasks()
     aws_access_key_id = ''
     aws_secret_access_key = ''
     region_name = ''
 
     try:
-        aws_access_key_id = decrypt(get_settings_by_filter(db, filter={'key': 's3_access_key'}).value)
-        aws_secret_access_key = decrypt(get_settings_by_filter(db, filter={'key': 's3_secret_access_key'}).value)
-        region_name = get_settings_by_filter(db, filter={'key': 's3_bucket_region'}).value
+        current_settings = get_settings_snapshot(db)
+        aws_access_key_id = current_settings.get_secret('s3_access_key')
+        aws_secret_access_key = current_settings.get_secret('s3_secret_access_key')
+        region_name = current_settings.get('s3_bucket_region')
     except:
         pass
 
@@ -44,13 +55,26 @@ async def lifespan(app: FastAPI):
 
     scheduler = BackgroundScheduler()
     scheduler.add_job(func=mark_tickets_overdue, trigger='cron', args=[], hour='*/1')
-    scheduler.add_job(func=create_imap_server, trigger='cron', args=[background_task, s3_client], minute='*/5')
+    scheduler.add_job(func=smtp_pool.evict_idle, trigger='interval', minutes=1)
 
     scheduler.start()
-    
+
+    # outbound mail is queued in the outbox table and sent from here
+    start_outbox_worker()
+    # incoming mail is picked up over persistent imap connections
+    start_imap_poller(s3_client)
     
     yield {'s3_client': s3_client}
 
+    stop_imap_poller()
+    shutdown_report_pool()
+    if async_engine is not None:
+        await async_engine.dispose()
+    s3_client.shutdown()
+    stop_outbox_worker()
+    smtp_pool.close_all()
+    bcrypt_pool.shutdown()
+
     
 
 app = FastAPI(lifespan=lifespan)
@@ -72,6 +96,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# with an async engine configured the hot reads are served on the event loop,
+# their routers go first so they take the paths over from the sync ones
+if async_engine is not None:
+    app.include_router(ticket_async.router)
+    app.include_router(thread_entry_async.router)
+    app.include_router(settings_async.router)
+
 app.include_router(agent.router)
 app.include_router(auth.router)
 app.include_router(ticket.router)
@@ -103,6 +134,8 @@ app.include_router(column.router)
 app.include_router(queue.router)
 app.include_router(email.router)
 app.include_router(attachment.router)
+app.include_router(report.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,38 @@
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+
+from . import models
+from .database import engine
+from .search import create_search_schema
+
+# databases created by create_all before the migrations existed are stamped with this revision
+BASELINE_REVISION = '0001'
+
+
+def alembic_config(connection=None):
+    config = Config()
+    config.set_main_option('script_location', os.path.join(os.path.dirname(__file__), 'migrations'))
+    config.attributes['connection'] = connection
+    return config
+
+
+def run_migrations():
+    with engine.begin() as connection:
+        config = alembic_config(connection)
+        tables = inspect(connection).get_table_names()
+        if 'alembic_version' not in tables:
+            if 'tickets' not in tables:
+                # a new database gets the current schema in one go
+                models.Base.metadata.create_all(bind=connection)
+                create_search_schema(connection)
+                command.stamp(config, 'head')
+                return
+            command.stamp(config, BASELINE_REVISION)
+        command.upgrade(config, 'head')
+
+
+if __name__ == '__main__':
+    run_migrations()
@@ -0,0 +1,48 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from triage_app import models
+from triage_app.database import engine
+from triage_app.search import SEARCH_TABLES
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+
+def include_name(name, type_, parent_names):
+    # the full text search tables (and the fts5 shadow tables behind them) live outside the models
+    if type_ == 'table':
+        return not name.startswith(SEARCH_TABLES)
+    return True
+
+
+def run_migrations_offline():
+    context.configure(url=engine.url.render_as_string(hide_password=False), target_metadata=target_metadata,
+                      literal_binds=True, dialect_opts={'paramstyle': 'named'}, render_as_batch=True, include_name=include_name)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # run_migrations passes its own connection in, the alembic cli opens one here
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True, include_name=include_name)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True, include_name=include_name)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
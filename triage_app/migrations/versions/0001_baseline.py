@@ -0,0 +1,477 @@
+"""baseline
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# the schema as create_all built it before migrations existed. databases from then already have it and
+# are stamped here by run_migrations instead (alembic stamp 0001 when upgrading one by hand)
+
+
+def upgrade():
+    # agents and departments point at each other, sqlite takes the foreign key inline (it cannot add one later),
+    # other databases add it once both tables exist
+    inline = op.get_bind().dialect.name == 'sqlite'
+    agents_dept_fk = [sa.ForeignKeyConstraint(['dept_id'], ['departments.dept_id'], ondelete='SET NULL')] if inline else []
+
+    op.create_table(
+        'attachments',
+        sa.Column('attachment_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('object_id', sa.Integer(), nullable=True),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=True),
+        sa.Column('inline', sa.Integer(), nullable=False),
+        sa.Column('link', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('attachment_id'),
+    )
+    op.create_table(
+        'categories',
+        sa.Column('category_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('group_id', sa.Integer(), nullable=False),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('category_id'),
+    )
+    op.create_table(
+        'default_columns',
+        sa.Column('default_column_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('primary', sa.String(), nullable=False),
+        sa.Column('secondary', sa.String(), nullable=True),
+        sa.Column('config', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('default_column_id'),
+    )
+    op.create_table(
+        'email_sources',
+        sa.Column('soure_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('thread_entry_id', sa.Integer(), nullable=False),
+        sa.Column('email_uid', sa.Integer(), nullable=False),
+        sa.Column('email_id', sa.Integer(), nullable=False),
+        sa.Column('message_id', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('soure_id'),
+    )
+    op.create_table(
+        'emails',
+        sa.Column('email_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('password', sa.String(), nullable=False),
+        sa.Column('email_from_name', sa.String(), nullable=False),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('mail_server', sa.String(), nullable=False),
+        sa.Column('imap_active_status', sa.Integer(), nullable=False),
+        sa.Column('uid_max', sa.Integer(), nullable=True),
+        sa.Column('imap_server', sa.String(), nullable=True),
+        sa.Column('banned_emails', sa.String(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('email_id'),
+    )
+    op.create_table(
+        'forms',
+        sa.Column('form_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('instructions', sa.String(), nullable=True),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('form_id'),
+    )
+    op.create_table(
+        'roles',
+        sa.Column('role_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('permissions', sa.String(), nullable=False),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('role_id'),
+    )
+    op.create_table(
+        'schedules',
+        sa.Column('schedule_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('timezone', sa.String(), nullable=True),
+        sa.Column('description', sa.String(), nullable=False),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('schedule_id'),
+    )
+    op.create_table(
+        'settings',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('namespace', sa.String(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('value', sa.String(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'slas',
+        sa.Column('sla_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('grace_period', sa.Integer(), nullable=False),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('sla_id'),
+    )
+    op.create_table(
+        'tasks',
+        sa.Column('task_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('number', sa.String(), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('dept_id', sa.Integer(), nullable=True),
+        sa.Column('agent_id', sa.Integer(), nullable=True),
+        sa.Column('group_id', sa.Integer(), nullable=True),
+        sa.Column('due_date', sa.DateTime(), nullable=True),
+        sa.Column('closed', sa.DateTime(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('task_id'),
+    )
+    op.create_table(
+        'templates',
+        sa.Column('template_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('code_name', sa.String(), nullable=False),
+        sa.Column('active', sa.Integer(), nullable=False),
+        sa.Column('subject', sa.String(), nullable=False),
+        sa.Column('body', sa.String(), nullable=False),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('template_id'),
+    )
+    op.create_table(
+        'ticket_priorities',
+        sa.Column('priority_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('priority', sa.String(), nullable=False),
+        sa.Column('priority_desc', sa.String(), nullable=False),
+        sa.Column('priority_color', sa.String(), nullable=False),
+        sa.Column('priority_urgency', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('priority_id'),
+    )
+    op.create_table(
+        'ticket_statuses',
+        sa.Column('status_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('state', sa.String(), nullable=False),
+        sa.Column('mode', sa.String(), nullable=False),
+        sa.Column('sort', sa.String(), nullable=False),
+        sa.Column('properties', sa.String(), nullable=False),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('status_id'),
+    )
+    op.create_table(
+        'users',
+        sa.Column('user_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('password', sa.String(), nullable=True),
+        sa.Column('firstname', sa.String(), nullable=False),
+        sa.Column('lastname', sa.String(), nullable=False),
+        sa.Column('status', sa.Integer(), nullable=False),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.create_table(
+        'agents',
+        sa.Column('agent_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('dept_id', sa.Integer(), nullable=True),
+        sa.Column('role_id', sa.Integer(), nullable=True),
+        sa.Column('permissions', sa.String(), nullable=False),
+        sa.Column('preferences', sa.String(), nullable=False),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('username', sa.String(), nullable=True),
+        sa.Column('password', sa.String(), nullable=True),
+        sa.Column('phone', sa.String(), nullable=True),
+        sa.Column('firstname', sa.String(), nullable=True),
+        sa.Column('lastname', sa.String(), nullable=True),
+        sa.Column('signature', sa.String(), nullable=True),
+        sa.Column('timezone', sa.String(), nullable=True),
+        sa.Column('admin', sa.Integer(), nullable=True),
+        sa.Column('status', sa.Integer(), nullable=False),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['role_id'], ['roles.role_id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('agent_id'),
+        *agents_dept_fk,
+    )
+    op.create_index('ix_agents_email', 'agents', ['email'], unique=True)
+    op.create_index('ix_agents_username', 'agents', ['username'], unique=True)
+    op.create_table(
+        'departments',
+        sa.Column('dept_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('sla_id', sa.Integer(), nullable=True),
+        sa.Column('email_id', sa.String(), nullable=True),
+        sa.Column('manager_id', sa.Integer(), nullable=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('signature', sa.String(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['manager_id'], ['agents.agent_id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('dept_id'),
+    )
+    op.create_table(
+        'form_fields',
+        sa.Column('field_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('form_id', sa.Integer(), nullable=True),
+        sa.Column('order_id', sa.Integer(), nullable=True),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('label', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('configuration', sa.String(), nullable=True),
+        sa.Column('hint', sa.String(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['form_id'], ['forms.form_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('field_id'),
+    )
+    op.create_table(
+        'groups',
+        sa.Column('group_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('lead_id', sa.Integer(), nullable=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('notes', sa.String(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['lead_id'], ['agents.agent_id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('group_id'),
+    )
+    op.create_table(
+        'queues',
+        sa.Column('queue_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('agent_id', sa.Integer(), nullable=True),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('config', sa.String(), nullable=False),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['agent_id'], ['agents.agent_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('queue_id'),
+    )
+    op.create_table(
+        'schedule_entries',
+        sa.Column('sched_entry_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('schedule_id', sa.Integer(), nullable=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('repeats', sa.String(), nullable=False),
+        sa.Column('starts_on', sa.Date(), nullable=True),
+        sa.Column('starts_at', sa.Time(), nullable=True),
+        sa.Column('ends_on', sa.Date(), nullable=True),
+        sa.Column('ends_at', sa.Time(), nullable=True),
+        sa.Column('stops_on', sa.Date(), nullable=True),
+        sa.Column('day', sa.Integer(), nullable=True),
+        sa.Column('week', sa.Integer(), nullable=True),
+        sa.Column('month', sa.Integer(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['schedule_id'], ['schedules.schedule_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('sched_entry_id'),
+    )
+    op.create_table(
+        'topics',
+        sa.Column('topic_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('status_id', sa.Integer(), nullable=True),
+        sa.Column('priority_id', sa.Integer(), nullable=True),
+        sa.Column('dept_id', sa.Integer(), nullable=True),
+        sa.Column('agent_id', sa.Integer(), nullable=True),
+        sa.Column('sla_id', sa.Integer(), nullable=True),
+        sa.Column('form_id', sa.Integer(), nullable=True),
+        sa.Column('auto_resp', sa.Integer(), nullable=False),
+        sa.Column('topic', sa.String(), nullable=False),
+        sa.Column('notes', sa.String(), nullable=False),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['agent_id'], ['agents.agent_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['dept_id'], ['departments.dept_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['form_id'], ['forms.form_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['priority_id'], ['ticket_priorities.priority_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['sla_id'], ['slas.sla_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['status_id'], ['ticket_statuses.status_id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('topic_id'),
+    )
+    op.create_table(
+        'columns',
+        sa.Column('column_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('queue_id', sa.Integer(), nullable=True),
+        sa.Column('default_column_id', sa.Integer(), nullable=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('sort', sa.Integer(), nullable=False),
+        sa.Column('width', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['default_column_id'], ['default_columns.default_column_id'], ondelete='cascade'),
+        sa.ForeignKeyConstraint(['queue_id'], ['queues.queue_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('column_id'),
+    )
+    op.create_table(
+        'group_members',
+        sa.Column('member_id', sa.Integer(), nullable=False),
+        sa.Column('group_id', sa.Integer(), nullable=True),
+        sa.Column('agent_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['group_id'], ['groups.group_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('member_id'),
+    )
+    op.create_table(
+        'tickets',
+        sa.Column('ticket_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('number', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('status_id', sa.Integer(), nullable=True),
+        sa.Column('dept_id', sa.Integer(), nullable=True),
+        sa.Column('sla_id', sa.Integer(), nullable=True),
+        sa.Column('category_id', sa.Integer(), nullable=True),
+        sa.Column('agent_id', sa.Integer(), nullable=True),
+        sa.Column('group_id', sa.Integer(), nullable=True),
+        sa.Column('priority_id', sa.Integer(), nullable=True),
+        sa.Column('topic_id', sa.Integer(), nullable=True),
+        sa.Column('due_date', sa.DateTime(), nullable=True),
+        sa.Column('closed', sa.DateTime(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('est_due_date', sa.DateTime(), nullable=True),
+        sa.Column('overdue', sa.SmallInteger(), nullable=False),
+        sa.Column('answered', sa.SmallInteger(), nullable=False),
+        sa.Column('title', sa.String(), nullable=True),
+        sa.Column('source', sa.String(), nullable=True),
+        sa.Column('description', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['agent_id'], ['agents.agent_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['category_id'], ['categories.category_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['dept_id'], ['departments.dept_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['group_id'], ['groups.group_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['priority_id'], ['ticket_priorities.priority_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['sla_id'], ['slas.sla_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['status_id'], ['ticket_statuses.status_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['topic_id'], ['topics.topic_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('ticket_id'),
+    )
+    op.create_table(
+        'form_entries',
+        sa.Column('entry_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('form_id', sa.Integer(), nullable=True),
+        sa.Column('ticket_id', sa.Integer(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['form_id'], ['forms.form_id'], ondelete='cascade'),
+        sa.ForeignKeyConstraint(['ticket_id'], ['tickets.ticket_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('entry_id'),
+    )
+    op.create_table(
+        'threads',
+        sa.Column('thread_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('ticket_id', sa.Integer(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['ticket_id'], ['tickets.ticket_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('thread_id'),
+    )
+    op.create_table(
+        'form_values',
+        sa.Column('value_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('entry_id', sa.Integer(), nullable=True),
+        sa.Column('form_id', sa.Integer(), nullable=True),
+        sa.Column('field_id', sa.Integer(), nullable=True),
+        sa.Column('value', sa.String(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['entry_id'], ['form_entries.entry_id'], ondelete='cascade'),
+        sa.ForeignKeyConstraint(['field_id'], ['form_fields.field_id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['form_id'], ['forms.form_id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('value_id'),
+    )
+    op.create_table(
+        'thread_collaborators',
+        sa.Column('collab_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('thread_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('role', sa.String(), nullable=False),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['thread_id'], ['threads.thread_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('collab_id'),
+    )
+    op.create_table(
+        'thread_entries',
+        sa.Column('entry_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('thread_id', sa.Integer(), nullable=True),
+        sa.Column('agent_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('owner', sa.String(), nullable=False),
+        sa.Column('editor', sa.String(), nullable=True),
+        sa.Column('subject', sa.String(), nullable=True),
+        sa.Column('body', sa.String(), nullable=False),
+        sa.Column('recipients', sa.String(), nullable=True),
+        sa.Column('updated', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['thread_id'], ['threads.thread_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('entry_id'),
+    )
+    op.create_table(
+        'thread_events',
+        sa.Column('event_id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('thread_id', sa.Integer(), nullable=True),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('agent_id', sa.Integer(), nullable=True),
+        sa.Column('owner', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('group_id', sa.Integer(), nullable=True),
+        sa.Column('dept_id', sa.Integer(), nullable=True),
+        sa.Column('data', sa.String(), nullable=False),
+        sa.Column('created', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['thread_id'], ['threads.thread_id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('event_id'),
+    )
+
+    if not inline:
+        op.create_foreign_key('fk_agents_dept_id', 'agents', 'departments', ['dept_id'], ['dept_id'], ondelete='SET NULL')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('fk_agents_dept_id', 'agents', type_='foreignkey')
+    op.drop_table('thread_events')
+    op.drop_table('thread_entries')
+    op.drop_table('thread_collaborators')
+    op.drop_table('form_values')
+    op.drop_table('threads')
+    op.drop_table('form_entries')
+    op.drop_table('tickets')
+    op.drop_table('group_members')
+    op.drop_table('columns')
+    op.drop_table('topics')
+    op.drop_table('schedule_entries')
+    op.drop_table('queues')
+    op.drop_table('groups')
+    op.drop_table('form_fields')
+    op.drop_table('departments')
+    op.drop_table('agents')
+    op.drop_table('users')
+    op.drop_table('ticket_statuses')
+    op.drop_table('ticket_priorities')
+    op.drop_table('templates')
+    op.drop_table('tasks')
+    op.drop_table('slas')
+    op.drop_table('settings')
+    op.drop_table('schedules')
+    op.drop_table('roles')
+    op.drop_table('forms')
+    op.drop_table('emails')
+    op.drop_table('email_sources')
+    op.drop_table('default_columns')
+    op.drop_table('categories')
+    op.drop_table('attachments')
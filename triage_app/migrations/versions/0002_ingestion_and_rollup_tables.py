@@ -0,0 +1,98 @@
+"""ticket number counter, outbox, dashboard rollup and email source indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:01
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def check_ticket_numbers():
+    # the unique index cannot be built over duplicate numbers, and renumbering tickets is not done silently
+    rows = op.get_bind().execute(sa.text(
+        'SELECT number, COUNT(*) FROM tickets GROUP BY number HAVING COUNT(*) > 1 ORDER BY number')).all()
+    if rows:
+        listed = ', '.join(f'{number} ({count} tickets)' for number, count in rows[:20])
+        more = f' and {len(rows) - 20} more' if len(rows) > 20 else ''
+        raise RuntimeError(f'Cannot add the unique index ix_tickets_number, {len(rows)} ticket numbers are used more than once: '
+                           f'{listed}{more}. Give all but one ticket of each number a new number and run the migrations again.')
+
+
+def dedupe_email_sources():
+    # a poll interrupted before uid_max was saved stored its messages again, keep the first source of each
+    deleted = op.get_bind().execute(sa.text(
+        'DELETE FROM email_sources WHERE soure_id NOT IN '
+        '(SELECT MIN(soure_id) FROM email_sources GROUP BY email_id, email_uid)')).rowcount
+    if deleted:
+        print(f'removed {deleted} duplicate email sources before adding ix_email_sources_email_uid')
+
+
+def upgrade():
+    if not has_table('number_sequences'):
+        op.create_table(
+            'number_sequences',
+            sa.Column('name', sa.String(), primary_key=True, nullable=False),
+            sa.Column('next', sa.Integer(), nullable=False),
+            sa.Column('updated', sa.DateTime(), server_default=sa.func.now()),
+        )
+
+    if not has_table('outbox'):
+        op.create_table(
+            'outbox',
+            sa.Column('outbox_id', sa.Integer(), primary_key=True, autoincrement=True, nullable=False),
+            sa.Column('kind', sa.String(), nullable=False),
+            sa.Column('recipient', sa.String()),
+            sa.Column('template', sa.String()),
+            sa.Column('email_type', sa.String()),
+            sa.Column('payload', sa.String(), nullable=False),
+            sa.Column('dedup_key', sa.String(), nullable=False),
+            sa.Column('status', sa.SmallInteger(), nullable=False),
+            sa.Column('attempts', sa.Integer(), nullable=False),
+            sa.Column('next_attempt', sa.DateTime(), server_default=sa.func.now()),
+            sa.Column('last_error', sa.String()),
+            sa.Column('updated', sa.DateTime(), server_default=sa.func.now()),
+            sa.Column('created', sa.DateTime(), server_default=sa.func.now()),
+        )
+    op.create_index('ix_outbox_dedup_key', 'outbox', ['dedup_key'], unique=True, if_not_exists=True)
+    op.create_index('ix_outbox_status_next_attempt', 'outbox', ['status', 'next_attempt'], if_not_exists=True)
+
+    if not has_table('ticket_daily_stats'):
+        op.create_table(
+            'ticket_daily_stats',
+            sa.Column('date', sa.Date(), primary_key=True),
+            sa.Column('dept_id', sa.Integer(), primary_key=True),
+            sa.Column('topic_id', sa.Integer(), primary_key=True),
+            sa.Column('agent_id', sa.Integer(), primary_key=True),
+            sa.Column('created', sa.Integer(), nullable=False),
+            sa.Column('updated', sa.Integer(), nullable=False),
+            sa.Column('overdue', sa.Integer(), nullable=False),
+        )
+
+    check_ticket_numbers()
+    op.create_index('ix_tickets_number', 'tickets', ['number'], unique=True, if_not_exists=True)
+    op.create_index('ix_tickets_overdue_deadline', 'tickets', ['overdue', sa.text('coalesce(due_date, est_due_date)')], if_not_exists=True)
+    op.create_index('ix_email_sources_message_id', 'email_sources', ['message_id'], if_not_exists=True)
+    dedupe_email_sources()
+    op.create_index('ix_email_sources_email_uid', 'email_sources', ['email_id', 'email_uid'], unique=True, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_email_sources_email_uid', 'email_sources', if_exists=True)
+    op.drop_index('ix_email_sources_message_id', 'email_sources', if_exists=True)
+    op.drop_index('ix_tickets_overdue_deadline', 'tickets', if_exists=True)
+    op.drop_index('ix_tickets_number', 'tickets', if_exists=True)
+    op.drop_table('ticket_daily_stats')
+    op.drop_table('outbox')
+    op.drop_table('number_sequences')
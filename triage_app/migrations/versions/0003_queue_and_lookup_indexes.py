@@ -0,0 +1,51 @@
+"""indexes for queue filters and sorts and the per ticket lookups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:02
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns), kept in step with the Index and index=True declarations in models
+INDEXES = [
+    # the default queues filter on status, agent, overdue, answered or a created period and sort by -created
+    ('ix_tickets_status_created', 'tickets', ['status_id', 'created']),
+    ('ix_tickets_agent_status_created', 'tickets', ['agent_id', 'status_id', 'created']),
+    ('ix_tickets_dept_created', 'tickets', ['dept_id', 'created']),
+    ('ix_tickets_priority_created', 'tickets', ['priority_id', 'created']),
+    ('ix_tickets_overdue_created', 'tickets', ['overdue', 'created']),
+    ('ix_tickets_answered_created', 'tickets', ['answered', 'created']),
+    ('ix_tickets_created', 'tickets', ['created']),
+    ('ix_tickets_updated', 'tickets', ['updated']),
+    ('ix_tickets_due_date', 'tickets', ['due_date']),
+    ('ix_tickets_user_id', 'tickets', ['user_id']),
+    # child rows loaded with every ticket
+    ('ix_threads_ticket_id', 'threads', ['ticket_id']),
+    ('ix_thread_entries_thread_id', 'thread_entries', ['thread_id']),
+    ('ix_thread_events_thread_id', 'thread_events', ['thread_id']),
+    ('ix_thread_collaborators_thread_id', 'thread_collaborators', ['thread_id']),
+    ('ix_form_entries_ticket_id', 'form_entries', ['ticket_id']),
+    ('ix_form_values_entry_id', 'form_values', ['entry_id']),
+    ('ix_attachments_object_id', 'attachments', ['object_id']),
+    ('ix_email_sources_thread_entry_id', 'email_sources', ['thread_entry_id']),
+    ('ix_users_email', 'users', ['email']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table, if_exists=True)
@@ -0,0 +1,40 @@
+"""full text search tables for tickets and users
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:03
+
+"""
+from alembic import op
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+# the ddl is written out here rather than taken from triage_app.search, so this revision stays as it is
+# when the app's search code changes. the app fills the new tables on its next start
+
+
+def upgrade():
+    # fts5 on sqlite, tsvector and gin on postgres, nothing on other databases
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        tokenize = "tokenize = 'unicode61 remove_diacritics 2'"
+        op.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS ticket_search USING fts5(number, title, description, entries, {tokenize})')
+        op.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(name, email, {tokenize})')
+    elif dialect == 'postgresql':
+        op.execute('CREATE TABLE IF NOT EXISTS ticket_search (ticket_id INTEGER PRIMARY KEY '
+                   'REFERENCES tickets (ticket_id) ON DELETE CASCADE, document TSVECTOR NOT NULL)')
+        op.execute('CREATE INDEX IF NOT EXISTS ix_ticket_search_document ON ticket_search USING gin (document)')
+        op.execute('CREATE TABLE IF NOT EXISTS user_search (user_id INTEGER PRIMARY KEY '
+                   'REFERENCES users (user_id) ON DELETE CASCADE, document TSVECTOR NOT NULL)')
+        op.execute('CREATE INDEX IF NOT EXISTS ix_user_search_document ON user_search USING gin (document)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ('sqlite', 'postgresql'):
+        op.execute('DROP TABLE IF EXISTS user_search')
+        op.execute('DROP TABLE IF EXISTS ticket_search')
@@ -1,5 +1,5 @@
-from sqlalchemy import (Boolean, Column, Date, DateTime, ForeignKey, Integer,
-                        SmallInteger, String, Time, event)
+from sqlalchemy import (Boolean, Column, Date, DateTime, ForeignKey, Index,
+                        Integer, SmallInteger, String, Time, event)
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import Session, relationship, foreign
 from sqlalchemy.sql import func, select
@@ -29,6 +29,8 @@ class Agent(Base):
     timezone = Column(String)
     admin = Column(Integer)
     status = Column(Integer, nullable=False)
+    # bumped to revoke every token issued to the agent so far
+    token_version = Column(Integer, nullable=False, default=0, server_default='0')
     updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
     created = Column(DateTime, server_default=func.now())
 
@@ -39,8 +41,8 @@ class Ticket(Base):
     __tablename__ = "tickets"
 
     ticket_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    number = Column(String, nullable=False)
-    user_id = Column(Integer, ForeignKey('users.user_id', ondelete='SET NULL'), default=None)
+    number = Column(String, unique=True, index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.user_id', ondelete='SET NULL'), default=None, index=True)
     status_id = Column(Integer, ForeignKey('ticket_statuses.status_id', ondelete='SET NULL'), default=None)
     dept_id = Column(Integer, ForeignKey('departments.dept_id', ondelete='SET NULL'), default=None)
     sla_id = Column(Integer, ForeignKey('slas.sla_id', ondelete='SET NULL'), default=None)
@@ -73,6 +75,21 @@ class Ticket(Base):
     form_entry = relationship('FormEntry', uselist=False)
     thread = relationship('Thread', uselist=False)
 
+    __table_args__ = (
+        # used by the overdue sweeper to find candidates without scanning the table
+        Index('ix_tickets_overdue_deadline', 'overdue', func.coalesce(due_date, est_due_date)),
+        # queue filters followed by the created sort every default queue uses
+        Index('ix_tickets_status_created', 'status_id', 'created'),
+        Index('ix_tickets_agent_status_created', 'agent_id', 'status_id', 'created'),
+        Index('ix_tickets_dept_created', 'dept_id', 'created'),
+        Index('ix_tickets_priority_created', 'priority_id', 'created'),
+        Index('ix_tickets_overdue_created', 'overdue', 'created'),
+        Index('ix_tickets_answered_created', 'answered', 'created'),
+        Index('ix_tickets_created', 'created'),
+        Index('ix_tickets_updated', 'updated'),
+        Index('ix_tickets_due_date', 'due_date'),
+    )
+
 class Department(Base):
     __tablename__ = "departments"
 
@@ -110,7 +127,7 @@ class FormEntry(Base):
 
     entry_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     form_id = Column(Integer,  ForeignKey('forms.form_id', ondelete='cascade'), default=None)
-    ticket_id = Column(Integer, ForeignKey('tickets.ticket_id', ondelete='cascade'), default=None)
+    ticket_id = Column(Integer, ForeignKey('tickets.ticket_id', ondelete='cascade'), default=None, index=True)
     updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
     created = Column(DateTime, server_default=func.now())
 
@@ -135,7 +152,7 @@ class FormValue(Base):
     __tablename__ = "form_values"
 
     value_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    entry_id = Column(Integer, ForeignKey('form_entries.entry_id', ondelete='cascade') ,default=None)
+    entry_id = Column(Integer, ForeignKey('form_entries.entry_id', ondelete='cascade') ,default=None, index=True)
     form_id = Column(Integer, ForeignKey('forms.form_id', ondelete='SET NULL') ,default=None)
     field_id = Column(Integer, ForeignKey('form_fields.field_id', ondelete='SET NULL'), default=None)
     value = Column(String)
@@ -234,7 +251,7 @@ class Attachment(Base):
     __tablename__ = "attachments"
 
     attachment_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    object_id = Column(Integer, default=None)
+    object_id = Column(Integer, default=None, index=True)
     size = Column(Integer, nullable=False)
     type = Column(String, nullable=False)
     name = Column(String, nullable=False)
@@ -247,7 +264,7 @@ class Thread(Base):
     __tablename__ = "threads"
 
     thread_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    ticket_id = Column(Integer, ForeignKey('tickets.ticket_id', ondelete='cascade'), default=None)
+    ticket_id = Column(Integer, ForeignKey('tickets.ticket_id', ondelete='cascade'), default=None, index=True)
     updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
     created = Column(DateTime, server_default=func.now())
 
@@ -260,7 +277,7 @@ class ThreadCollaborator(Base):
     __tablename__ = "thread_collaborators"
 
     collab_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    thread_id = Column(Integer, ForeignKey('threads.thread_id', ondelete='cascade'), default=None)
+    thread_id = Column(Integer, ForeignKey('threads.thread_id', ondelete='cascade'), default=None, index=True)
     user_id = Column(Integer, default=None)
     role = Column(String, nullable=False)
     updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -271,7 +288,7 @@ class ThreadEntry(Base):
     __tablename__ = "thread_entries"
 
     entry_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    thread_id = Column(Integer, ForeignKey('threads.thread_id', ondelete='cascade'), default=None)
+    thread_id = Column(Integer, ForeignKey('threads.thread_id', ondelete='cascade'), default=None, index=True)
     agent_id = Column(Integer, default=None)
     user_id = Column(Integer, default=None)
     type = Column(String, nullable=False)
@@ -289,7 +306,7 @@ class ThreadEvent(Base):
     __tablename__ = "thread_events"
 
     event_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    thread_id = Column(Integer, ForeignKey('threads.thread_id', ondelete='cascade'), default=None)
+    thread_id = Column(Integer, ForeignKey('threads.thread_id', ondelete='cascade'), default=None, index=True)
     type = Column(String, nullable=False)
     agent_id = Column(Integer, default=None)
     owner = Column(String, nullable=False)
@@ -303,10 +320,13 @@ class EmailSource(Base):
     __tablename__ = "email_sources"
 
     soure_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    thread_entry_id = Column(Integer, nullable=False)
+    thread_entry_id = Column(Integer, nullable=False, index=True)
     email_uid = Column(Integer, nullable=False)
     email_id = Column(Integer, nullable=False)
-    message_id = Column(String, nullable=False)
+    message_id = Column(String, nullable=False, index=True)
+
+    # a message is stored once per mailbox, which makes re-running an interrupted poll safe
+    __table_args__ = (Index('ix_email_sources_email_uid', 'email_id', 'email_uid', unique=True),)
 
 class TicketPriority(Base):
 
@@ -366,7 +386,7 @@ class User(Base):
     __tablename__ = "users"
 
     user_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
-    email = Column(String, nullable=False)
+    email = Column(String, nullable=False, index=True)
     password = Column(String)
     firstname = Column(String, nullable=False)
     lastname = Column(String, nullable=False)
@@ -398,6 +418,15 @@ class Settings(Base):
     def to_dict(self):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
+class NumberSequence(Base):
+
+    __tablename__ = "number_sequences"
+
+    # one counter per numbered table (tickets, tasks), handed out to workers in blocks
+    name = Column(String, primary_key=True, nullable=False)
+    next = Column(Integer, nullable=False)
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
 class Queue(Base):
 
     __tablename__ = "queues"
@@ -443,6 +472,51 @@ class Email(Base):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
     # dept = relationship('Department')
 
+class Outbox(Base):
+
+    __tablename__ = "outbox"
+
+    # Status meanings
+    # 0 means it is waiting to be sent
+    # 1 means it was sent
+    # 2 means it failed too many times and was given up on
+    # 3 means a worker has claimed it and is sending it
+
+    outbox_id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    kind = Column(String, nullable=False) # 'template' or 'agent_reply'
+    recipient = Column(String)
+    template = Column(String)
+    email_type = Column(String)
+    payload = Column(String, nullable=False)
+    dedup_key = Column(String, unique=True, index=True, nullable=False)
+    status = Column(SmallInteger, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt = Column(DateTime, server_default=func.now())
+    last_error = Column(String)
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    created = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt', 'status', 'next_attempt'),
+    )
+
+class TicketDailyStats(Base):
+
+    __tablename__ = "ticket_daily_stats"
+
+    # dashboard counters per day, kept up to date by the ticket write paths
+    # a ticket counts as created on its created date, updated on its last updated date
+    # and overdue on its due date (or estimated due date) while it is overdue
+    # a missing department, topic or agent is stored as 0
+
+    date = Column(Date, primary_key=True)
+    dept_id = Column(Integer, primary_key=True, default=0)
+    topic_id = Column(Integer, primary_key=True, default=0)
+    agent_id = Column(Integer, primary_key=True, default=0)
+    created = Column(Integer, nullable=False, default=0)
+    updated = Column(Integer, nullable=False, default=0)
+    overdue = Column(Integer, nullable=False, default=0)
+
 class Template(Base):
 
     __tablename__ = "templates"
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from . import models
+from .crud import deliver_outbox_row, outbox_wakeup
+from .database import SessionLocal
+
+
+class OutboxWorker:
+    # delivers queued outbox rows from a dedicated thread running its own event loop
+
+    def __init__(self, poll_interval: float = 5, batch_size: int = 20, max_attempts: int = 6,
+                 base_backoff: float = 30, max_backoff: float = 3600, claim_timeout: float = 600):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.claim_timeout = claim_timeout
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='outbox-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        outbox_wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self.release_stale_claims()
+            while not self._stop.is_set():
+                try:
+                    sent = loop.run_until_complete(self.deliver_batch())
+                except:
+                    traceback.print_exc()
+                    sent = 0
+                # a full batch means there is probably more waiting
+                if sent < self.batch_size:
+                    outbox_wakeup.wait(self.poll_interval)
+                    outbox_wakeup.clear()
+        finally:
+            loop.close()
+
+    def backoff(self, attempts: int):
+        return timedelta(seconds=min(self.base_backoff * 2 ** (attempts - 1), self.max_backoff))
+
+    def release_stale_claims(self):
+        # rows claimed by a worker that died mid send go back to the queue
+        db: Session = SessionLocal()
+        try:
+            db.execute(
+                update(models.Outbox)
+                .where(models.Outbox.status == 3)
+                .where(models.Outbox.updated < datetime.now() - timedelta(seconds=self.claim_timeout))
+                .values(status=0)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def claim(self, db: Session):
+        due = db.query(models.Outbox.outbox_id).filter(
+            models.Outbox.status == 0, models.Outbox.next_attempt <= datetime.now()) \
+            .order_by(models.Outbox.next_attempt).limit(self.batch_size).all()
+
+        # the status check makes the claim safe when several processes run a worker
+        claimed = []
+        for outbox_id, in due:
+            affected = db.execute(
+                update(models.Outbox)
+                .where(models.Outbox.outbox_id == outbox_id, models.Outbox.status == 0)
+                .values(status=3, updated=datetime.now())
+            ).rowcount
+            db.commit()
+            if affected:
+                claimed.append(outbox_id)
+        return claimed
+
+    async def deliver_batch(self):
+        db: Session = SessionLocal()
+        try:
+            claimed = self.claim(db)
+            for outbox_id in claimed:
+                db_outbox = db.query(models.Outbox).filter(models.Outbox.outbox_id == outbox_id).first()
+                try:
+                    await deliver_outbox_row(db, db_outbox)
+                    db_outbox.status = 1
+                    db_outbox.last_error = None
+                except Exception as e:
+                    traceback.print_exc()
+                    db.rollback()
+                    db_outbox = db.query(models.Outbox).filter(models.Outbox.outbox_id == outbox_id).first()
+                    db_outbox.attempts += 1
+                    db_outbox.last_error = repr(e)[:1000]
+                    if db_outbox.attempts >= self.max_attempts:
+                        print(f'Giving up on outbox row {outbox_id}')
+                        db_outbox.status = 2
+                    else:
+                        db_outbox.status = 0
+                        db_outbox.next_attempt = datetime.now() + self.backoff(db_outbox.attempts)
+                db.commit()
+            return len(claimed)
+        finally:
+            db.close()
+
+
+outbox_worker: OutboxWorker = None
+
+
+def start_outbox_worker():
+    global outbox_worker
+    if outbox_worker is None:
+        outbox_worker = OutboxWorker()
+    outbox_worker.start()
+    return outbox_worker
+
+
+def stop_outbox_worker():
+    if outbox_worker is not None:
+        outbox_worker.stop()
@@ -0,0 +1,187 @@
+import asyncio
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import bcrypt
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+def hash_rounds(hashed: str):
+    # $2b$12$... -> 12
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def hash_work(password: str, rounds: int):
+    start = time.perf_counter()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return hashed, time.perf_counter() - start
+
+
+def verify_work(password: str, hashed: str, rounds: int):
+    # returns (matches, new hash when the stored one used another cost, seconds spent)
+    start = time.perf_counter()
+    try:
+        matches = bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        matches = False
+    new_hash = None
+    if matches and hash_rounds(hashed) != rounds:
+        new_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return matches, new_hash, time.perf_counter() - start
+
+
+class BcryptPool:
+    # bcrypt runs in a few worker processes so a burst of logins cannot take over the request
+    # threadpool. at most max_pending calls are queued or running, async callers past that are
+    # turned away straight away and sync ones wait up to wait_timeout for a slot
+
+    def __init__(self, rounds: int = 12, workers: int = 2, max_pending: int = 64, wait_timeout: float = 10):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        # hash of a random password, checked for unknown accounts so they take as long as known ones
+        self._dummy = None
+        self._lock = threading.RLock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_time = 0.0
+        self._run_time = 0.0
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawned, a fork would copy the parent's threads, locks and open connections into the workers
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _submit(self, fn, *args):
+        return self.executor().submit(fn, *args)
+
+    def _discard(self, executor):
+        # a worker died (oom killer, segfault) and took the pool with it, the next call starts a new one.
+        # the dummy hash came from the dead pool too
+        with self._lock:
+            if self._executor is executor:
+                self._executor, self._dummy = None, None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, submit):
+        # one retry on a fresh pool, a second broken pool goes up to the caller
+        for retry in (False, True):
+            executor = self.executor()
+            try:
+                return submit().result()
+            except BrokenProcessPool:
+                self._discard(executor)
+                if retry:
+                    raise
+
+    async def _run_async(self, submit):
+        for retry in (False, True):
+            executor = self.executor()
+            try:
+                return await asyncio.wrap_future(submit())
+            except BrokenProcessPool:
+                self._discard(executor)
+                if retry:
+                    raise
+
+    def dummy_hash(self):
+        # made once in a worker, the future is shared by everyone waiting on it
+        with self._lock:
+            if self._dummy is None:
+                self._dummy = self._submit(hash_work, secrets.token_hex(16), self.rounds)
+            return self._dummy
+
+    def _admit(self, blocking: bool):
+        if not self._slots.acquire(blocking, self.wait_timeout if blocking else None):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordPoolBusy()
+        with self._lock:
+            self._pending += 1
+        return time.perf_counter()
+
+    def _release(self, start: float, run_time: float = 0.0):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+            self._run_time += run_time
+            self._wait_time += max(time.perf_counter() - start - run_time, 0.0)
+        self._slots.release()
+
+    def hash(self, password: str):
+        start = self._admit(blocking=True)
+        run_time = 0.0
+        try:
+            hashed, run_time = self._run(partial(self._submit, hash_work, password, self.rounds))
+            return hashed
+        finally:
+            self._release(start, run_time)
+
+    def verify(self, password: str, hashed: str = None):
+        # (matches, new hash or None), hashed is None for accounts that do not exist
+        start = self._admit(blocking=True)
+        run_time = 0.0
+        try:
+            known = bool(hashed)
+            if not known:
+                hashed = self._run(self.dummy_hash)[0]
+            matches, new_hash, run_time = self._run(partial(self._submit, verify_work, password, hashed, self.rounds))
+            return (matches, new_hash) if known else (False, None)
+        finally:
+            self._release(start, run_time)
+
+    async def verify_async(self, password: str, hashed: str = None):
+        start = self._admit(blocking=False)
+        run_time = 0.0
+        try:
+            known = bool(hashed)
+            if not known:
+                hashed = (await self._run_async(self.dummy_hash))[0]
+            matches, new_hash, run_time = await self._run_async(partial(self._submit, verify_work, password, hashed, self.rounds))
+            return (matches, new_hash) if known else (False, None)
+        finally:
+            self._release(start, run_time)
+
+    def stats(self):
+        with self._lock:
+            completed = self._completed
+            return {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'completed': completed,
+                'rejected': self._rejected,
+                'avg_wait_ms': self._wait_time / completed * 1000 if completed else 0.0,
+                'avg_run_ms': self._run_time / completed * 1000 if completed else 0.0,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor, self._dummy = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# BCRYPT_ROUNDS is the cost for new hashes, stored hashes at another cost are redone on the next login
+bcrypt_pool = BcryptPool(rounds=int(os.getenv('BCRYPT_ROUNDS') or 12),
+                         workers=int(os.getenv('BCRYPT_WORKERS') or max(1, (os.cpu_count() or 2) // 2)),
+                         max_pending=int(os.getenv('BCRYPT_MAX_PENDING') or 64))
@@ -0,0 +1,7 @@
+# recomputes the dashboard rollup from the tickets table
+# usage: python -m triage_app.rebuild_ticket_stats
+
+from triage_app.crud import rebuild_ticket_daily_stats
+
+if __name__ == '__main__':
+    rebuild_ticket_daily_stats()
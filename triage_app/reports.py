@@ -0,0 +1,226 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+
+from . import models
+from .database import engine
+
+# rows read from the database per chunk, each report reduces a chunk before reading the next
+REPORT_CHUNK_SIZE = 5000
+PERCENTILES = [50, 75, 90, 95, 99]
+# backlog age buckets in days, the last one is open ended
+BACKLOG_AGE_BINS = [0, 1, 2, 4, 7, 14, 30, 60, 90, np.inf]
+TICKET_DATE_COLUMNS = ['created', 'closed', 'due_date', 'est_due_date']
+GROUP_COLUMNS = {'department': 'dept_id', 'topics': 'topic_id', 'agent': 'agent_id', 'priority': 'priority'}
+
+
+def ticket_report_query(start: datetime, end: datetime):
+    # only the columns the reports use, with the lookups they need joined in
+    return (
+        select(models.Ticket.ticket_id, models.Ticket.created, models.Ticket.closed, models.Ticket.due_date,
+               models.Ticket.est_due_date, models.Ticket.overdue, models.Ticket.dept_id, models.Ticket.topic_id,
+               models.Ticket.agent_id, models.TicketStatus.state.label('state'), models.TicketPriority.priority.label('priority'),
+               models.SLA.grace_period, models.Department.name.label('department'))
+        .outerjoin(models.TicketStatus, models.TicketStatus.status_id == models.Ticket.status_id)
+        .outerjoin(models.TicketPriority, models.TicketPriority.priority_id == models.Ticket.priority_id)
+        .outerjoin(models.SLA, models.SLA.sla_id == models.Ticket.sla_id)
+        .outerjoin(models.Department, models.Department.dept_id == models.Ticket.dept_id)
+        .where(models.Ticket.created.between(start, end))
+    )
+
+
+def first_response_query(start: datetime, end: datetime):
+    # the report tickets with their first agent entry, which the database aggregates
+    responses = (
+        select(models.Thread.ticket_id, func.min(models.ThreadEntry.created).label('first_response'))
+        .join(models.ThreadEntry, models.ThreadEntry.thread_id == models.Thread.thread_id)
+        .join(models.Ticket, models.Ticket.ticket_id == models.Thread.ticket_id)
+        .where(models.ThreadEntry.agent_id.isnot(None), models.Ticket.created.between(start, end))
+        .group_by(models.Thread.ticket_id)
+        .subquery()
+    )
+    return (
+        ticket_report_query(start, end)
+        .add_columns(responses.c.first_response)
+        .outerjoin(responses, responses.c.ticket_id == models.Ticket.ticket_id)
+    )
+
+
+def read_chunks(connection, query, date_columns: list):
+    # yields the rows a chunk at a time, the reports reduce each chunk before the next one is read
+    connection = connection.execution_options(stream_results=True)
+    for chunk in pd.read_sql(query, connection, chunksize=REPORT_CHUNK_SIZE):
+        for column in date_columns:
+            chunk[column] = pd.to_datetime(chunk[column], errors='coerce', utc=True).dt.tz_localize(None)
+        yield chunk
+
+
+def group_label(value):
+    if pd.isna(value):
+        return None
+    return int(value) if isinstance(value, (int, float, np.number)) else str(value)
+
+
+def group_names(frame: pd.DataFrame, group_by: str):
+    # department reports also carry the department name
+    if group_by != 'department':
+        return {}
+    names = frame.dropna(subset=['dept_id']).drop_duplicates('dept_id')
+    return {group_label(dept_id): name for dept_id, name in zip(names['dept_id'], names['department'])}
+
+
+class GroupedReport:
+    # running totals per group, so a report only ever holds one chunk of rows plus what it keeps per group
+
+    def __init__(self, group_by: str = None, summarize=None):
+        self.group_by = group_by
+        # turns what was kept for one group into its part of the response
+        self.summarize = summarize
+        self.groups = {}
+        self.names = {}
+        self.tickets = 0
+
+    def split(self, frame: pd.DataFrame, values: pd.Series):
+        # (group, values) pairs for one chunk, a single group when the report is not grouped
+        self.names.update(group_names(frame, self.group_by))
+        if not self.group_by:
+            return [(None, values)]
+        return [(group_label(group), group_values)
+                for group, group_values in values.groupby(frame[GROUP_COLUMNS[self.group_by]], dropna=False)]
+
+    def result(self):
+        if not self.group_by:
+            return self.summarize(self.groups.get(None))
+        # same order as a groupby, missing groups last
+        order = sorted(self.groups, key=lambda group: (group is None, group if group is not None else 0))
+        return [{'category_id': group, 'category_name': self.names.get(group), **self.summarize(self.groups[group])}
+                for group in order]
+
+
+def percentile_summary(values: list):
+    values = np.concatenate(values) if values else np.array([])
+    summary = {'count': int(values.size)}
+    percentiles = np.percentile(values, PERCENTILES) if values.size else [None] * len(PERCENTILES)
+    for p, value in zip(PERCENTILES, percentiles):
+        summary[f'p{p}'] = None if value is None else float(value)
+    return summary
+
+
+class PercentileReport(GroupedReport):
+    # percentiles need every value, so only the one float per ticket is kept, never the rows
+
+    def __init__(self, group_by: str = None):
+        super().__init__(group_by, percentile_summary)
+
+    def add(self, frame: pd.DataFrame, values: pd.Series):
+        for group, group_values in self.split(frame, values):
+            self.groups.setdefault(group, []).append(group_values.dropna().to_numpy(dtype=float))
+
+
+def time_to_close_report(chunks, group_by: str = None):
+    # hours from creation to close for closed tickets
+    report = PercentileReport(group_by)
+    for frame in chunks:
+        report.tickets += frame.shape[0]
+        frame = frame[frame['closed'].notna()]
+        report.add(frame, (frame['closed'] - frame['created']).dt.total_seconds() / 3600)
+    return report
+
+
+def sla_breach_summary(counts):
+    total, breached = counts if counts else (0, 0)
+    return {'count': total, 'breached': breached, 'rate': breached / total if total else None}
+
+
+def sla_breach_report(chunks, group_by: str = None, now: datetime = None):
+    # a ticket breached its sla when it was closed (or is still open) after its deadline
+    now = pd.Timestamp(now or datetime.now())
+    report = GroupedReport(group_by, sla_breach_summary)
+    for frame in chunks:
+        report.tickets += frame.shape[0]
+        sla_deadline = frame['created'] + pd.to_timedelta(frame['grace_period'], unit='h')
+        deadline = frame['due_date'].fillna(frame['est_due_date']).fillna(sla_deadline)
+        finished = frame['closed'].fillna(now)
+        breached = (deadline.notna() & (finished > deadline)) | (frame['overdue'] == 1)
+        for group, group_breached in report.split(frame, breached):
+            total, count = report.groups.get(group, (0, 0))
+            report.groups[group] = (total + int(group_breached.size), count + int(group_breached.sum()))
+    return report
+
+
+def age_histogram(counts):
+    counts = counts if counts is not None else np.zeros(len(BACKLOG_AGE_BINS) - 1, dtype=int)
+    buckets = [{'from_days': float(low), 'to_days': None if np.isinf(high) else float(high), 'count': int(count)}
+               for low, high, count in zip(BACKLOG_AGE_BINS[:-1], BACKLOG_AGE_BINS[1:], counts)]
+    return {'open': int(counts.sum()), 'buckets': buckets}
+
+
+def backlog_age_report(chunks, group_by: str = None, now: datetime = None):
+    # age in days of tickets that are still open
+    now = pd.Timestamp(now or datetime.now())
+    report = GroupedReport(group_by, age_histogram)
+    for frame in chunks:
+        report.tickets += frame.shape[0]
+        frame = frame[frame['closed'].isna() & (frame['state'] != 'closed')]
+        ages = (now - frame['created']).dt.total_seconds() / 86400
+        for group, group_ages in report.split(frame, ages):
+            counts, _ = np.histogram(group_ages.to_numpy(), bins=BACKLOG_AGE_BINS)
+            report.groups[group] = report.groups.get(group, 0) + counts
+    return report
+
+
+def first_response_report(chunks, group_by: str = None):
+    # minutes from creation to the first agent entry
+    report = PercentileReport(group_by)
+    for frame in chunks:
+        report.tickets += frame.shape[0]
+        frame = frame[frame['first_response'].notna()]
+        report.add(frame, (frame['first_response'] - frame['created']).dt.total_seconds() / 60)
+    return report
+
+
+def run_report(kind: str, start: datetime, end: datetime, group_by: str = None):
+    # runs in a worker process, so it reads through its own connection
+    with engine.connect() as connection:
+        if kind == 'first_response':
+            report = first_response_report(read_chunks(connection, first_response_query(start, end), TICKET_DATE_COLUMNS + ['first_response']), group_by)
+        else:
+            chunks = read_chunks(connection, ticket_report_query(start, end), TICKET_DATE_COLUMNS)
+            if kind == 'time_to_close':
+                report = time_to_close_report(chunks, group_by)
+            elif kind == 'sla_breach':
+                report = sla_breach_report(chunks, group_by)
+            elif kind == 'backlog_age':
+                report = backlog_age_report(chunks, group_by)
+            else:
+                raise ValueError(f'Unknown report {kind}')
+    return {'report': kind, 'start': start, 'end': end, 'group_by': group_by, 'tickets': int(report.tickets), 'data': report.result()}
+
+
+report_pool: ProcessPoolExecutor = None
+
+
+def get_report_pool():
+    global report_pool
+    if report_pool is None:
+        # spawned workers start clean instead of forking the server's threads, locks and open connections
+        report_pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'))
+    return report_pool
+
+
+async def generate_report(kind: str, start: datetime, end: datetime, group_by: str = None):
+    # the frames are built and reduced in a worker process so the event loop stays free
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_report_pool(), run_report, kind, start, end, group_by)
+
+
+def shutdown_report_pool():
+    global report_pool
+    if report_pool is not None:
+        report_pool.shutdown(wait=False, cancel_futures=True)
+        report_pool = None
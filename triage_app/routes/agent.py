@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
 from ..schemas import Agent, AgentCreate, AgentUpdate, AgentData, AgentSearch, Permission, AgentWithRole, AgentRegister, UnconfirmedAgent, EmailPost, PasswordPost
 from sqlalchemy.orm import Session
 from ..dependencies import get_db
-from ..crud import create_agent, delete_agent, update_agent, decode_agent, get_agent_by_filter, get_agents, get_permission, get_agents_by_name_search, get_settings, register_agent, confirm_agent, resend_agent_confirmation_email, send_agent_reset_password_email, agent_reset_password
+from ..crud import create_agent, delete_agent, update_agent, decode_agent, get_agent_by_filter, get_agents, get_permission, get_agents_by_name_search, get_settings, get_settings_snapshot, register_agent, confirm_agent, resend_agent_confirmation_email, send_agent_reset_password_email, agent_reset_password
 from fastapi.responses import JSONResponse
 from fastapi_pagination import Page
 from fastapi_pagination.ext.sqlalchemy import paginate
@@ -68,11 +68,11 @@ def get_agent_by_id(agent_id: int, db: Session = Depends(get_db), agent_data: Ag
         raise HTTPException(status_code=400, detail=f'No agent found with id {agent_id}')
     
     agent.new_attribute = 'default_preferences'
-    settings = db.query(models.Settings).filter(or_(models.Settings.key == 'default_ticket_queue', models.Settings.key == 'default_page_size')).all()
+    current_settings = get_settings_snapshot(db)
     
     temp_dict = {}
-    for setting in settings:
-        temp_dict[setting.key] = setting.value
+    for key in ['default_ticket_queue', 'default_page_size']:
+        temp_dict[key] = current_settings.get(key)
         
     agent_preferences = ast.literal_eval(agent.preferences)
     default_preferences = {**agent_preferences, **temp_dict}
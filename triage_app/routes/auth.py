@@ -2,7 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from typing import Annotated, Union
 from datetime import timedelta
-from ..crud import authenticate_agent, authenticate_user, authenticate_guest, create_token, refresh_token
+from ..crud import authenticate_agent_async, authenticate_user_async, authenticate_guest, create_token, refresh_token
 from ..dependencies import get_db
 from ..schemas import AgentToken, UserToken, GuestToken
 from sqlalchemy.orm import Session
@@ -11,15 +11,17 @@ router = APIRouter(prefix='/auth')
 
 security = HTTPBasic()
 
+# bcrypt is awaited on the event loop, so a burst of logins does not hold the threadpool
 @router.post("/login") 
-def agent_login(form_data: Annotated[HTTPBasicCredentials, Depends(security)], db: Session = Depends(get_db)) -> AgentToken:
+async def agent_login(form_data: Annotated[HTTPBasicCredentials, Depends(security)], db: Session = Depends(get_db)) -> AgentToken:
     
-    agent = authenticate_agent(db, form_data.username, form_data.password)
+    agent = await authenticate_agent_async(db, form_data.username, form_data.password)
     if not agent:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
     
-    access_data = {'agent_id': agent.agent_id, 'admin': agent.admin, 'type': 'access'}
-    refresh_data = {'agent_id': agent.agent_id, 'type': 'refresh'}
+    # ver ties the tokens to the agent's token_version, bumping it revokes them
+    access_data = {'agent_id': agent.agent_id, 'admin': agent.admin, 'type': 'access', 'ver': agent.token_version}
+    refresh_data = {'agent_id': agent.agent_id, 'type': 'refresh', 'ver': agent.token_version}
 
     access_token_expires = timedelta(minutes=1440) # 1 day
     refresh_token_expires = timedelta(minutes=1036800) # 30 days
@@ -29,9 +31,9 @@ def agent_login(form_data: Annotated[HTTPBasicCredentials, Depends(security)], d
     return AgentToken(token=access_token, refresh_token=refresh_token, agent_id=agent.agent_id, admin=agent.admin)
 
 @router.post("/login-user") 
-def user_login(form_data: Annotated[HTTPBasicCredentials, Depends(security)], db: Session = Depends(get_db)) -> UserToken:
+async def user_login(form_data: Annotated[HTTPBasicCredentials, Depends(security)], db: Session = Depends(get_db)) -> UserToken:
     
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
     
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from .. import schemas
+from ..crud import decode_agent
+from ..database import async_engine, engine, pool_stats
+from ..password_pool import bcrypt_pool
+
+router = APIRouter(prefix='/metrics')
+
+
+@router.get("/pool")
+def get_pool_metrics(agent_data: schemas.AgentData = Depends(decode_agent)):
+    if agent_data.admin != 1:
+        raise HTTPException(status_code=403, detail="Access denied: You do not have permission to access this resource")
+    metrics = {'sync': pool_stats(engine)}
+    if async_engine is not None:
+        metrics['async'] = pool_stats(async_engine)
+    return metrics
+
+
+@router.get("/bcrypt")
+def get_bcrypt_metrics(agent_data: schemas.AgentData = Depends(decode_agent)):
+    if agent_data.admin != 1:
+        raise HTTPException(status_code=403, detail="Access denied: You do not have permission to access this resource")
+    return bcrypt_pool.stats()
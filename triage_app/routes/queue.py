@@ -3,7 +3,7 @@ from .. import schemas
 from .. import models
 from sqlalchemy.orm import Session
 from ..dependencies import get_db
-from ..crud import create_queue, delete_queue, update_queue, decode_agent, get_queue_by_filter, get_queues_for_agent, decode_user, get_queues_for_user
+from ..crud import create_queue, delete_queue, update_queue, decode_agent, get_queue_by_filter, get_queues_for_agent, decode_user, get_queues_for_user, get_ticket_plan_stats, get_queue_counts
 from fastapi.responses import JSONResponse
 
 
@@ -25,10 +25,20 @@ def get_queue_by_id(queue_id: int, db: Session = Depends(get_db), agent_data: sc
 def get_all_queues(db: Session = Depends(get_db), agent_data: schemas.AgentData = Depends(decode_agent)):
     return get_queues_for_agent(db, agent_data.agent_id)
 
+@router.get("/counts", response_model=list[schemas.QueueCount])
+def get_all_queue_counts(db: Session = Depends(get_db), agent_data: schemas.AgentData = Depends(decode_agent)):
+    return get_queue_counts(db, agent_data.agent_id)
+
 @router.get("/get/user", response_model=list[schemas.Queue])
 def get_default_queues_for_user(db: Session = Depends(get_db), user_data: schemas.UserData = Depends(decode_user)):
     return get_queues_for_user(db)
 
+@router.get("/plan_cache")
+def get_queue_plan_cache_stats(agent_data: schemas.AgentData = Depends(decode_agent)):
+    if agent_data.admin != 1:
+        raise HTTPException(status_code=403, detail="Access denied: You do not have permission to access this resource")
+    return get_ticket_plan_stats()
+
 @router.put("/put/{queue_id}", response_model=schemas.Queue)
 def queue_update(queue_id: int, updates: schemas.QueueUpdate, db: Session = Depends(get_db), agent_data: schemas.AgentData = Depends(decode_agent)):
     queue = update_queue(db, queue_id, updates)
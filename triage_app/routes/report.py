@@ -0,0 +1,33 @@
+import traceback
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from ..crud import decode_agent
+from ..reports import GROUP_COLUMNS, generate_report
+from ..schemas import AgentData
+
+router = APIRouter(prefix='/report')
+
+REPORT_KINDS = ['time_to_close', 'sla_breach', 'backlog_age', 'first_response']
+
+
+@router.get("/{kind}")
+async def get_report(kind: str, start: str, end: str, group_by: str = None, agent_data: AgentData = Depends(decode_agent)):
+    if agent_data.admin != 1:
+        raise HTTPException(status_code=403, detail="Access denied: You do not have permission to access this resource")
+    if kind not in REPORT_KINDS:
+        raise HTTPException(status_code=400, detail=f'Unknown report {kind}')
+    if group_by is not None and group_by not in GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail=f'Cannot group reports by {group_by}')
+    try:
+        # same date format as the dashboard, end date inclusive
+        start_date = datetime.strptime(start, '%m-%d-%Y')
+        end_date = datetime.strptime(end, '%m-%d-%Y') + timedelta(days=1) - timedelta(microseconds=1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Dates must be formatted as mm-dd-yyyy')
+    try:
+        return await generate_report(kind, start_date, end_date, group_by)
+    except:
+        traceback.print_exc()
+        raise HTTPException(400, 'Error while generating report')
@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models, schemas
+from ..crud import decode_agent_async, get_settings_async, get_settings_by_filter_async
+from ..dependencies import get_async_db
+
+# settings reads on the async engine, included ahead of routes/settings.py
+router = APIRouter(prefix='/settings')
+
+
+@router.get("/key/{key}", response_model=schemas.Settings)
+async def get_settings_by_key_async(key: str, db: AsyncSession = Depends(get_async_db), agent_data: schemas.AgentData = Depends(decode_agent_async)):
+    setting = await get_settings_by_filter_async(db, filter={'key': key})
+    if not setting:
+        raise HTTPException(status_code=400, detail=f'No settings found with key {key}')
+    return setting
+
+
+@router.get('/default', response_model=list[schemas.Settings])
+async def get_default_system_settings_async(db: AsyncSession = Depends(get_async_db)):
+    default_settings_list = ['agent_max_file_size', 'default_ticket_queue', 'default_page_size']
+    return (await db.execute(select(models.Settings).where(models.Settings.key.in_(default_settings_list)))).scalars().all()
+
+
+@router.get("/get", response_model=list[schemas.Settings])
+async def get_all_settings_async(db: AsyncSession = Depends(get_async_db), agent_data: schemas.AgentData = Depends(decode_agent_async)):
+    if agent_data.admin != 1:
+        raise HTTPException(status_code=403, detail="Access denied: You do not have permission to access this resource")
+    return await get_settings_async(db)
+
+
+@router.get("/logo")
+async def get_company_logo_async(db: AsyncSession = Depends(get_async_db)):
+    try:
+        company_logo = await get_settings_by_filter_async(db, filter={'key': 'company_logo'})
+        return JSONResponse(status_code=200, content={'url': company_logo.value})
+    except:
+        return JSONResponse(status_code=400)
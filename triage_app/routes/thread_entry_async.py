@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas
+from ..crud import decode_agent_async, get_thread_entries_per_thread_async, get_thread_entry_by_filter_async
+from ..dependencies import get_async_db
+
+# thread entry reads on the async engine, included ahead of routes/thread_entry.py
+router = APIRouter(prefix='/thread_entry')
+
+
+@router.get("/id/{entry_id}", response_model=schemas.ThreadEntry)
+async def get_thread_entry_by_id_async(entry_id: int, db: AsyncSession = Depends(get_async_db), agent_data: schemas.AgentData = Depends(decode_agent_async)):
+    thread_entry = await get_thread_entry_by_filter_async(db, filter={'entry_id': entry_id})
+    if not thread_entry:
+        raise HTTPException(status_code=400, detail=f'No thread_entry found with id {entry_id}')
+    return thread_entry
+
+
+@router.get("/{thread_id}", response_model=list[schemas.ThreadEntry])
+async def get_all_thread_entries_per_thread_async(thread_id: int, db: AsyncSession = Depends(get_async_db), agent_data: schemas.AgentData = Depends(decode_agent_async)):
+    return await get_thread_entries_per_thread_async(db, thread_id)
@@ -1,4 +1,3 @@
-import json
 from datetime import datetime
 
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
@@ -10,15 +9,16 @@ from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from .. import models, schemas
-from ..crud import (create_ticket, decode_agent, decode_user, decode_guest, delete_ticket,
+from ..crud import (agent_page_size, bulk_update_tickets, create_ticket, decode_agent, decode_user, decode_guest, delete_ticket,
                     get_role, get_statistics_between_date,
                     get_ticket_between_date, get_ticket_by_advanced_search,
                     get_ticket_by_advanced_search_for_user,
-                    get_ticket_by_filter, get_ticket_by_queue, get_topics, update_ticket,
+                    get_ticket_by_filter, get_ticket_by_queue, get_ticket_plan,
+                    count_ticket_plan, get_topic_forms, paginate_ticket_cursor, resolve_queue, ticket_loader_options, update_ticket,
                     update_ticket_with_thread, get_user_by_filter, create_user,
                     update_ticket_with_thread_for_user, decode_guest)
 from ..dependencies import get_db
-from ..schemas import (AgentData, DashboardStats, DashboardTicket,
+from ..schemas import (AgentData, CursorPage, DashboardStats, DashboardTicket,
                        PageWithQueue, TicketCreate, TicketFilter, TicketJoined,
                        TicketJoinedSimple, TicketUpdate,
                        TicketUpdateWithThread, TopicForm, UserData, GuestData)
@@ -53,7 +53,7 @@ def ticket_create_for_guest(request: Request, background_task: BackgroundTasks,
 
 @router.get("/id/{ticket_id}", response_model=TicketJoined)
 def get_ticket_by_id(ticket_id: int, db: Session = Depends(get_db), agent_data: AgentData = Depends(decode_agent)):
-    ticket = get_ticket_by_filter(db, filter={'ticket_id': ticket_id})
+    ticket = get_ticket_by_filter(db, filter={'ticket_id': ticket_id}, profile='detail')
     if not ticket:
         raise HTTPException(
             status_code=400, detail=f'No ticket found with id {ticket_id}')
@@ -62,7 +62,7 @@ def get_ticket_by_id(ticket_id: int, db: Session = Depends(get_db), agent_data:
 
 @router.get("/user/id/{ticket_id}", response_model=schemas.TicketJoinedUser)
 def get_ticket_by_id_by_user(ticket_id: int, db: Session = Depends(get_db), user_data: UserData = Depends(decode_user)):
-    ticket = get_ticket_by_filter(db, filter={'ticket_id': ticket_id})
+    ticket = get_ticket_by_filter(db, filter={'ticket_id': ticket_id}, profile='detail')
     if not ticket:
         raise HTTPException(
             status_code=400, detail=f'No ticket found with id {ticket_id}')
@@ -74,7 +74,7 @@ def get_ticket_by_id_by_user(ticket_id: int, db: Session = Depends(get_db), user
 
 @router.get("/number/{number}", response_model=TicketJoined)
 def get_ticket_by_number(number: str, db: Session = Depends(get_db), agent_data: AgentData = Depends(decode_agent)):
-    ticket = get_ticket_by_filter(db, filter={'number': number})
+    ticket = get_ticket_by_filter(db, filter={'number': number}, profile='detail')
     if not ticket:
         raise HTTPException(
             status_code=400, detail=f'No ticket found with number {number}')
@@ -82,7 +82,7 @@ def get_ticket_by_number(number: str, db: Session = Depends(get_db), agent_data:
 
 @router.get("/guest/number/{number}", response_model=TicketJoined)
 def get_ticket_by_number_by_guest(number: str, db: Session = Depends(get_db), guest_data: GuestData = Depends(decode_guest)):
-    ticket = get_ticket_by_filter(db, filter={'number': number})
+    ticket = get_ticket_by_filter(db, filter={'number': number}, profile='detail')
     if not ticket:
         raise HTTPException(
             status_code=400, detail=f'No ticket found with number {number}')
@@ -94,7 +94,7 @@ def get_ticket_by_number_by_guest(number: str, db: Session = Depends(get_db), gu
 
 @router.get("/search", response_model=Page[TicketJoinedSimple])
 def get_ticket_by_search(ticket_filter: TicketFilter = FilterDepends(TicketFilter), db: Session = Depends(get_db), agent_data: AgentData = Depends(decode_agent)):
-    query = ticket_filter.filter(select(models.Ticket))
+    query = ticket_filter.filter(select(models.Ticket).options(*ticket_loader_options('list')))
     query = ticket_filter.sort(query)
     # print(resolve_params())
     return paginate(db, query)
@@ -102,25 +102,19 @@ def get_ticket_by_search(ticket_filter: TicketFilter = FilterDepends(TicketFilte
 
 @router.get("/queue/{queue_id}", response_model=PageWithQueue[TicketJoinedSimple])
 def get_ticket_queue(queue_id: int, search: str = '', page: int = None, size: int = None, db: Session = Depends(get_db), agent_data: AgentData = Depends(decode_agent)):
+    queue_id, size, plan = resolve_queue(db, agent_data, queue_id, size)
 
-    if size is None or queue_id == 0:
-        prefs = json.loads(db.query(models.Agent).filter(
-            models.Agent.agent_id == agent_data.agent_id).first().preferences)
-        if size is None:
-            size = prefs.get('agent_default_page_size', 10)
-        if queue_id == 0:
-            queue_id = prefs.get('agent_default_ticket_queue', None)
-            if queue_id == 0:
-                queue_id = db.query(models.Settings).filter(models.Settings.key == 'default_ticket_queue').first().value
-            
-    query = get_ticket_by_queue(db, agent_data.agent_id, queue_id, search)
+    params = Params(page=page or 1, size=size)
+    total, total_exact = count_ticket_plan(db, plan, search)
+    items = get_ticket_by_queue(db, agent_data.agent_id, queue_id, search) \
+        .offset((params.page - 1) * params.size).limit(params.size).all()
 
-    with set_params(Params(page=page, size=size)), set_page(Page[TicketJoinedSimple]):
-        output = paginate(db, query)
-        dump = output.dict()
-        dump['queue_id'] = queue_id
+    output = Page[TicketJoinedSimple].create(items, params, total=total)
+    dump = output.dict()
+    dump['queue_id'] = queue_id
+    dump['total_exact'] = total_exact
 
-        return PageWithQueue(**dump)
+    return PageWithQueue(**dump)
 
 
 @router.post("/adv_search", response_model=Page[TicketJoinedSimple])
@@ -129,16 +123,25 @@ def get_ticket_by_adv_search(adv_search: schemas.AdvancedFilter, search: str = '
     sorts = getattr(adv_search, 'sorts')
     query = get_ticket_by_advanced_search(
         db, agent_data.agent_id, filters, sorts, search)
-    
-    if size is None:
-        prefs = json.loads(db.query(models.Agent).filter(
-            models.Agent.agent_id == agent_data.agent_id).first().preferences)
-        size = prefs.get('agent_default_page_size', 10)
 
-    with set_params(Params(page=page, size=size)):
+    with set_params(Params(page=page, size=agent_page_size(agent_data, size))):
         return paginate(db, query)
 
 
+@router.get("/queue/{queue_id}/cursor", response_model=CursorPage[TicketJoinedSimple])
+def get_ticket_queue_by_cursor(queue_id: int, search: str = '', cursor: str = None, size: int = None, with_total: bool = False, db: Session = Depends(get_db), agent_data: AgentData = Depends(decode_agent)):
+    queue_id, size, plan = resolve_queue(db, agent_data, queue_id, size)
+    page = paginate_ticket_cursor(db, plan, search, cursor, size, with_total)
+    # the response model validates the loaded tickets from their attributes
+    return {**page, 'queue_id': queue_id}
+
+
+@router.post("/adv_search/cursor", response_model=CursorPage[TicketJoinedSimple])
+def get_ticket_by_adv_search_cursor(adv_search: schemas.AdvancedFilter, search: str = '', cursor: str = None, size: int = None, with_total: bool = False, db: Session = Depends(get_db), agent_data: AgentData = Depends(decode_agent)):
+    plan = get_ticket_plan(db, agent_data.agent_id, adv_search.filters, adv_search.sorts)
+    return paginate_ticket_cursor(db, plan, search, cursor, agent_page_size(agent_data, size), with_total)
+
+
 @router.post("/adv_search/user", response_model=Page[schemas.TicketJoinedSimpleUser])
 def get_ticket_by_adv_search(adv_search: schemas.AdvancedFilter, db: Session = Depends(get_db), user_data: UserData = Depends(decode_user)):
     filters = getattr(adv_search, 'filters')
@@ -149,8 +152,8 @@ def get_ticket_by_adv_search(adv_search: schemas.AdvancedFilter, db: Session = D
 
 
 @router.get("/form", response_model=list[TopicForm])
-def get_ticket_form(db: Session = Depends(get_db)):
-    return get_topics(db)
+def get_ticket_form():
+    return get_topic_forms()
 
 
 @router.put("/put/{ticket_id}", response_model=TicketJoined)
@@ -180,6 +183,14 @@ def ticket_update_with_thread(background_task: BackgroundTasks, ticket_id: int,
     return ticket
 
 
+@router.put("/bulk_update", response_model=schemas.TicketBulkUpdateResult)
+def ticket_bulk_update(bulk: schemas.TicketBulkUpdate, db: Session = Depends(get_db), agent_data: AgentData = Depends(decode_agent)):
+    if not get_role(db=db, agent_id=agent_data.agent_id, role='ticket.edit'):
+        raise HTTPException(
+            status_code=403, detail="Access denied: You do not have permission to access this resource")
+    return bulk_update_tickets(db, bulk.ticket_ids, bulk.updates, agent_data.agent_id)
+
+
 @router.put("/user/update/{ticket_id}", response_model=schemas.TicketJoinedUser)
 def ticket_update_with_thread_for_user(background_task: BackgroundTasks, ticket_id: int, updates: schemas.TicketUpdateWithThreadUser, db: Session = Depends(get_db), user_data: UserData = Depends(decode_user)):
     ticket = update_ticket_with_thread_for_user(
@@ -0,0 +1,106 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi_filter import FilterDepends
+from fastapi_pagination import Page, Params, set_params
+from fastapi_pagination.ext.sqlalchemy import paginate
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models, schemas
+from ..crud import (agent_page_size, count_ticket_plan_async, decode_agent_async, decode_guest_async,
+                    decode_user_async, get_ticket_by_advanced_search_async, get_ticket_by_filter_async,
+                    get_ticket_page_async, get_ticket_plan_async, paginate_ticket_cursor_async,
+                    resolve_queue, ticket_loader_options)
+from ..dependencies import get_async_db
+from ..schemas import (AgentData, CursorPage, GuestData, PageWithQueue, TicketFilter, TicketJoined,
+                       TicketJoinedSimple, UserData)
+
+# the hot ticket reads on the async engine, included ahead of routes/ticket.py so these win
+router = APIRouter(prefix='/ticket')
+
+
+@router.get("/id/{ticket_id}", response_model=TicketJoined)
+async def get_ticket_by_id_async(ticket_id: int, db: AsyncSession = Depends(get_async_db), agent_data: AgentData = Depends(decode_agent_async)):
+    ticket = await get_ticket_by_filter_async(db, filter={'ticket_id': ticket_id}, profile='detail')
+    if not ticket:
+        raise HTTPException(
+            status_code=400, detail=f'No ticket found with id {ticket_id}')
+    return ticket
+
+
+@router.get("/user/id/{ticket_id}", response_model=schemas.TicketJoinedUser)
+async def get_ticket_by_id_by_user_async(ticket_id: int, db: AsyncSession = Depends(get_async_db), user_data: UserData = Depends(decode_user_async)):
+    ticket = await get_ticket_by_filter_async(db, filter={'ticket_id': ticket_id}, profile='detail')
+    if not ticket:
+        raise HTTPException(
+            status_code=400, detail=f'No ticket found with id {ticket_id}')
+    if ticket.user_id != user_data.user_id:
+        raise HTTPException(
+            status_code=400, detail=f'Not accessible for this user')
+    return ticket
+
+
+@router.get("/number/{number}", response_model=TicketJoined)
+async def get_ticket_by_number_async(number: str, db: AsyncSession = Depends(get_async_db), agent_data: AgentData = Depends(decode_agent_async)):
+    ticket = await get_ticket_by_filter_async(db, filter={'number': number}, profile='detail')
+    if not ticket:
+        raise HTTPException(
+            status_code=400, detail=f'No ticket found with number {number}')
+    return ticket
+
+
+@router.get("/guest/number/{number}", response_model=TicketJoined)
+async def get_ticket_by_number_by_guest_async(number: str, db: AsyncSession = Depends(get_async_db), guest_data: GuestData = Depends(decode_guest_async)):
+    ticket = await get_ticket_by_filter_async(db, filter={'number': number}, profile='detail')
+    if not ticket:
+        raise HTTPException(
+            status_code=400, detail=f'No ticket found with number {number}')
+    if ticket.user_id != guest_data.user_id:
+        raise HTTPException(
+            status_code=400, detail=f'Not accessible for this user')
+    return ticket
+
+
+@router.get("/search", response_model=Page[TicketJoinedSimple])
+async def get_ticket_by_search_async(ticket_filter: TicketFilter = FilterDepends(TicketFilter), db: AsyncSession = Depends(get_async_db), agent_data: AgentData = Depends(decode_agent_async)):
+    query = ticket_filter.filter(select(models.Ticket).options(*ticket_loader_options('list')))
+    query = ticket_filter.sort(query)
+    return await paginate(db, query)
+
+
+@router.get("/queue/{queue_id}", response_model=PageWithQueue[TicketJoinedSimple])
+async def get_ticket_queue_async(queue_id: int, search: str = '', page: int = None, size: int = None, db: AsyncSession = Depends(get_async_db), agent_data: AgentData = Depends(decode_agent_async)):
+    queue_id, size, plan = await db.run_sync(resolve_queue, agent_data, queue_id, size)
+
+    params = Params(page=page or 1, size=size)
+    total, total_exact = await count_ticket_plan_async(db, plan, search)
+    items = await get_ticket_page_async(db, plan, search, params.page, params.size)
+
+    output = Page[TicketJoinedSimple].create(items, params, total=total)
+    dump = output.dict()
+    dump['queue_id'] = queue_id
+    dump['total_exact'] = total_exact
+
+    return PageWithQueue(**dump)
+
+
+@router.post("/adv_search", response_model=Page[TicketJoinedSimple])
+async def get_ticket_by_adv_search_async(adv_search: schemas.AdvancedFilter, search: str = '', page: int = None, size: int = None, db: AsyncSession = Depends(get_async_db), agent_data: AgentData = Depends(decode_agent_async)):
+    query = await get_ticket_by_advanced_search_async(
+        db, agent_data.agent_id, adv_search.filters, adv_search.sorts, search)
+
+    with set_params(Params(page=page, size=agent_page_size(agent_data, size))):
+        return await paginate(db, query)
+
+
+@router.get("/queue/{queue_id}/cursor", response_model=CursorPage[TicketJoinedSimple])
+async def get_ticket_queue_by_cursor_async(queue_id: int, search: str = '', cursor: str = None, size: int = None, with_total: bool = False, db: AsyncSession = Depends(get_async_db), agent_data: AgentData = Depends(decode_agent_async)):
+    queue_id, size, plan = await db.run_sync(resolve_queue, agent_data, queue_id, size)
+    page = await paginate_ticket_cursor_async(db, plan, search, cursor, size, with_total)
+    # the response model validates the loaded tickets from their attributes
+    return {**page, 'queue_id': queue_id}
+
+
+@router.post("/adv_search/cursor", response_model=CursorPage[TicketJoinedSimple])
+async def get_ticket_by_adv_search_cursor_async(adv_search: schemas.AdvancedFilter, search: str = '', cursor: str = None, size: int = None, with_total: bool = False, db: AsyncSession = Depends(get_async_db), agent_data: AgentData = Depends(decode_agent_async)):
+    plan = await get_ticket_plan_async(db, agent_data.agent_id, adv_search.filters, adv_search.sorts)
+    return await paginate_ticket_cursor_async(db, plan, search, cursor, agent_page_size(agent_data, size), with_total)
@@ -1,14 +1,23 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore import client
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import traceback
 
 
 class S3Manager:
-    def __init__(self, aws_access_key_id: str, aws_secret_access_key: str, region_name: str):
+    def __init__(self, aws_access_key_id: str, aws_secret_access_key: str, region_name: str,
+                 max_uploads: int = 4, multipart_threshold: int = 8 * 1024 * 1024):
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
         self.region_name = region_name
         self._client = None
+        # uploads above the threshold go up in parallel parts, smaller ones in a single put
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold, multipart_chunksize=multipart_threshold)
+        self.max_uploads = max_uploads
+        self._executor = None
+        self._lock = threading.Lock()
 
     def get_client(self):
         if not self.aws_access_key_id or not self.aws_secret_access_key or not self.region_name:
@@ -26,3 +35,28 @@ class S3Manager:
         self.aws_secret_access_key = aws_secret_access_key
         self.region_name = region_name
         self._client = None  # Force reinitialization on the next get_client call
+
+    def upload_fileobj(self, fileobj, bucket_name: str, key: str, extra_args: dict = None):
+        # queues an upload on the bounded upload pool and returns its future
+        s3_client = self.get_client()
+        if s3_client is None:
+            raise RuntimeError('S3 is not configured')
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_uploads, thread_name_prefix='s3-upload')
+            executor = self._executor
+        return executor.submit(s3_client.upload_fileobj, fileobj, bucket_name, key, ExtraArgs=extra_args, Config=self.transfer_config)
+
+    def delete_objects(self, bucket_name: str, keys: list):
+        # removes uploaded objects nothing refers to anymore, at most 1000 keys per request
+        s3_client = self.get_client()
+        if s3_client is None:
+            raise RuntimeError('S3 is not configured')
+        for i in range(0, len(keys), 1000):
+            s3_client.delete_objects(Bucket=bucket_name, Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True})
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -1,5 +1,5 @@
 from datetime import date, datetime, time
-from typing import Any, List, Optional
+from typing import Any, Generic, List, Optional, TypeVar
 
 from fastapi_filter.contrib.sqlalchemy import Filter
 from fastapi_pagination import Page
@@ -169,9 +169,22 @@ class GuestToken(BaseModel):
 
 # Decoded Token Data Schema
 
+# what routes need to authorize and personalize a request, cached per agent
+class AgentPrincipal(BaseModel):
+    agent_id: int
+    role_id: int | None = None
+    dept_id: int | None = None
+    timezone: str | None = None
+    preferences: dict = {}
+    permissions: frozenset[str] = frozenset()
+    role_permissions: frozenset[str] = frozenset()
+    token_version: int = 0
+
+
 class AgentData(BaseModel):
     agent_id: int
     admin: int
+    principal: AgentPrincipal | None = None
 
 
 class UserData(BaseModel):
@@ -762,6 +775,14 @@ class TicketUpdate(TicketBase, OptionalModel):
 class TicketUpdateWithThread(TicketUpdate):
     form_values: list[FormValueUpdateForm] | None = None
 
+class TicketBulkUpdate(BaseModel):
+    ticket_ids: list[int]
+    updates: TicketUpdate
+
+class TicketBulkUpdateResult(BaseModel):
+    updated: list[int]
+    unchanged: list[int]
+
 class TicketUpdateWithThreadUser(BaseModel):
     title: str
     description: str
@@ -1132,4 +1153,21 @@ class EmailSource(EmailSourceBase):
     updated: datetime
     created: datetime
 class PageWithQueue(Page):
-    queue_id: int
\ No newline at end of file
+    queue_id: int
+    # False when total was served from the short lived count cache
+    total_exact: bool = True
+
+class QueueCount(BaseModel):
+    queue_id: int
+    count: int
+    exact: bool
+
+T = TypeVar('T')
+
+# keyset page, next_cursor is passed back as cursor to fetch the following page
+class CursorPage(BaseModel, Generic[T]):
+    items: list[T]
+    size: int
+    next_cursor: str | None = None
+    total: int | None = None
+    queue_id: int | None = None
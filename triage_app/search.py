@@ -0,0 +1,300 @@
+# full text search over tickets and users, kept in side tables next to the main schema:
+# fts5 virtual tables on sqlite, tsvector columns with a gin index on postgres.
+# any other database has no backend and searches fall back to ILIKE
+
+import re
+from abc import ABC, abstractmethod
+
+from bs4 import BeautifulSoup
+from sqlalchemy import Float, Integer, Text, cast, column, delete, func, insert, literal_column, or_, select, table, text
+from sqlalchemy.dialects.postgresql import REGCONFIG, TSVECTOR
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal, engine
+
+# tickets and users indexed per round trip when the index is rebuilt
+SEARCH_BATCH_SIZE = 500
+SEARCH_TABLES = ('ticket_search', 'user_search')
+
+
+def search_terms(query: str):
+    # words only, so user input never reaches the match syntax
+    return re.findall(r'\w+', query or '')
+
+
+def strip_html(body: str):
+    if not body:
+        return ''
+    return BeautifulSoup(body, 'html.parser').get_text(' ', strip=True)
+
+
+def email_words(email: str):
+    # the address as written plus its parts, so 'acme' finds jane@acme.com
+    return f"{email} {re.sub(r'[^A-Za-z0-9]+', ' ', email)}" if email else ''
+
+
+def ticket_documents(db: Session, ticket_ids: list):
+    # ticket_id -> (number, title, description, thread entry subjects and bodies)
+    tickets = db.query(models.Ticket.ticket_id, models.Ticket.number, models.Ticket.title, models.Ticket.description) \
+        .filter(models.Ticket.ticket_id.in_(ticket_ids)).all()
+    entries = {ticket_id: [] for ticket_id, *_ in tickets}
+    rows = db.query(models.Thread.ticket_id, models.ThreadEntry.subject, models.ThreadEntry.body) \
+        .join(models.ThreadEntry, models.ThreadEntry.thread_id == models.Thread.thread_id) \
+        .filter(models.Thread.ticket_id.in_(ticket_ids)).order_by(models.ThreadEntry.entry_id).all()
+    for ticket_id, subject, body in rows:
+        entries[ticket_id] += [subject or '', strip_html(body)]
+    return {ticket_id: (number or '', title or '', strip_html(description), ' '.join(entries[ticket_id]).strip())
+            for ticket_id, number, title, description in tickets}
+
+
+def user_documents(db: Session, user_ids: list):
+    # user_id -> (name, email)
+    users = db.query(models.User.user_id, models.User.firstname, models.User.lastname, models.User.email) \
+        .filter(models.User.user_id.in_(user_ids)).all()
+    return {user_id: (f'{firstname or ""} {lastname or ""}'.strip(), email_words(email))
+            for user_id, firstname, lastname, email in users}
+
+
+class SearchBackend(ABC):
+    # ticket_table and user_table are keyed by ticket_id and user_id, rows are replaced wholesale
+    ticket_table = None
+    user_table = None
+
+    @abstractmethod
+    def create_schema(self, connection):
+        ...
+
+    def drop_schema(self, connection):
+        for name in SEARCH_TABLES:
+            connection.execute(text(f'DROP TABLE IF EXISTS {name}'))
+
+    @abstractmethod
+    def ticket_row(self, ticket_id: int, document: tuple):
+        ...
+
+    @abstractmethod
+    def user_row(self, user_id: int, document: tuple):
+        ...
+
+    @abstractmethod
+    def ticket_key(self):
+        ...
+
+    @abstractmethod
+    def user_key(self):
+        ...
+
+    def write(self, db: Session, search_table, key, rows: list, ids: list):
+        db.execute(delete(search_table).where(key.in_(ids)))
+        if rows:
+            db.execute(insert(search_table), rows)
+
+    def index_tickets(self, db: Session, ticket_ids: list):
+        documents = ticket_documents(db, ticket_ids)
+        rows = [self.ticket_row(ticket_id, document) for ticket_id, document in documents.items()]
+        self.write(db, self.ticket_table, self.ticket_key(), rows, ticket_ids)
+
+    def index_users(self, db: Session, user_ids: list):
+        documents = user_documents(db, user_ids)
+        rows = [self.user_row(user_id, document) for user_id, document in documents.items()]
+        self.write(db, self.user_table, self.user_key(), rows, user_ids)
+
+    @abstractmethod
+    def match_tickets(self, terms: list):
+        # select of (ticket_id, rank) for tickets matching every term, higher rank is better
+        ...
+
+    @abstractmethod
+    def match_users(self, terms: list):
+        ...
+
+
+class SQLiteSearch(SearchBackend):
+    # the fts5 rowid is the ticket or user id
+    ticket_table = table('ticket_search', column('rowid', Integer), column('number', Text), column('title', Text),
+                         column('description', Text), column('entries', Text))
+    user_table = table('user_search', column('rowid', Integer), column('name', Text), column('email', Text))
+    # bm25 column weights: number, title, description, entries
+    ticket_weights = (10.0, 8.0, 2.0, 1.0)
+    user_weights = (4.0, 2.0)
+
+    def create_schema(self, connection):
+        tokenize = "tokenize = 'unicode61 remove_diacritics 2'"
+        connection.execute(text(f'CREATE VIRTUAL TABLE IF NOT EXISTS ticket_search USING fts5(number, title, description, entries, {tokenize})'))
+        connection.execute(text(f'CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(name, email, {tokenize})'))
+
+    def ticket_row(self, ticket_id: int, document: tuple):
+        return dict(zip(('rowid', 'number', 'title', 'description', 'entries'), (ticket_id, *document)))
+
+    def user_row(self, user_id: int, document: tuple):
+        return dict(zip(('rowid', 'name', 'email'), (user_id, *document)))
+
+    def ticket_key(self):
+        return self.ticket_table.c.rowid
+
+    def user_key(self):
+        return self.user_table.c.rowid
+
+    def match_query(self, terms: list):
+        # every term as a quoted prefix, so 'prin' finds printer
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def match(self, search_table, weights: tuple, terms: list):
+        name = literal_column(search_table.name)
+        rank = (-func.bm25(name, *weights, type_=Float)).label('rank')
+        return select(search_table.c.rowid, rank).where(name.op('MATCH')(self.match_query(terms)))
+
+    def match_tickets(self, terms: list):
+        return self.match(self.ticket_table, self.ticket_weights, terms)
+
+    def match_users(self, terms: list):
+        return self.match(self.user_table, self.user_weights, terms)
+
+
+class PostgresSearch(SearchBackend):
+    ticket_table = table('ticket_search', column('ticket_id', Integer), column('document', TSVECTOR))
+    user_table = table('user_search', column('user_id', Integer), column('document', TSVECTOR))
+    # no stemming, ticket text is mixed language and full of product names
+    config = cast('simple', REGCONFIG)
+
+    def create_schema(self, connection):
+        connection.execute(text('CREATE TABLE IF NOT EXISTS ticket_search (ticket_id INTEGER PRIMARY KEY '
+                                'REFERENCES tickets (ticket_id) ON DELETE CASCADE, document TSVECTOR NOT NULL)'))
+        connection.execute(text('CREATE INDEX IF NOT EXISTS ix_ticket_search_document ON ticket_search USING gin (document)'))
+        connection.execute(text('CREATE TABLE IF NOT EXISTS user_search (user_id INTEGER PRIMARY KEY '
+                                'REFERENCES users (user_id) ON DELETE CASCADE, document TSVECTOR NOT NULL)'))
+        connection.execute(text('CREATE INDEX IF NOT EXISTS ix_user_search_document ON user_search USING gin (document)'))
+
+    def vector(self, parts: list):
+        # parts are (text, weight), weight A ranks above D
+        vectors = [func.setweight(func.to_tsvector(self.config, value), weight) for value, weight in parts]
+        document = vectors[0]
+        for vector in vectors[1:]:
+            document = document.op('||')(vector)
+        return document
+
+    def ticket_row(self, ticket_id: int, document: tuple):
+        number, title, description, entries = document
+        return {'ticket_id': ticket_id, 'document': self.vector([(number, 'A'), (title, 'A'), (description, 'B'), (entries, 'C')])}
+
+    def user_row(self, user_id: int, document: tuple):
+        name, email = document
+        return {'user_id': user_id, 'document': self.vector([(name, 'A'), (email, 'B')])}
+
+    def write(self, db: Session, search_table, key, rows: list, ids: list):
+        # the documents are sql expressions, so they go in one values list instead of executemany
+        db.execute(delete(search_table).where(key.in_(ids)))
+        if rows:
+            db.execute(insert(search_table).values(rows))
+
+    def ticket_key(self):
+        return self.ticket_table.c.ticket_id
+
+    def user_key(self):
+        return self.user_table.c.user_id
+
+    def match(self, search_table, key, terms: list):
+        query = func.to_tsquery(self.config, ' & '.join(f'{term}:*' for term in terms))
+        rank = func.ts_rank(search_table.c.document, query, type_=Float).label('rank')
+        return select(key, rank).where(search_table.c.document.op('@@')(query))
+
+    def match_tickets(self, terms: list):
+        return self.match(self.ticket_table, self.ticket_key(), terms)
+
+    def match_users(self, terms: list):
+        return self.match(self.user_table, self.user_key(), terms)
+
+
+SEARCH_BACKENDS = {'sqlite': SQLiteSearch, 'postgresql': PostgresSearch}
+
+
+def backend_for(bind=None):
+    backend = SEARCH_BACKENDS.get((bind or engine).dialect.name)
+    return backend() if backend else None
+
+
+search_backend = backend_for()
+
+
+# kept in sync by the crud writes, within the same transaction as the change
+
+def index_tickets(db: Session, ticket_ids: list):
+    if search_backend and ticket_ids:
+        search_backend.index_tickets(db, list(ticket_ids))
+
+
+def index_users(db: Session, user_ids: list):
+    if search_backend and user_ids:
+        search_backend.index_users(db, list(user_ids))
+
+
+def ticket_search_filter(query: str):
+    terms = search_terms(query)
+    if search_backend is None:
+        return (models.Ticket.number + models.Ticket.title).ilike(f'%{query}%')
+    # the index only matches word prefixes, a number is still found from any part of it ('0042' finds TK-00042)
+    number_match = models.Ticket.number.ilike(f'%{query.strip()}%') if query and query.strip() else None
+    if not terms:
+        return number_match if number_match is not None else models.Ticket.ticket_id.is_(None)
+    matches = search_backend.match_tickets(terms).subquery()
+    if number_match is None:
+        return models.Ticket.ticket_id.in_(select(matches.c[0]))
+    return or_(models.Ticket.ticket_id.in_(select(matches.c[0])), number_match)
+
+
+def ticket_search_rank(query: str):
+    # correlated per ticket so it can be used as a sort key, None without a backend
+    terms = search_terms(query)
+    if search_backend is None or not terms:
+        return None
+    matches = search_backend.match_tickets(terms)
+    key = matches.selected_columns[0]
+    return matches.with_only_columns(matches.selected_columns.rank).where(key == models.Ticket.ticket_id) \
+        .correlate(models.Ticket).scalar_subquery().label('search_rank')
+
+
+def user_search_filter(query: str):
+    full_name = models.User.firstname + ' ' + models.User.lastname + ' ' + models.User.email
+    terms = search_terms(query)
+    if search_backend is None:
+        return full_name.ilike(f'%{query}%')
+    if not terms:
+        return models.User.user_id.is_(None)
+    matches = search_backend.match_users(terms).subquery()
+    return models.User.user_id.in_(select(matches.c[0]))
+
+
+def create_search_schema(connection):
+    backend = backend_for(connection)
+    if backend:
+        backend.create_schema(connection)
+
+
+def rebuild_search_index(db: Session = None, only_if_empty: bool = False):
+    # only_if_empty fills the tables a migration just created and leaves an existing index alone
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        backend = backend_for(db.get_bind())
+        if backend is None:
+            return
+        for key, index, search_key in ((models.Ticket.ticket_id, backend.index_tickets, backend.ticket_key()),
+                                       (models.User.user_id, backend.index_users, backend.user_key())):
+            if only_if_empty and db.execute(select(search_key).limit(1)).first():
+                continue
+            last_id = 0
+            while True:
+                ids = [row[0] for row in db.query(key).filter(key > last_id).order_by(key).limit(SEARCH_BATCH_SIZE).all()]
+                if not ids:
+                    break
+                index(db, ids)
+                last_id = ids[-1]
+        db.commit()
+    except:
+        db.rollback()
+        raise
+    finally:
+        if own_session:
+            db.close()
@@ -0,0 +1,113 @@
+import smtplib
+import threading
+import time
+
+
+class SMTPPool:
+    # authenticated smtp sessions kept open per models.Email.email_id so a burst of mail
+    # pays for STARTTLS and AUTH once per account instead of once per message
+
+    def __init__(self, port: int = 587, max_idle_per_account: int = 2, idle_timeout: float = 300,
+                 keepalive_interval: float = 60, timeout: float = 30):
+        self.port = port
+        self.max_idle_per_account = max_idle_per_account
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout
+        # email_id -> list of (server, credentials, last_used)
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, host: str, username: str, password: str):
+        server = smtplib.SMTP(host, self.port, timeout=self.timeout)
+        server.ehlo()
+        server.starttls()
+        server.ehlo()
+        server.login(username, password)
+        return server
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except:
+            try:
+                server.close()
+            except:
+                pass
+
+    def _checkout(self, email_id: int, credentials: tuple):
+        while True:
+            with self._lock:
+                idle = self._idle.get(email_id)
+                if not idle:
+                    return None
+                server, server_credentials, last_used = idle.pop()
+            idle_for = time.monotonic() - last_used
+            if server_credentials != credentials or idle_for > self.idle_timeout:
+                self._close(server)
+                continue
+            if idle_for > self.keepalive_interval:
+                # make sure the server has not dropped a session that sat unused for a while
+                try:
+                    if server.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected()
+                except:
+                    self._close(server)
+                    continue
+            return server
+
+    def _checkin(self, email_id: int, credentials: tuple, server):
+        with self._lock:
+            idle = self._idle.setdefault(email_id, [])
+            if len(idle) < self.max_idle_per_account:
+                idle.append((server, credentials, time.monotonic()))
+                return
+        self._close(server)
+
+    def send_message(self, email_id: int, host: str, username: str, password: str, message):
+        credentials = (host, username, password)
+        server = self._checkout(email_id, credentials)
+        if server is not None:
+            # a pooled session can be dropped at any time, find out before any of the message is sent
+            try:
+                if server.rset()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected()
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._close(server)
+                server = None
+        if server is None:
+            server = self._connect(host, username, password)
+        try:
+            server.send_message(message)
+        except:
+            # never resent from here, the server may already have accepted the message
+            self._close(server)
+            raise
+        self._checkin(email_id, credentials, server)
+
+    def invalidate(self, email_id: int):
+        # called when an account's credentials change or it is deleted
+        with self._lock:
+            idle = self._idle.pop(email_id, [])
+        for server, _, _ in idle:
+            self._close(server)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for email_id, idle in self._idle.items():
+                expired += [entry for entry in idle if now - entry[2] > self.idle_timeout]
+                idle[:] = [entry for entry in idle if now - entry[2] <= self.idle_timeout]
+        for server, _, _ in expired:
+            self._close(server)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for entries in idle.values():
+            for server, _, _ in entries:
+                self._close(server)
+
+
+smtp_pool = SMTPPool()